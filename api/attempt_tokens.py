@@ -0,0 +1,97 @@
+"""
+Signed attempt tokens.
+
+When a student loads a test, read_test samples `questions_to_show` questions and
+issues a token recording exactly which ones (plus the snapshot version they came
+from). submit_test verifies the token and scores only those questions, so a large
+bank doesn't inflate `unanswered` and scoring is O(questions shown).
+
+Token format: base64url(JSON payload) "." base64url(HMAC-SHA256(payload)). The secret
+is ATTEMPT_TOKEN_SECRET, falling back to a hash of the Firebase credentials the app
+loaded (FIREBASE_CREDENTIALS or the local firebase_credentials.json) so every
+instance of a deployment agrees without extra configuration. With neither available,
+issuing or verifying a token raises SecretNotConfigured (the API answers 503) unless
+ATTEMPT_TOKEN_DEV=1 allows a fixed development secret; the rest of the app still runs.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from functools import lru_cache
+from typing import List, Optional
+
+# Time allowed past the test duration before a token stops being accepted
+GRACE_SECONDS = 60 * 60
+
+
+class SecretNotConfigured(RuntimeError):
+    pass
+
+
+class InvalidToken(Exception):
+    pass
+
+
+@lru_cache(maxsize=1)
+def _secret() -> bytes:
+    secret = os.environ.get("ATTEMPT_TOKEN_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    creds = os.environ.get("FIREBASE_CREDENTIALS")
+    if not creds:
+        try:
+            from firebase_config import loaded_credentials
+            creds = loaded_credentials()
+        except Exception:
+            creds = None
+    if creds:
+        return hashlib.sha256(b"attempt-tokens:" + creds.encode("utf-8")).digest()
+    if os.environ.get("ATTEMPT_TOKEN_DEV", "").lower() in ("1", "true", "yes"):
+        print("WARNING: ATTEMPT_TOKEN_SECRET not set. Using an insecure development secret (ATTEMPT_TOKEN_DEV).")
+        return b"linear-academy-dev-attempt-tokens"
+    # A well-known secret would let anyone forge tokens and pick their own questions
+    raise SecretNotConfigured("Set ATTEMPT_TOKEN_SECRET (or Firebase credentials), or ATTEMPT_TOKEN_DEV=1 for local development")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_secret(), body.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue(test_id: int, version: Optional[int], question_ids: List[int], duration_minutes: int = 0) -> str:
+    payload = {
+        "t": test_id,
+        "v": version,
+        "q": list(question_ids),
+        "exp": int(time.time()) + (duration_minutes or 0) * 60 + GRACE_SECONDS,
+    }
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return f"{body}.{_sign(body)}"
+
+
+def verify(token: str, test_id: int) -> dict:
+    """{"test_id", "version", "question_ids"} from a valid token; raises InvalidToken otherwise"""
+    try:
+        body, signature = token.split(".", 1)
+    except (AttributeError, ValueError):
+        raise InvalidToken("Malformed attempt token")
+    if not hmac.compare_digest(signature, _sign(body)):
+        raise InvalidToken("Attempt token signature mismatch")
+    try:
+        payload = json.loads(_unb64(body))
+    except ValueError:
+        raise InvalidToken("Malformed attempt token")
+    if payload.get("t") != test_id:
+        raise InvalidToken("Attempt token is for a different test")
+    if payload.get("exp", 0) < time.time():
+        raise InvalidToken("Attempt token has expired")
+    return {"test_id": payload["t"], "version": payload.get("v"), "question_ids": payload.get("q") or []}
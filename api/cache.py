@@ -0,0 +1,187 @@
+"""
+In-process response cache.
+
+A thread-safe LRU bounded by the approximate serialized size of its values, with a
+TTL per key. get_or_load() is single-flight: when many requests miss the same key at
+once, one of them runs the loader and the rest wait for its result instead of all
+hitting Firestore (cache stampede).
+
+pin() exempts a key from eviction and expiry until a wall-clock time, for entries
+that must stay warm through a known busy window (see exam_schedule.py). Pinned
+entries can still be replaced or deleted, and clear(keep_pinned=True) leaves them.
+"""
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 300  # seconds
+
+_MISSING = object()
+
+
+def estimate_size(value) -> int:
+    """Rough size in bytes: the JSON encoding, which is what these values end up as anyway"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class _Flight:
+    """A load in progress that other callers for the same key can wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, default_ttl: float = DEFAULT_TTL,
+                 sizeof: Callable[[Any], int] = estimate_size):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._flights: Dict[str, _Flight] = {}
+        self._pins: Dict[str, float] = {}  # key -> pinned until (time.time())
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _pinned(self, key) -> bool:
+        """Caller holds the lock"""
+        until = self._pins.get(key)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self._pins[key]
+            return False
+        return True
+
+    def _lookup(self, key):
+        """Caller holds the lock. Returns the value or _MISSING and updates counters."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if time.monotonic() < expires_at or self._pinned(key):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._drop(key)
+            self.expirations += 1
+        self.misses += 1
+        return _MISSING
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value, ttl: float = None):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return  # would evict everything else and still not fit
+            ttl = self.default_ttl if ttl is None else ttl
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                victim = next((k for k in self._entries if not self._pinned(k)), None)
+                if victim is None:
+                    break  # only pinned entries left; they may overshoot until unpinned
+                self._drop(victim)
+                self.evictions += 1
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: float = None):
+        """Return the cached value, or run loader() once for all concurrent callers and cache it"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value, ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def pin(self, key: str, until: float):
+        """Keep key (once set) from being evicted or expiring before `until` (a time.time())"""
+        with self._lock:
+            self._pins[key] = max(until, self._pins.get(key, 0))
+
+    def unpin(self, key: str):
+        with self._lock:
+            self._pins.pop(key, None)
+
+    def pinned(self) -> Dict[str, float]:
+        with self._lock:
+            return {key: until for key, until in list(self._pins.items()) if self._pinned(key)}
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._drop(key)
+
+    def clear(self, keep_pinned: bool = False):
+        """Drop every entry, or with keep_pinned every entry that isn't currently pinned"""
+        with self._lock:
+            if keep_pinned:
+                for key in [k for k in self._entries if not self._pinned(k)]:
+                    self._drop(key)
+                return
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "coalesced_loads": self.coalesced,
+                "pinned": sum(1 for key in list(self._pins) if self._pinned(key)),
+            }
@@ -0,0 +1,128 @@
+"""
+Cross-instance cache invalidation.
+
+Every serverless instance keeps its own in-memory caches, so a write handled by one
+instance is invisible to the others until their entries expire. Writes to cached data
+bump a single counter document (`counters/cache_generation`); each instance reads it
+at most once every CHECK_INTERVAL seconds and, when it has moved, drops its local
+caches through the registered listeners. Staleness is bounded by CHECK_INTERVAL
+instead of the cache TTL, so TTLs can be long.
+
+Every bump is a transaction on that one document, so a request that writes several
+things runs inside deferred() (an index.py middleware): bump() only notes the write
+and the middleware bumps once when the request is done.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+import storage
+
+GENERATION_COLLECTION = "counters"
+GENERATION_DOC = "cache_generation"
+CHECK_INTERVAL = float(os.environ.get("CACHE_GENERATION_INTERVAL", 5))
+
+_lock = threading.Lock()
+_listeners: List[Callable[[], None]] = []
+_known: Optional[int] = None  # generation our caches were filled under
+_updates = 0  # times _known was set, so a check() can tell a bump() overtook it
+_next_check = 0.0
+
+
+class Deferred:
+    def __init__(self):
+        self.pending = False  # bump() was called inside the block
+        self.open = True
+
+
+_deferred: ContextVar[Optional[Deferred]] = ContextVar("cache_generation_deferred", default=None)
+
+
+@contextmanager
+def deferred():
+    """Collect bump() calls made inside the block; the caller bumps once if `pending`"""
+    state = Deferred()
+    token = _deferred.set(state)
+    try:
+        yield state
+    finally:
+        # Anything still running in a copied context (after the response) bumps directly
+        state.open = False
+        _deferred.reset(token)
+
+
+def on_change(listener: Callable[[], None]):
+    """Register a callback that clears some local cache"""
+    _listeners.append(listener)
+
+
+def _notify():
+    for listener in _listeners:
+        listener()
+
+
+def _read(txn=None) -> int:
+    reader = txn if txn is not None else storage.get_backend()
+    doc = reader.get(GENERATION_COLLECTION, GENERATION_DOC)
+    return (doc or {}).get("generation", 0)
+
+
+def check():
+    """Drop local caches if another instance has written since we last looked (rate limited)"""
+    global _known, _updates, _next_check
+    now = time.monotonic()
+    with _lock:
+        if now < _next_check:
+            return
+        # Claim this check so concurrent requests don't all read the document
+        _next_check = now + CHECK_INTERVAL
+        seen = _updates
+    try:
+        generation = _read()
+    except Exception as e:
+        print(f"Cache generation check failed: {e}")
+        return
+    with _lock:
+        if _updates != seen:
+            # A bump() finished while we read; its value is at least as new as ours
+            return
+        changed = _known is not None and generation != _known
+        _known = generation
+        _updates += 1
+    if changed:
+        _notify()
+
+
+def bump():
+    """Record a write so other instances drop their cached copies at their next check().
+    Callers clear this instance's caches themselves. Inside deferred() this only marks
+    the write; the bump happens once when the block's owner asks for it."""
+    global _known, _updates
+    state = _deferred.get()
+    if state is not None and state.open:
+        state.pending = True
+        return
+
+    def _increment(txn):
+        current = _read(txn)
+        txn.set(GENERATION_COLLECTION, GENERATION_DOC, {"generation": current + 1})
+        return current
+
+    try:
+        previous = storage.get_backend().run_transaction(_increment)
+    except Exception as e:
+        print(f"Cache generation bump failed: {e}")
+        _notify()
+        return
+    # Caches here were cleared by the caller; only a bump we hadn't seen yet means
+    # another instance's write might still be sitting in them.
+    with _lock:
+        # previous < _known: a concurrent bump here already moved past it, nothing missed
+        missed = _known is not None and previous > _known
+        _known = previous + 1 if _known is None else max(_known, previous + 1)
+        _updates += 1
+    if missed:
+        _notify()
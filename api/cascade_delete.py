@@ -0,0 +1,152 @@
+"""
+Batched cascade deletes for the test-series hierarchy:
+
+    test_series -> mcq_tests -> mcq_questions, test_attempts, test_snapshots,
+                               leaderboards, item_stats
+                -> pdf_resources
+
+Children go before their parents, in WriteBatches of up to 500 deletes with a few
+batches committed in parallel. Parents are deactivated and flagged `deleting` up
+front so they drop out of listings straight away. A run that reaches its time
+budget stops between batches and reports done=False; calling it again simply
+re-queries whatever is left, so a large series can be removed across several
+requests without ever hitting the 60s Vercel limit.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import item_stats
+import jobs
+import leaderboard
+import test_snapshots
+from jobs import BATCH_LIMIT, DEFAULT_TIME_BUDGET
+from storage import Increment
+
+MAX_WORKERS = 4
+JOBS_COLLECTION = "delete_jobs"
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class CascadeDelete:
+    def __init__(self, store, job_id: str, time_budget: float = DEFAULT_TIME_BUDGET,
+                 max_workers: int = MAX_WORKERS, on_progress: Optional[Callable[[dict], None]] = None):
+        self.store = store
+        self.job_id = job_id
+        self.deadline = time.monotonic() + time_budget
+        self.max_workers = max_workers
+        self.on_progress = on_progress
+        self.deleted: Dict[str, int] = {}
+        self.started = time.monotonic()
+
+    # --- progress ---
+    def report(self, done: bool) -> dict:
+        return {
+            "job_id": self.job_id,
+            "done": done,
+            "deleted": dict(self.deleted),
+            "elapsed_seconds": round(time.monotonic() - self.started, 2),
+        }
+
+    def _record(self, collection: str, count: int):
+        self.deleted[collection] = self.deleted.get(collection, 0) + count
+        self.store.set(JOBS_COLLECTION, self.job_id, {
+            "status": "running",
+            "deleted": {collection: Increment(count)},
+            "updated_at": time.time(),
+        }, merge=True)
+        if self.on_progress:
+            self.on_progress(self.report(done=False))
+
+    def _finish(self):
+        self.store.set(JOBS_COLLECTION, self.job_id, {
+            "status": "done",
+            "updated_at": time.time(),
+        }, merge=True)
+
+    def _check_time(self):
+        if time.monotonic() >= self.deadline:
+            raise _OutOfTime()
+
+    # --- deletes ---
+    def _commit_deletes(self, collection: str, doc_ids):
+        batch = self.store.batch()
+        for doc_id in doc_ids:
+            batch.delete(collection, doc_id)
+        batch.commit()
+
+    def _delete_where(self, collection: str, field: str, value):
+        page_size = BATCH_LIMIT * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                self._check_time()
+                docs = self.store.query(collection, filters=[(field, "==", value)], limit=page_size, select=["id"])
+                ids = [doc.get("id") for doc in docs]
+                if not ids:
+                    return
+                chunks = [ids[i:i + BATCH_LIMIT] for i in range(0, len(ids), BATCH_LIMIT)]
+                list(pool.map(lambda chunk: self._commit_deletes(collection, chunk), chunks))
+                self._record(collection, len(ids))
+                if len(ids) < page_size:
+                    return
+
+    def _delete_doc(self, collection: str, doc_id):
+        self.store.delete(collection, doc_id)
+        self._record(collection, 1)
+
+    def _mark_deleting(self, collection: str, doc_ids):
+        for i in range(0, len(doc_ids), BATCH_LIMIT):
+            batch = self.store.batch()
+            for doc_id in doc_ids[i:i + BATCH_LIMIT]:
+                batch.update(collection, doc_id, {"is_active": False, "deleting": True})
+            batch.commit()
+
+    def delete_test(self, test_id: int):
+        self._delete_where("mcq_questions", "test_id", test_id)
+        self._delete_where("test_attempts", "test_id", test_id)
+        self._check_time()
+        test_snapshots.delete(self.store, test_id)
+        leaderboard.delete(self.store, test_id)
+        item_stats.delete(self.store, test_id)
+        self._delete_doc("mcq_tests", test_id)
+
+    def delete_test_series(self, series_id: int):
+        test_ids = [doc.get("id") for doc in self.store.query("mcq_tests", filters=[("test_series_id", "==", series_id)], select=["id"])]
+        self._mark_deleting("mcq_tests", test_ids)
+        for test_id in test_ids:
+            self.delete_test(test_id)
+        self._delete_where("pdf_resources", "test_series_id", series_id)
+        self._check_time()
+        self._delete_doc("test_series", series_id)
+
+
+def _run(store, collection: str, doc_id: int, job_id: str, step, **kwargs) -> Optional[dict]:
+    data = store.get(collection, doc_id)
+    if data is None:
+        return None
+    store.update(collection, doc_id, {"is_active": False, "deleting": True})
+
+    job = CascadeDelete(store, job_id, **kwargs)
+    try:
+        step(job, doc_id)
+    except _OutOfTime:
+        return {**job.report(done=False), "item": data}
+    job._finish()
+    return {**job.report(done=True), "item": data}
+
+
+def delete_test(store, test_id: int, **kwargs) -> Optional[dict]:
+    """Delete a test with its questions and attempts. None if the test doesn't exist."""
+    return _run(store, "mcq_tests", test_id, f"mcq_tests_{test_id}", CascadeDelete.delete_test, **kwargs)
+
+
+def delete_test_series(store, series_id: int, **kwargs) -> Optional[dict]:
+    """Delete a series with its tests (and their questions/attempts) and PDFs. None if missing."""
+    return _run(store, "test_series", series_id, f"test_series_{series_id}", CascadeDelete.delete_test_series, **kwargs)
+
+
+def get_job(store, job_id: str) -> Optional[dict]:
+    return jobs.get_job(store, JOBS_COLLECTION, job_id)
@@ -1,4 +1,6 @@
 from api.firebase_config import get_db
+from api.id_allocator import allocate_id
+from api.storage_firestore import FirestoreBackend
 import datetime
 
 def cleanup():
@@ -57,13 +59,7 @@ def cleanup():
             
             if not exists:
                 # Create it
-                # Logic to find next ID
-                max_id = 0
-                for c in all_classes:
-                    try:
-                        max_id = max(max_id, int(c.get("id", 0)))
-                    except: pass
-                new_id = max_id + 1
+                new_id = allocate_id(FirestoreBackend(db), "academic_classes")
                 
                 new_class = {
                     "id": new_id,
@@ -1,20 +1,33 @@
 import datetime
-from google.cloud.firestore_v1.base_query import FieldFilter
+import json
+import re
+import threading
+import time
 from typing import List, Dict, Any, Optional
 import schemas
-from firebase_config import get_db
-
-firestore_db = get_db()
-
-def _doc_to_dict(doc) -> Optional[Dict[str, Any]]:
-    if not doc.exists:
-        return None
-    data = doc.to_dict()
-    # Ensure ID match if needed, though we set document name to id
-    return data
-
-def _docs_to_list(docs) -> List[Dict[str, Any]]:
-    return [doc.to_dict() for doc in docs]
+import storage
+import cache_generation
+import id_allocator
+import cascade_delete
+import test_snapshots
+import scoring
+import cursors
+import query_stats
+import pdf_search
+import regrade
+import leaderboard
+import item_stats
+import jobs
+import submission_buffer
+from cache import LRUCache
+from jobs import BATCH_LIMIT
+from storage import ASCENDING, DESCENDING, Increment
+
+# All reads and writes go through the configured storage backend
+# (Firestore by default, see storage.py for SQL / in-memory), recorded by
+# query_stats when QUERY_STATS is on.
+def _store() -> storage.StorageBackend:
+    return query_stats.instrument(storage.get_backend())
 
 # --- Class to emulate SQLAlchemy objects for existing endpoints ---
 # Because FastAPI endpoints use things like `student.id` or `student.name`
@@ -23,7 +36,7 @@ class FirestoreDict(dict):
         if name in self:
             return self[name]
         return None
-        
+
     def __setattr__(self, name, value):
         self[name] = value
 
@@ -35,97 +48,188 @@ def dict_to_obj(d):
 def list_to_objs(l):
     return [FirestoreDict(d) for d in l]
 
+def _delete_doc(collection: str, doc_id: int):
+    data = _store().get(collection, doc_id)
+    if data is not None:
+        _store().delete(collection, doc_id)
+    return dict_to_obj(data)
+
+# --- Catalog cache ---
+# Classes, subjects, series, tests and courses are listed on nearly every page view but
+# only change through the admin endpoints below. Listings are cached per collection and
+# stamped with that collection's version; every crud write to it bumps the version, and
+# cache_generation carries the bump to the other instances.
+CATALOG_COLLECTIONS = ("academic_classes", "subjects", "test_series", "mcq_tests", "courses")
+
+_catalog_lock = threading.Lock()
+_catalog_versions = {name: 0 for name in CATALOG_COLLECTIONS}
+_catalog_cache = {}  # ((collection, ...), key) -> (versions, docs)
+
+def catalog_version(collection: str) -> int:
+    with _catalog_lock:
+        return _catalog_versions[collection]
+
+def _bump_local(*collections: str):
+    with _catalog_lock:
+        for name in collections:
+            _catalog_versions[name] += 1
+
+def bump_catalog_version(*collections: str):
+    _bump_local(*collections)
+    cache_generation.bump()
+
+# Another instance wrote something: everything cached here may be stale
+cache_generation.on_change(lambda: _bump_local(*CATALOG_COLLECTIONS))
+
+def _catalog_stamp(collections) -> tuple:
+    return tuple(_catalog_versions[name] for name in collections)
+
+def _cached_catalog(collection, key, load):
+    """collection may be a tuple when the result depends on several collections"""
+    collections = (collection,) if isinstance(collection, str) else tuple(collection)
+    cache_generation.check()
+    with _catalog_lock:
+        version = _catalog_stamp(collections)
+        hit = _catalog_cache.get((collections, key))
+    if hit is not None and hit[0] == version:
+        return list_to_objs(hit[1])
+
+    docs = load()
+    with _catalog_lock:
+        # Don't keep a result that raced with a write
+        if _catalog_stamp(collections) == version:
+            _catalog_cache[(collections, key)] = (version, docs)
+    return list_to_objs(docs)
+
 # =====================================================================
 # --- Site Config ---
 def get_site_config(db):
-    docs = firestore_db.collection("site_config").limit(1).get()
+    docs = _store().query("site_config", limit=1)
     if docs:
-        return dict_to_obj(docs[0].to_dict())
+        return dict_to_obj(docs[0])
     return None
 
 def create_or_update_site_config(db, config: schemas.SiteConfigCreate):
     config_dict = config.dict()
     # Just grab the first one if we have it
-    docs = firestore_db.collection("site_config").limit(1).get()
-    
+    docs = _store().query("site_config", limit=1)
+
     if docs:
-        doc_ref = docs[0].reference
         # We need to maintain the original ID if it previously existed
-        config_dict['id'] = docs[0].to_dict().get('id', 1) 
-        doc_ref.set(config_dict, merge=True)
+        config_dict['id'] = docs[0].get('id', 1)
+        _store().set("site_config", config_dict['id'], config_dict, merge=True)
     else:
         # Create new
         config_dict['id'] = 1
-        firestore_db.collection("site_config").document("1").set(config_dict)
-        
+        _store().set("site_config", 1, config_dict)
+
+    cache_generation.bump()
     return dict_to_obj(config_dict)
 
 # --- Student ---
+def _page(collection: str, order_by, limit: int, cursor: str = None, filters=None) -> dict:
+    """{"items", "next_cursor"}; raises ValueError for a cursor that isn't ours"""
+    docs, next_cursor = cursors.page(_store(), collection, order_by, limit, cursor, filters)
+    return {"items": list_to_objs(docs), "next_cursor": next_cursor}
+
+STUDENTS_ORDER = [("id", ASCENDING)]
+
 def get_students(db, skip: int = 0, limit: int = 100):
-    docs = firestore_db.collection("students").order_by("id").offset(skip).limit(limit).get()
-    return list_to_objs(_docs_to_list(docs))
+    docs = _store().query("students", order_by=STUDENTS_ORDER, offset=skip, limit=limit)
+    return list_to_objs(docs)
+
+def get_students_page(db, limit: int = 100, cursor: str = None):
+    return _page("students", STUDENTS_ORDER, limit, cursor)
 
 def get_student(db, student_id: int):
-    doc = firestore_db.collection("students").document(str(student_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("students", student_id))
+
+STUDENT_RANK_ORDER = [("grade_value", DESCENDING), ("id", ASCENDING)]
+STUDENT_LIST_FIELDS = ["id", "name", "rank", "description", "is_active", "image_url", "grade_value"]
+
+def student_grade(rank: Optional[str]) -> float:
+    """Numeric grade for ordering toppers: the first number in rank ("98.5% - Class 10" -> 98.5)"""
+    match = re.search(r"(\d+\.?\d*)", rank or "")
+    return float(match.group(1)) if match else 0.0
+
+def get_ranked_students(db, skip: int = 0, limit: int = 100):
+    """Toppers by grade, best first, as one ordered and limited query. Students written
+    before grade_value existed are left out until backfill_student_grades() has run"""
+    docs = _store().query("students", order_by=STUDENT_RANK_ORDER, offset=skip, limit=limit,
+                          select=STUDENT_LIST_FIELDS)
+    return list_to_objs(docs)
+
+def get_ranked_students_page(db, limit: int = 100, cursor: str = None):
+    docs, next_cursor = cursors.page(_store(), "students", STUDENT_RANK_ORDER, limit, cursor)
+    return {"items": list_to_objs(docs), "next_cursor": next_cursor}
+
+def backfill_student_grades(db) -> int:
+    """Set grade_value on students written before it existed; returns how many changed"""
+    changed = 0
+    batch = _store().batch()
+    for doc in _store().query("students", select=["id", "rank", "grade_value"]):
+        grade = student_grade(doc.get("rank"))
+        if doc.get("grade_value") != grade:
+            batch.update("students", doc["id"], {"grade_value": grade})
+            changed += 1
+            if len(batch) == 500:
+                batch.commit()
+    batch.commit()
+    if changed:
+        cache_generation.bump()
+    return changed
 
 def create_student(db, student: schemas.StudentCreate):
     student_dict = student.dict()
     # Generate an ID since Firestore normally auto-generates string IDs, but we need integers to match legacy
-    docs = firestore_db.collection("students").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "students")
     student_dict["id"] = new_id
     if "is_active" not in student_dict:
         student_dict["is_active"] = True
-        
-    firestore_db.collection("students").document(str(new_id)).set(student_dict)
+    student_dict["grade_value"] = student_grade(student_dict.get("rank"))
+
+    _store().set("students", new_id, student_dict)
+    cache_generation.bump()
     return dict_to_obj(student_dict)
 
+def update_student_image(db, student_id: int, image_url: str):
+    _store().update("students", student_id, {"image_url": image_url})
+    cache_generation.bump()
+
 def delete_student(db, student_id: int):
-    doc_ref = firestore_db.collection("students").document(str(student_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    data = _delete_doc("students", student_id)
+    cache_generation.bump()
+    return data
 
 # --- Enquiry ---
 def create_enquiry(db, enquiry: schemas.EnquiryCreate):
     enquiry_dict = enquiry.dict()
-    docs = firestore_db.collection("enquiries").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "enquiries")
     enquiry_dict["id"] = new_id
     enquiry_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    firestore_db.collection("enquiries").document(str(new_id)).set(enquiry_dict)
+    _store().set("enquiries", new_id, enquiry_dict)
     return dict_to_obj(enquiry_dict)
 
+# Newest first by time: ids are leased in blocks per instance, so they are not in time order
+ENQUIRIES_ORDER = [("created_at", DESCENDING), ("id", DESCENDING)]
+
 def get_enquiries(db, skip: int = 0, limit: int = 100):
-    docs = firestore_db.collection("enquiries").order_by("id", direction="DESCENDING").offset(skip).limit(limit).get()
-    return list_to_objs(_docs_to_list(docs))
+    docs = _store().query("enquiries", order_by=ENQUIRIES_ORDER, offset=skip, limit=limit)
+    return list_to_objs(docs)
+
+def get_enquiries_page(db, limit: int = 100, cursor: str = None):
+    return _page("enquiries", ENQUIRIES_ORDER, limit, cursor)
 
 def delete_enquiry(db, enquiry_id: int):
-    doc_ref = firestore_db.collection("enquiries").document(str(enquiry_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    return _delete_doc("enquiries", enquiry_id)
 
 # --- Admin ---
 def get_user_by_email(db, email: str): # Replacing getting admin by getting user by email which was used in login
     # In index.py login uses crud.get_user_by_email(db, email=request.username)
     # Check admins collection
-    docs = firestore_db.collection("admins").where(filter=FieldFilter("username", "==", email)).limit(1).get()
+    docs = _store().query("admins", filters=[("username", "==", email)], limit=1)
     if docs:
-        admin_data = docs[0].to_dict()
+        admin_data = docs[0]
         # Add a verify_password mock method to pass the FastAPI dependency
         obj = dict_to_obj(admin_data)
         # Assuming admin password checking in fastAPI
@@ -135,7 +239,7 @@ def get_user_by_email(db, email: str): # Replacing getting admin by getting user
                 self.role = "admin"
                 self.data = data
             def verify_password(self, password):
-                # For demo, match hashes or simple string check 
+                # For demo, match hashes or simple string check
                 # (SQLAlchemy had hashed_password)
                 return self.data.get("hashed_password") == password or self.data.get("hashed_password") == (password + "notreallyhashed")
         return UserPassWrapper(admin_data)
@@ -143,351 +247,607 @@ def get_user_by_email(db, email: str): # Replacing getting admin by getting user
 
 def create_admin(db, admin: schemas.AdminCreate):
     admin_dict = admin.dict()
-    docs = firestore_db.collection("admins").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "admins")
     admin_dict["id"] = new_id
     admin_dict["hashed_password"] = admin.password + "notreallyhashed"
-    firestore_db.collection("admins").document(str(new_id)).set(admin_dict)
+    _store().set("admins", new_id, admin_dict)
     return dict_to_obj(admin_dict)
 
 # --- Demo Booking ---
 def create_demo_booking(db, booking: schemas.DemoBookingCreate):
     bk_dict = booking.dict()
-    docs = firestore_db.collection("demo_bookings").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "demo_bookings")
     bk_dict["id"] = new_id
     if "status" not in bk_dict:
         bk_dict["status"] = "pending"
     bk_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    firestore_db.collection("demo_bookings").document(str(new_id)).set(bk_dict)
+    _store().set("demo_bookings", new_id, bk_dict)
     return dict_to_obj(bk_dict)
 
+DEMO_BOOKINGS_ORDER = [("created_at", DESCENDING), ("id", DESCENDING)]
+
 def get_demo_bookings(db, skip: int = 0, limit: int = 100):
-    docs = firestore_db.collection("demo_bookings").order_by("id", direction="DESCENDING").offset(skip).limit(limit).get()
-    return list_to_objs(_docs_to_list(docs))
+    docs = _store().query("demo_bookings", order_by=DEMO_BOOKINGS_ORDER, offset=skip, limit=limit)
+    return list_to_objs(docs)
+
+def get_demo_bookings_page(db, limit: int = 100, cursor: str = None):
+    return _page("demo_bookings", DEMO_BOOKINGS_ORDER, limit, cursor)
 
 def update_demo_booking_status(db, booking_id: int, status: str):
-    doc_ref = firestore_db.collection("demo_bookings").document(str(booking_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
+    data = _store().get("demo_bookings", booking_id)
+    if data is not None:
         data["status"] = status
-        doc_ref.update({"status": status})
+        _store().update("demo_bookings", booking_id, {"status": status})
         return dict_to_obj(data)
     return None
 
 def delete_demo_booking(db, booking_id: int):
-    doc_ref = firestore_db.collection("demo_bookings").document(str(booking_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    return _delete_doc("demo_bookings", booking_id)
 
 
 # ================== ACADEMIC CLASSES ==================
 
 def get_academic_classes(db, board: str = None):
-    ref = firestore_db.collection("academic_classes").where(filter=FieldFilter("is_active", "==", True))
-    if board:
-        ref = ref.where(filter=FieldFilter("board", "==", board))
-    docs = ref.get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("order_index", 0))
-    return objs
+    def _load():
+        filters = [("is_active", "==", True)]
+        if board:
+            filters.append(("board", "==", board))
+        docs = _store().query("academic_classes", filters=filters)
+        query_stats.sort(docs, [("order_index", ASCENDING)])
+        return docs
+    return _cached_catalog("academic_classes", board, _load)
 
 def get_academic_class(db, class_id: int):
-    doc = firestore_db.collection("academic_classes").document(str(class_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("academic_classes", class_id))
 
 def create_academic_class(db, academic_class: schemas.AcademicClassCreate):
     cls_dict = academic_class.dict()
-    docs = firestore_db.collection("academic_classes").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "academic_classes")
     cls_dict["id"] = new_id
     if "is_active" not in cls_dict:
         cls_dict["is_active"] = True
     if "order_index" not in cls_dict:
         cls_dict["order_index"] = 0
-        
-    firestore_db.collection("academic_classes").document(str(new_id)).set(cls_dict)
+
+    _store().set("academic_classes", new_id, cls_dict)
+    bump_catalog_version("academic_classes")
     return dict_to_obj(cls_dict)
 
 
 # ================== SUBJECTS ==================
 
 def get_subjects_by_class(db, class_id: int, board: str = None):
-    ref = firestore_db.collection("subjects").where(filter=FieldFilter("class_id", "==", class_id)).where(filter=FieldFilter("is_active", "==", True))
-    if board:
-        ref = ref.where(filter=FieldFilter("board", "==", board))
-    docs = ref.get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("order_index", 0))
-    return objs
+    def _load():
+        filters = [("class_id", "==", class_id), ("is_active", "==", True)]
+        if board:
+            filters.append(("board", "==", board))
+        docs = _store().query("subjects", filters=filters)
+        query_stats.sort(docs, [("order_index", ASCENDING)])
+        return docs
+    return _cached_catalog("subjects", (class_id, board), _load)
 
 def get_subject(db, subject_id: int):
-    doc = firestore_db.collection("subjects").document(str(subject_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("subjects", subject_id))
 
 def create_subject(db, subject: schemas.SubjectCreate):
     sub_dict = subject.dict()
-    docs = firestore_db.collection("subjects").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "subjects")
     sub_dict["id"] = new_id
     if "is_active" not in sub_dict:
         sub_dict["is_active"] = True
     if "order_index" not in sub_dict:
         sub_dict["order_index"] = 0
-        
-    firestore_db.collection("subjects").document(str(new_id)).set(sub_dict)
+
+    _store().set("subjects", new_id, sub_dict)
+    bump_catalog_version("subjects")
     return dict_to_obj(sub_dict)
 
 def get_all_subjects(db):
-    docs = firestore_db.collection("subjects").where(filter=FieldFilter("is_active", "==", True)).get()
-    return list_to_objs(_docs_to_list(docs))
+    return list_to_objs(_store().query("subjects", filters=[("is_active", "==", True)]))
 
 
 # ================== TEST SERIES ==================
 
 def get_test_series_by_subject(db, subject_id: int):
-    docs = firestore_db.collection("test_series").where(filter=FieldFilter("subject_id", "==", subject_id)).where(filter=FieldFilter("is_active", "==", True)).get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("order_index", 0))
-    return objs
+    def _load():
+        docs = _store().query("test_series", filters=[("subject_id", "==", subject_id), ("is_active", "==", True)])
+        query_stats.sort(docs, [("order_index", ASCENDING)])
+        return docs
+    return _cached_catalog("test_series", subject_id, _load)
 
 def get_test_series(db, series_id: int):
-    doc = firestore_db.collection("test_series").document(str(series_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("test_series", series_id))
 
 def create_test_series(db, series: schemas.TestSeriesCreate):
     ser_dict = series.dict()
-    docs = firestore_db.collection("test_series").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "test_series")
     ser_dict["id"] = new_id
     if "is_active" not in ser_dict:
         ser_dict["is_active"] = True
     if "order_index" not in ser_dict:
         ser_dict["order_index"] = 0
     ser_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-    firestore_db.collection("test_series").document(str(new_id)).set(ser_dict)
+
+    _store().set("test_series", new_id, ser_dict)
+    bump_catalog_version("test_series")
     return dict_to_obj(ser_dict)
 
 def get_all_test_series(db):
-    docs = firestore_db.collection("test_series").where(filter=FieldFilter("is_active", "==", True)).get()
-    return list_to_objs(_docs_to_list(docs))
+    return list_to_objs(_store().query("test_series", filters=[("is_active", "==", True)]))
 
 def delete_test_series(db, series_id: int):
-    doc_ref = firestore_db.collection("test_series").document(str(series_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    # Removes the series' tests, questions, attempts and PDFs too; see cascade_delete
+    test_ids = [doc.get("id") for doc in _store().query("mcq_tests", filters=[("test_series_id", "==", series_id)], select=["id"])]
+    try:
+        return dict_to_obj(cascade_delete.delete_test_series(_store(), series_id))
+    finally:
+        # Even a partial run has already deactivated the series and its tests
+        for test_id in test_ids:
+            _published_tests.delete(str(test_id))
+        bump_catalog_version("test_series", "mcq_tests")
 
 
 # ================== PDF RESOURCES ==================
 
 def get_pdfs_by_test_series(db, test_series_id: int):
-    docs = firestore_db.collection("pdf_resources").where(filter=FieldFilter("test_series_id", "==", test_series_id)).where(filter=FieldFilter("is_active", "==", True)).get()
-    return list_to_objs(_docs_to_list(docs))
+    docs = _store().query("pdf_resources", filters=[("test_series_id", "==", test_series_id), ("is_active", "==", True)])
+    return list_to_objs(docs)
 
 def create_pdf_resource(db, pdf: schemas.PDFResourceCreate):
     pdf_dict = pdf.dict()
-    docs = firestore_db.collection("pdf_resources").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "pdf_resources")
     pdf_dict["id"] = new_id
     if "is_active" not in pdf_dict:
         pdf_dict["is_active"] = True
     pdf_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-    firestore_db.collection("pdf_resources").document(str(new_id)).set(pdf_dict)
+
+    _store().set("pdf_resources", new_id, pdf_dict)
     return dict_to_obj(pdf_dict)
 
 def delete_pdf_resource(db, pdf_id: int):
-    doc_ref = firestore_db.collection("pdf_resources").document(str(pdf_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    return _delete_doc("pdf_resources", pdf_id)
 
 def get_all_pdfs(db):
-    docs = firestore_db.collection("pdf_resources").where(filter=FieldFilter("is_active", "==", True)).get()
-    return list_to_objs(_docs_to_list(docs))
+    return list_to_objs(_store().query("pdf_resources", filters=[("is_active", "==", True)]))
 
 
 # ================== MCQ TESTS ==================
 
 def get_mcq_tests_by_test_series(db, test_series_id: int):
-    docs = firestore_db.collection("mcq_tests").where(filter=FieldFilter("test_series_id", "==", test_series_id)).where(filter=FieldFilter("is_active", "==", True)).get()
-    return list_to_objs(_docs_to_list(docs))
+    def _load():
+        return _store().query("mcq_tests", filters=[("test_series_id", "==", test_series_id), ("is_active", "==", True)])
+    return _cached_catalog("mcq_tests", test_series_id, _load)
 
 def get_mcq_test(db, test_id: int):
-    doc = firestore_db.collection("mcq_tests").document(str(test_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("mcq_tests", test_id))
+
+def get_mcq_test_cached(db, test_id: int):
+    """get_mcq_test through the catalog cache, for the submit path"""
+    def _load():
+        test = _store().get("mcq_tests", test_id)
+        return [test] if test is not None else []
+    tests = _cached_catalog("mcq_tests", ("test", test_id), _load)
+    return tests[0] if tests else None
 
 def create_mcq_test(db, test: schemas.MCQTestCreate):
     test_dict = test.dict()
-    docs = firestore_db.collection("mcq_tests").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "mcq_tests")
     test_dict["id"] = new_id
+    # Question writes maintain these; starting anywhere but 0 would count the questions twice
+    test_dict["total_questions"] = 0
+    test_dict["total_marks"] = 0
     if "is_active" not in test_dict:
         test_dict["is_active"] = True
     test_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-    firestore_db.collection("mcq_tests").document(str(new_id)).set(test_dict)
+
+    _store().set("mcq_tests", new_id, test_dict)
+    bump_catalog_version("mcq_tests")
+    refresh_test_snapshot(db, new_id)
     return dict_to_obj(test_dict)
 
 def update_mcq_test(db, test_id: int, test: schemas.MCQTestCreate):
-    doc_ref = firestore_db.collection("mcq_tests").document(str(test_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        for key, value in test.dict().items():
-            if value is not None:
-                data[key] = value
-        doc_ref.update(data)
+    data = _store().get("mcq_tests", test_id)
+    if data is not None:
+        changes = test.dict()
+        # Maintained by the question writes; the schema defaults would reset them to 0
+        changes.pop("total_questions", None)
+        changes.pop("total_marks", None)
+        changes = {key: value for key, value in changes.items() if value is not None}
+        data.update(changes)
+        _store().update("mcq_tests", test_id, changes)
+        bump_catalog_version("mcq_tests")
+        refresh_test_snapshot(db, test_id)
         return dict_to_obj(data)
     return None
 
+def set_mcq_test_active(db, test_id: int, is_active: bool = True):
+    data = _store().get("mcq_tests", test_id)
+    if data is None:
+        return None
+    _store().update("mcq_tests", test_id, {"is_active": is_active})
+    bump_catalog_version("mcq_tests")
+    refresh_test_snapshot(db, test_id)
+    data["is_active"] = is_active
+    return dict_to_obj(data)
+
 def delete_mcq_test(db, test_id: int):
-    doc_ref = firestore_db.collection("mcq_tests").document(str(test_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        
-        # Also delete questions
-        qs = firestore_db.collection("mcq_questions").where(filter=FieldFilter("test_id", "==", test_id)).get()
-        for q in qs:
-            q.reference.delete()
-            
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    # Also deletes questions and attempts in batches; see cascade_delete
+    try:
+        return dict_to_obj(cascade_delete.delete_test(_store(), test_id))
+    finally:
+        # bump() doesn't notify this instance, so drop our own copy of the student view
+        _published_tests.delete(str(test_id))
+        bump_catalog_version("mcq_tests")
+
+def refresh_test_snapshot(db, test_id: int):
+    """Rebuild the student snapshot of a published test (drop it if the test isn't published)"""
+    test = _store().get("mcq_tests", test_id)
+    if test is None:
+        test_snapshots.delete(_store(), test_id)
+    elif test.get("is_active", True):
+        test_snapshots.build(_store(), test_id)
+    else:
+        test_snapshots.retract(_store(), test_id)
+    # After the new snapshot is in place, so other instances reload the new version
+    _published_tests.delete(str(test_id))
+    cache_generation.bump()
+
+def mark_test_snapshot_stale(db, test_id: int):
+    """After a question write: the next load rebuilds the snapshot (see test_snapshots.mark_stale)"""
+    test_snapshots.mark_stale(_store(), test_id)
+    _published_tests.delete(str(test_id))
+    cache_generation.bump()
+
+# Student loads, cached per process; exam prewarming pins entries here (exam_schedule.py)
+_published_tests = LRUCache(max_bytes=32 * 1024 * 1024, default_ttl=3600)
+
+def _on_generation_change():
+    """Another instance wrote: drop unpinned tests, and pinned ones only if their snapshot moved"""
+    _published_tests.clear(keep_pinned=True)
+    for key in _published_tests.pinned():
+        cached = _published_tests.get(key)
+        if cached is None:
+            continue
+        head = _store().get(test_snapshots.SNAPSHOTS_COLLECTION, int(key))
+        if (cached["version"] is None or not head or not head.get("published")
+                or head.get("version") != cached["version"] or test_snapshots.is_stale(head)):
+            _published_tests.delete(key)
+
+cache_generation.on_change(_on_generation_change)
+
+def _load_published_test(test_id: int):
+    snapshot = test_snapshots.load(_store(), test_id)
+    if snapshot is None:
+        test = _store().get("mcq_tests", test_id)
+        if test is None:
+            return None
+        if test.get("is_active", True) and test_snapshots.build(_store(), test_id):
+            # Published before snapshots existed, or questions edited since: built now for the next reader
+            snapshot = test_snapshots.load(_store(), test_id)
+        else:
+            questions = _store().query("mcq_questions", filters=[("test_id", "==", test_id)])
+            query_stats.sort(questions, [("order_index", ASCENDING)])
+            snapshot = {"version": None, "test": test, "questions": questions}
+    return snapshot
+
+def get_published_test(db, test_id: int):
+    """{"version", "test", "questions"} for a student load: one snapshot read when published"""
+    cache_generation.check()
+    snapshot = _published_tests.get_or_load(str(test_id), lambda: _load_published_test(test_id))
+    if snapshot is None:
+        return None
+    return {
+        "version": snapshot["version"],
+        "test": dict_to_obj(snapshot["test"]),
+        "questions": list_to_objs(snapshot["questions"]),
+    }
+
+def pin_published_test(db, test_id: int, until: float):
+    """Load a test's student view and answer key into the process caches and keep them
+    there until `until` (a time.time()); returns the snapshot version, None if no test"""
+    _published_tests.pin(str(test_id), until)
+    published = get_published_test(db, test_id)
+    if published is None:
+        return None
+    version = published["version"]
+    if version is not None:
+        _answer_keys.pin(f"{test_id}:{version}", until)
+    get_answer_key(db, test_id, version)
+    get_mcq_test_cached(db, test_id)
+    return version
+
+def published_cache_stats(db) -> dict:
+    return {"published_tests": _published_tests.stats(), "answer_keys": _answer_keys.stats()}
+
+# Keys are immutable per (test, version), so they can stay cached until evicted
+_answer_keys = LRUCache(max_bytes=16 * 1024 * 1024, default_ttl=24 * 3600,
+                        sizeof=lambda key: 64 * len(key) + 256)
+
+def get_answer_key(db, test_id: int, version: int = None) -> Optional[scoring.CompiledKey]:
+    """Compiled answer key a submission is scored against (see test_snapshots.build_answer_key)"""
+    if version is None:
+        head = _store().get(test_snapshots.SNAPSHOTS_COLLECTION, test_id)
+        if head and head.get("published"):
+            if test_snapshots.is_stale(head):
+                # Questions were edited since the last build
+                head = test_snapshots.build(_store(), test_id) or head
+            version = head.get("version")
+    if version is not None:
+        cache_key = f"{test_id}:{version}"
+        key = _answer_keys.get(cache_key)
+        if key is None:
+            stored = test_snapshots.load_answer_key(_store(), test_id, version)
+            if stored is not None:
+                key = scoring.compile_key(stored)
+                _answer_keys.set(cache_key, key)
+        if key is not None:
+            return key
+    # Unpublished test, or a version that has since been cleaned up: use the live bank
+    if _store().get("mcq_tests", test_id) is None:
+        return None
+    questions = _store().query("mcq_questions", filters=[("test_id", "==", test_id)])
+    query_stats.sort(questions, [("order_index", ASCENDING)])
+    return scoring.compile_key(test_snapshots.build_answer_key(test_id, None, questions))
+
+def regrade_test_attempts(db, test_id: int, restart: bool = False, time_budget: float = jobs.DEFAULT_TIME_BUDGET):
+    """Re-score a test's attempts against its current answer key, then recount its item
+    stats, within one time budget (resumable, see regrade.py and item_stats.py)"""
+    key = get_answer_key(db, test_id)
+    if key is None:
+        return None
+    flush_submissions(db)
+    deadline = time.monotonic() + time_budget
+    result = regrade.regrade_test(_store(), test_id, key, restart=restart, time_budget=time_budget)
+    if not result.get("done"):
+        return result
+    leaderboard.rebuild(_store(), test_id)
+    stats = item_stats.rebuild(_store(), test_id, key, time_budget=max(0, deadline - time.monotonic()))
+    cache_generation.bump()
+    return {**result, "item_stats": stats, "done": stats["done"]}
+
+def get_regrade_job(db, job_id: str):
+    return dict_to_obj(regrade.get_job(_store(), job_id))
+
+def get_item_stats_job(db, job_id: str):
+    return dict_to_obj(item_stats.get_job(_store(), job_id))
+
+def get_delete_job(db, job_id: str):
+    return dict_to_obj(cascade_delete.get_job(_store(), job_id))
+
+def get_catalog_tree(db, board: str = None):
+    """Active classes -> subjects -> test series -> tests, one query per collection joined in memory"""
+    def _load():
+        class_filters = [("is_active", "==", True)]
+        subject_filters = [("is_active", "==", True)]
+        if board:
+            class_filters.append(("board", "==", board))
+            subject_filters.append(("board", "==", board))
+        classes = _store().query("academic_classes", filters=class_filters)
+        subjects = _store().query("subjects", filters=subject_filters)
+        series = _store().query("test_series", filters=[("is_active", "==", True)])
+        tests = _store().query("mcq_tests", filters=[("is_active", "==", True)])
+
+        def _group(children, key):
+            grouped = {}
+            for child in query_stats.sort(children, [("order_index", ASCENDING)]):
+                grouped.setdefault(child.get(key), []).append(child)
+            return grouped
+
+        tests_by_series = _group(tests, "test_series_id")
+        series_by_subject = _group(series, "subject_id")
+        subjects_by_class = _group(subjects, "class_id")
+        for s in series:
+            s["tests"] = tests_by_series.get(s.get("id"), [])
+        for sub in subjects:
+            sub["test_series"] = series_by_subject.get(sub.get("id"), [])
+        for cls in classes:
+            cls["subjects"] = subjects_by_class.get(cls.get("id"), [])
+        query_stats.sort(classes, [("order_index", ASCENDING)])
+        # Series and tests can't be filtered by board in the store; count what the tree kept
+        kept_subjects = [sub for cls in classes for sub in cls["subjects"]]
+        kept_series = [s for sub in kept_subjects for s in sub["test_series"]]
+        query_stats.used(subjects, len(kept_subjects))
+        query_stats.used(series, len(kept_series))
+        query_stats.used(tests, sum(len(s["tests"]) for s in kept_series))
+        return classes
+    return _cached_catalog(("academic_classes", "subjects", "test_series", "mcq_tests"), ("tree", board), _load)
 
 def get_all_mcq_tests(db):
-    docs = firestore_db.collection("mcq_tests").where(filter=FieldFilter("is_active", "==", True)).get()
-    return _docs_to_list(docs)
+    return _store().query("mcq_tests", filters=[("is_active", "==", True)])
+
+def get_tests_with_series(db):
+    """Every test (including unpublished ones) paired with its series, newest first"""
+    rows = _store().join("mcq_tests", "test_series_id", "test_series", order_by=[("id", DESCENDING)])
+    return [(dict_to_obj(test), dict_to_obj(series)) for test, series in rows]
 
 
 # ================== MCQ QUESTIONS ==================
 
+# total_questions / total_marks on mcq_tests are maintained as deltas from the
+# question writes below; rebuild_test_aggregates() recomputes them from scratch.
+
+def _question_marks(q_dict) -> int:
+    return q_dict.get("marks", 1) or 0
+
+def _totals_delta(questions: int, marks: int):
+    delta = {}
+    if questions:
+        delta["total_questions"] = Increment(questions)
+    if marks:
+        delta["total_marks"] = Increment(marks)
+    return delta
+
 def get_questions_by_test(db, test_id: int):
-    docs = firestore_db.collection("mcq_questions").where(filter=FieldFilter("test_id", "==", test_id)).get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("order_index", 0))
+    objs = list_to_objs(_store().query("mcq_questions", filters=[("test_id", "==", test_id)]))
+    query_stats.sort(objs, [("order_index", ASCENDING)])
     return objs
 
+def get_mcq_question(db, question_id: int):
+    return dict_to_obj(_store().get("mcq_questions", question_id))
+
 def create_mcq_question(db, question: schemas.MCQQuestionCreate):
     q_dict = question.dict()
-    docs = firestore_db.collection("mcq_questions").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "mcq_questions")
     q_dict["id"] = new_id
     if "order_index" not in q_dict:
         q_dict["order_index"] = 0
     if "marks" not in q_dict:
         q_dict["marks"] = 1
-        
-    firestore_db.collection("mcq_questions").document(str(new_id)).set(q_dict)
-    
-    # Update test question count
-    test_doc = firestore_db.collection("mcq_tests").document(str(question.test_id)).get()
-    if test_doc.exists:
-        all_qs = firestore_db.collection("mcq_questions").where(filter=FieldFilter("test_id", "==", question.test_id)).get()
-        total_questions = len(all_qs)
-        total_marks = sum([q.to_dict().get("marks", 1) for q in all_qs])
-        
-        test_doc.reference.update({
-            "total_questions": total_questions,
-            "total_marks": total_marks
-        })
-    
+
+    def _create(txn):
+        test_exists = txn.get("mcq_tests", question.test_id) is not None
+        txn.set("mcq_questions", new_id, q_dict)
+        if test_exists:
+            txn.update("mcq_tests", question.test_id, _totals_delta(1, _question_marks(q_dict)))
+
+    _store().run_transaction(_create)
+    bump_catalog_version("mcq_tests")
+    mark_test_snapshot_stale(db, question.test_id)
     return dict_to_obj(q_dict)
 
+def create_mcq_questions_bulk(db, test_id: int, questions: List[schemas.MCQQuestionContent]):
+    """Insert many questions into one test with batched writes, each carrying its totals update"""
+    if not questions:
+        return []
+    new_ids = id_allocator.allocate_ids(_store(), "mcq_questions", len(questions))
+    test_exists = _store().get("mcq_tests", test_id) is not None
+
+    created = []
+    for new_id, question in zip(new_ids, questions):
+        q_dict = question.dict()
+        q_dict["id"] = new_id
+        q_dict["test_id"] = test_id
+        if q_dict.get("order_index") is None:
+            q_dict["order_index"] = 0
+        if q_dict.get("marks") is None:
+            q_dict["marks"] = 1
+        created.append(q_dict)
+
+    # Firestore caps a WriteBatch at 500 operations; each chunk commits on its own, so each
+    # batch carries the totals delta for its own questions
+    for start in range(0, len(created), BATCH_LIMIT - 1):
+        chunk = created[start:start + BATCH_LIMIT - 1]
+        batch = _store().batch()
+        for q_dict in chunk:
+            batch.set("mcq_questions", q_dict["id"], q_dict)
+        if test_exists:
+            batch.update("mcq_tests", test_id, _totals_delta(len(chunk), sum(_question_marks(q) for q in chunk)))
+        batch.commit()
+
+    bump_catalog_version("mcq_tests")
+    mark_test_snapshot_stale(db, test_id)
+    return list_to_objs(created)
+
 def update_mcq_question(db, question_id: int, question: schemas.MCQQuestionCreate):
-    doc_ref = firestore_db.collection("mcq_questions").document(str(question_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
+    def _update(txn):
+        old = txn.get("mcq_questions", question_id)
+        if old is None:
+            return None
+        data = dict(old)
         for key, value in question.dict().items():
             if value is not None:
                 data[key] = value
-        doc_ref.update(data)
-        
-        # update test question count and marks in background ideally, but we'll do it synchronously
-        test_doc = firestore_db.collection("mcq_tests").document(str(data.get("test_id"))).get()
-        if test_doc.exists:
-            all_qs = firestore_db.collection("mcq_questions").where(filter=FieldFilter("test_id", "==", data.get("test_id"))).get()
-            total_marks = sum([q.to_dict().get("marks", 1) for q in all_qs])
-            test_doc.reference.update({
-                "total_marks": total_marks
-            })
-            
-        return dict_to_obj(data)
-    return None
+
+        # Work out how this edit moves each affected test's totals
+        old_test, new_test = old.get("test_id"), data.get("test_id")
+        deltas = {}
+        if old_test == new_test:
+            deltas[new_test] = (0, _question_marks(data) - _question_marks(old))
+        else:
+            deltas[old_test] = (-1, -_question_marks(old))
+            deltas[new_test] = (1, _question_marks(data))
+        deltas = {tid: d for tid, d in deltas.items() if _totals_delta(*d)}
+
+        # Transactions need every read before the first write
+        tests_exist = {tid: txn.get("mcq_tests", tid) is not None for tid in deltas}
+        txn.update("mcq_questions", question_id, data)
+        for tid, (questions, marks) in deltas.items():
+            if tests_exist[tid]:
+                txn.update("mcq_tests", tid, _totals_delta(questions, marks))
+        return data
+
+    old_test_id = (_store().get("mcq_questions", question_id) or {}).get("test_id")
+    data = _store().run_transaction(_update)
+    bump_catalog_version("mcq_tests")
+    if data is not None:
+        for tid in {old_test_id, data.get("test_id")} - {None}:
+            mark_test_snapshot_stale(db, tid)
+    return dict_to_obj(data)
+
+def update_mcq_question_fields(db, question_id: int, fields: Dict[str, Any]):
+    """Overwrite some question fields (e.g. a flipped question's text/options) without touching marks"""
+    data = _store().get("mcq_questions", question_id)
+    if data is None:
+        return None
+    _store().update("mcq_questions", question_id, fields)
+    data.update(fields)
+    mark_test_snapshot_stale(db, data.get("test_id"))
+    return dict_to_obj(data)
 
 def delete_mcq_question(db, question_id: int):
-    doc_ref = firestore_db.collection("mcq_questions").document(str(question_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        test_id = data.get("test_id")
-        doc_ref.delete()
-        
-        # Update test question count
-        test_doc = firestore_db.collection("mcq_tests").document(str(test_id)).get()
-        if test_doc.exists:
-            all_qs = firestore_db.collection("mcq_questions").where(filter=FieldFilter("test_id", "==", test_id)).get()
-            total_questions = len(all_qs)
-            total_marks = sum([q.to_dict().get("marks", 1) for q in all_qs])
-            
-            test_doc.reference.update({
-                "total_questions": total_questions,
-                "total_marks": total_marks
-            })
-            
-        return dict_to_obj(data)
-    return None
+    def _delete(txn):
+        data = txn.get("mcq_questions", question_id)
+        if data is None:
+            return None
+        test_exists = txn.get("mcq_tests", data.get("test_id")) is not None
+        txn.delete("mcq_questions", question_id)
+        if test_exists:
+            txn.update("mcq_tests", data.get("test_id"), _totals_delta(-1, -_question_marks(data)))
+        return data
+
+    data = _store().run_transaction(_delete)
+    bump_catalog_version("mcq_tests")
+    if data is not None:
+        mark_test_snapshot_stale(db, data.get("test_id"))
+    return dict_to_obj(data)
+
+def rebuild_test_aggregates(db, test_id: int = None):
+    """Repair job: recompute total_questions / total_marks from the questions themselves.
+
+    With a test_id only that test is rescanned; otherwise every question is read once
+    and all tests are rewritten in batches. Returns the tests whose totals changed.
+    """
+    if test_id is not None:
+        q_docs = _store().query("mcq_questions", filters=[("test_id", "==", test_id)], select=["test_id", "marks"])
+        test_docs = [doc for doc in [_store().get("mcq_tests", test_id)] if doc is not None]
+    else:
+        q_docs = _store().query("mcq_questions", select=["test_id", "marks"])
+        test_docs = _store().query("mcq_tests", select=["id", "total_questions", "total_marks"])
+
+    totals = {}
+    for q_dict in q_docs:
+        count, marks = totals.get(q_dict.get("test_id"), (0, 0))
+        totals[q_dict.get("test_id")] = (count + 1, marks + _question_marks(q_dict))
+
+    fixed = []
+    batch = _store().batch()
+    for t_dict in test_docs:
+        count, marks = totals.get(t_dict.get("id"), (0, 0))
+        if t_dict.get("total_questions") == count and t_dict.get("total_marks") == marks:
+            continue
+        batch.update("mcq_tests", t_dict.get("id"), {"total_questions": count, "total_marks": marks})
+        fixed.append({"id": t_dict.get("id"), "total_questions": count, "total_marks": marks})
+        if len(batch) == BATCH_LIMIT:
+            batch.commit()
+    batch.commit()
+    if fixed:
+        bump_catalog_version("mcq_tests")
+    for t_dict in fixed:
+        mark_test_snapshot_stale(db, t_dict["id"])
+    return fixed
 
 
 # ================== TEST ATTEMPTS ==================
 
-def create_test_attempt(db, attempt: schemas.TestAttemptCreate, score: int, total_marks: int, 
-                        correct: int, wrong: int, unanswered: int, time_taken: int):
+def create_test_attempt(db, attempt: schemas.TestAttemptCreate, score: int, total_marks: int,
+                        correct: int, wrong: int, unanswered: int, time_taken: int,
+                        question_ids: List[int] = None):
     att_dict = attempt.dict()
-    docs = firestore_db.collection("test_attempts").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    att_dict.pop("attempt_token", None)
+    if question_ids is not None:
+        # The questions this attempt was served, so regrades score the same set
+        att_dict["question_ids_json"] = json.dumps(question_ids)
+    new_id = id_allocator.allocate_id(_store(), "test_attempts")
     att_dict["id"] = new_id
     att_dict["score"] = score
     att_dict["total_marks"] = total_marks
@@ -496,48 +856,151 @@ def create_test_attempt(db, attempt: schemas.TestAttemptCreate, score: int, tota
     att_dict["unanswered"] = unanswered
     att_dict["time_taken_seconds"] = time_taken
     att_dict["completed_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    firestore_db.collection("test_attempts").document(str(new_id)).set(att_dict)
-    return dict_to_obj(att_dict)
 
-def get_test_attempts(db, test_id: int = None):
-    query = firestore_db.collection("test_attempts")
-    if test_id:
-        query = query.where(filter=FieldFilter("test_id", "==", test_id))
-    docs = query.get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("id", 0), reverse=True)
-    return objs
+    buffer = submission_buffer.get_buffer()
+    if buffer is not None:
+        # Write-behind: durable locally now, in test_attempts at the next flush
+        buffer.append(att_dict)
+        buffer.maybe_flush(_store())
+    else:
+        # When it reached test_attempts; item_stats.RebuildJob splits its scan on this
+        att_dict["written_at"] = time.time()
+        _store().set("test_attempts", new_id, att_dict)
+        _record_attempts([att_dict])
+    return dict_to_obj(att_dict)
 
-def get_all_test_attempts(db):
-    docs = firestore_db.collection("test_attempts").get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("id", 0), reverse=True)
-    return objs[:100]
+def _record_attempts(attempts: List[dict], replay: bool = False):
+    """Roll newly written attempts into the per-test leaderboards and item stats.
+    A replay may repeat attempts already counted, so item stats are marked stale instead"""
+    by_test = {}
+    for attempt in attempts:
+        by_test.setdefault(attempt.get("test_id"), []).append(attempt)
+    for test_id, group in by_test.items():
+        # The attempts themselves are saved; the rebuilds can catch these up later
+        try:
+            leaderboard.merge(_store(), test_id, group)
+        except Exception as e:
+            print(f"Leaderboard update failed for test {test_id}, rebuilding on next read: {e}")
+        if replay:
+            # The increments aren't idempotent; a rebuild recounts from the attempts
+            item_stats.mark_stale(_store(), test_id)
+            continue
+        try:
+            # Marked against the key version each attempt was scored with
+            key_for = lambda attempt: get_answer_key(None, attempt.get("test_id"), attempt.get("test_version"))
+            item_stats.record(_store(), test_id, item_stats.tally(key_for, group))
+        except Exception as e:
+            print(f"Item stats update failed for test {test_id}, marking them stale: {e}")
+            item_stats.mark_stale(_store(), test_id)
+
+# Buffered submissions are rolled up when they are flushed
+submission_buffer.on_write(_record_attempts)
+
+def get_leaderboard(db, test_id: int, limit: int = leaderboard.SIZE):
+    return leaderboard.get(_store(), test_id, limit)
+
+ITEM_STATS_REPAIR_BUDGET = 10  # seconds a read spends repairing stale stats; later reads continue
+
+def get_item_stats(db, test_id: int):
+    stats = item_stats.get(_store(), test_id)
+    if stats["stale"]:
+        job = item_stats.get_job(_store(), item_stats.job_id_for(test_id))
+        # Restart unless a rebuild is already under way, which picks up the missed attempts too
+        restart = not job or job.get("status") != "running"
+        repaired = rebuild_item_stats(db, test_id, restart=restart, time_budget=ITEM_STATS_REPAIR_BUDGET)
+        if repaired is not None and repaired["done"]:
+            stats = item_stats.get(_store(), test_id)
+    return stats
+
+def rebuild_item_stats(db, test_id: int, restart: bool = False, **kwargs):
+    """Backfill a test's item stats from its stored attempts, against the current key
+    (resumable, see item_stats.RebuildJob); None if the test has no answer key"""
+    key = get_answer_key(db, test_id)
+    if key is None:
+        return None
+    flush_submissions(db)
+    return item_stats.rebuild(_store(), test_id, key, restart=restart, **kwargs)
+
+def flush_submissions(db) -> int:
+    """Write any buffered submissions to test_attempts (no-op when not buffering)"""
+    return submission_buffer.flush(_store())
+
+def iter_test_attempts(db, test_id: int = None, since: str = None, page_size: int = 500):
+    """Every matching attempt, oldest first, fetched a page at a time with a cursor
+    (memory stays at one page however many there are). since is a completed_at string."""
+    filters = [("test_id", "==", test_id)] if test_id else []
+    if since:
+        filters.append(("completed_at", ">=", since))
+    order_by = [("completed_at", ASCENDING), ("id", ASCENDING)]
+    cursor = None
+    while True:
+        page = _store().query("test_attempts", filters=filters or None, order_by=order_by,
+                              start_after=cursor, limit=page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        cursor = {"completed_at": page[-1].get("completed_at"), "id": page[-1].get("id")}
+
+# Ids are leased in blocks per instance (id_allocator), so newest means completed_at
+ATTEMPTS_ORDER = [("completed_at", DESCENDING), ("id", DESCENDING)]
+
+def get_test_attempts(db, test_id: int = None, limit: int = None):
+    """Newest first; the store does the ordering and limit (see index_manifest.py)"""
+    filters = [("test_id", "==", test_id)] if test_id else None
+    return list_to_objs(_store().query("test_attempts", filters=filters, order_by=ATTEMPTS_ORDER, limit=limit))
+
+def get_all_test_attempts(db, limit: int = 100):
+    return get_test_attempts(db, limit=limit)
+
+def get_test_attempts_page(db, limit: int = 100, cursor: str = None, test_id: int = None):
+    filters = [("test_id", "==", test_id)] if test_id else None
+    return _page("test_attempts", ATTEMPTS_ORDER, limit, cursor, filters)
+
+
+# ================== EXAM SCHEDULE ==================
+
+def create_exam_window(db, window: schemas.ExamWindowCreate):
+    win_dict = window.dict()
+    new_id = id_allocator.allocate_id(_store(), "exam_schedule")
+    win_dict["id"] = new_id
+    # Epoch seconds alongside the ISO strings, for range queries and comparisons
+    win_dict["start_ts"] = window.start_at.timestamp()
+    win_dict["end_ts"] = window.end_at.timestamp()
+    win_dict["start_at"] = window.start_at.isoformat()
+    win_dict["end_at"] = window.end_at.isoformat()
+    win_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    _store().set("exam_schedule", new_id, win_dict)
+    return dict_to_obj(win_dict)
+
+def get_exam_windows(db, ending_after: float = None):
+    """Windows ordered by start; ending_after (epoch seconds) skips those already over"""
+    filters = [("end_ts", ">", ending_after)] if ending_after is not None else None
+    docs = _store().query("exam_schedule", filters=filters)
+    query_stats.sort(docs, [("start_ts", ASCENDING)])
+    return list_to_objs(docs)
+
+def delete_exam_window(db, window_id: int):
+    return _delete_doc("exam_schedule", window_id)
 
 
 # ================== COURSES ==================
 
 def get_courses(db, is_free: bool = None):
-    query = firestore_db.collection("courses").where(filter=FieldFilter("is_active", "==", True))
-    if is_free is not None:
-        query = query.where(filter=FieldFilter("is_free", "==", is_free))
-    docs = query.get()
-    objs = list_to_objs(_docs_to_list(docs))
-    objs.sort(key=lambda x: x.get("order_index", 0))
-    return objs
+    def _load():
+        filters = [("is_active", "==", True)]
+        if is_free is not None:
+            filters.append(("is_free", "==", is_free))
+        docs = _store().query("courses", filters=filters)
+        query_stats.sort(docs, [("order_index", ASCENDING)])
+        return docs
+    return _cached_catalog("courses", is_free, _load)
 
 def get_course(db, course_id: int):
-    doc = firestore_db.collection("courses").document(str(course_id)).get()
-    return dict_to_obj(_doc_to_dict(doc))
+    return dict_to_obj(_store().get("courses", course_id))
 
 def create_course(db, course: schemas.CourseCreate):
     course_dict = course.dict()
-    docs = firestore_db.collection("courses").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "courses")
     course_dict["id"] = new_id
     if "is_free" not in course_dict:
         course_dict["is_free"] = True
@@ -546,73 +1009,76 @@ def create_course(db, course: schemas.CourseCreate):
     if "order_index" not in course_dict:
         course_dict["order_index"] = 0
     course_dict["created_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-    firestore_db.collection("courses").document(str(new_id)).set(course_dict)
+
+    _store().set("courses", new_id, course_dict)
+    bump_catalog_version("courses")
     return dict_to_obj(course_dict)
 
 def update_course(db, course_id: int, course: schemas.CourseCreate):
-    doc_ref = firestore_db.collection("courses").document(str(course_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
+    data = _store().get("courses", course_id)
+    if data is not None:
         for key, value in course.dict().items():
             if value is not None:
                 data[key] = value
-        doc_ref.update(data)
+        _store().update("courses", course_id, data)
+        bump_catalog_version("courses")
         return dict_to_obj(data)
     return None
 
 def delete_course(db, course_id: int):
-    doc_ref = firestore_db.collection("courses").document(str(course_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    data = _delete_doc("courses", course_id)
+    bump_catalog_version("courses")
+    return data
 
 # --- Question Bank PDF ---
 def create_question_bank_pdf(db, pdf: schemas.QuestionBankPDFCreate):
     pdf_dict = pdf.dict()
-    docs = firestore_db.collection("question_bank_pdfs").order_by("id", direction="DESCENDING").limit(1).get()
-    new_id = 1
-    if docs:
-        new_id = docs[0].to_dict().get("id", 0) + 1
-        
+    new_id = id_allocator.allocate_id(_store(), "question_bank_pdfs")
     pdf_dict["id"] = new_id
     pdf_dict["created_at"] = datetime.datetime.now().isoformat()
     pdf_dict["download_count"] = 0
     pdf_dict["is_active"] = True
-    
-    firestore_db.collection("question_bank_pdfs").document(str(new_id)).set(pdf_dict)
+
+    _store().set("question_bank_pdfs", new_id, pdf_dict)
+    _pdf_index.add(pdf_dict)
+    cache_generation.bump()
     return dict_to_obj(pdf_dict)
 
+def get_question_bank_pdf(db, pdf_id: int):
+    return dict_to_obj(_store().get("question_bank_pdfs", pdf_id))
+
 def get_question_bank_pdfs(db, board: str = None, class_name: str = None, subject_name: str = None):
-    query = firestore_db.collection("question_bank_pdfs")
+    filters = []
     if board:
-        query = query.where(filter=FieldFilter("board", "==", board))
+        filters.append(("board", "==", board))
     if class_name:
-        query = query.where(filter=FieldFilter("class_name", "==", class_name))
+        filters.append(("class_name", "==", class_name))
     if subject_name:
-        query = query.where(filter=FieldFilter("subject_name", "==", subject_name))
-    
+        filters.append(("subject_name", "==", subject_name))
+
     # Firestore composite index limitation: Cannot order_by a field different from equality filters.
     # Therefore, we fetch the docs and sort them in Python.
-    docs = query.get()
-    
-    # Convert to objects
-    results = list_to_objs(_docs_to_list(docs))
-    
+    results = list_to_objs(_store().query("question_bank_pdfs", filters=filters))
+
     # Sort descending by id
-    results.sort(key=lambda x: getattr(x, 'id', 0), reverse=True)
-    
+    query_stats.sort(results, [("id", DESCENDING)])
+
     return results
 
 def delete_question_bank_pdf(db, pdf_id: int):
-    doc_ref = firestore_db.collection("question_bank_pdfs").document(str(pdf_id))
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        doc_ref.delete()
-        return dict_to_obj(data)
-    return None
+    data = _delete_doc("question_bank_pdfs", pdf_id)
+    _pdf_index.remove(pdf_id)
+    cache_generation.bump()
+    return data
+
+# Metadata-only search index (see pdf_search.py); writes on other instances reload it
+_pdf_index = pdf_search.PdfSearchIndex()
+cache_generation.on_change(_pdf_index.invalidate)
+
+def search_question_bank_pdfs(db, q: str = "", board: str = None, class_name: str = None,
+                              subject_name: str = None, limit: int = 20, offset: int = 0):
+    cache_generation.check()
+    if not _pdf_index.loaded:
+        _pdf_index.load(_store().query("question_bank_pdfs", select=pdf_search.METADATA_FIELDS))
+    return _pdf_index.search(q, board=board, class_name=class_name, subject_name=subject_name,
+                             limit=limit, offset=offset)
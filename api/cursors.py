@@ -0,0 +1,39 @@
+"""
+Opaque pagination cursors.
+
+A cursor is the order-by values of the last document on a page, JSON encoded and
+base64url'd. It goes back to the store as start_after, so Firestore starts reading
+right after that document; with offset it reads (and bills) every skipped document
+first, which makes page 50 cost fifty pages of reads.
+"""
+import base64
+import json
+from typing import List, Optional, Tuple
+
+
+def encode(doc: dict, order_by) -> str:
+    values = [doc.get(field) for field, _ in order_by]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def decode(token: str, order_by) -> dict:
+    """start_after dict for token; ValueError if it isn't a cursor for this ordering"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(order_by):
+        raise ValueError("Invalid cursor")
+    return {field: value for (field, _), value in zip(order_by, values)}
+
+
+def page(store, collection: str, order_by, limit: int, cursor: Optional[str] = None,
+         filters=None) -> Tuple[List[dict], Optional[str]]:
+    """One page of documents and the cursor for the next one (None on the last page)"""
+    start_after = decode(cursor, order_by) if cursor else None
+    # One extra document says whether there is a next page
+    docs = store.query(collection, filters=filters, order_by=order_by, start_after=start_after, limit=limit + 1)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode(docs[-1], order_by)
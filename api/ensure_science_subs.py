@@ -1,4 +1,6 @@
 from api.firebase_config import get_db
+from api.id_allocator import allocate_id
+from api.storage_firestore import FirestoreBackend
 
 def ensure_science_subjects(class_id):
     db = get_db()
@@ -8,11 +10,7 @@ def ensure_science_subjects(class_id):
     if not s1_query:
         # Create
         print(f"Creating {s1_name}")
-        # Need to find next ID
-        all_subs = db.collection("subjects").order_by("id", direction="DESCENDING").limit(1).get()
-        new_id = 1
-        if all_subs:
-            new_id = int(all_subs[0].id) + 1
+        new_id = allocate_id(FirestoreBackend(db), "subjects")
         db.collection("subjects").document(str(new_id)).set({
             "id": new_id,
             "class_id": class_id,
@@ -32,10 +30,7 @@ def ensure_science_subjects(class_id):
     if not s2_query:
         # Create
         print(f"Creating {s2_name}")
-        all_subs = db.collection("subjects").order_by("id", direction="DESCENDING").limit(1).get()
-        new_id = 1
-        if all_subs:
-            new_id = int(all_subs[0].id) + 1
+        new_id = allocate_id(FirestoreBackend(db), "subjects")
         db.collection("subjects").document(str(new_id)).set({
             "id": new_id,
             "class_id": class_id,
@@ -0,0 +1,59 @@
+"""
+Exam windows and cache prewarming.
+
+A scheduled exam hammers one test for its whole window, and the first students in
+would otherwise all pay for loading the snapshot and answer key. Each window in
+`exam_schedule` (test_id, start_at, end_at) is prewarmed PREWARM_LEAD seconds before
+it opens (times are stored in UTC with epoch seconds alongside; input without an offset
+is academy local time, see schemas.ExamWindowBase): the test, its published questions and its answer key are loaded into this
+process's caches and pinned there (LRUCache.pin) until the window closes, so neither
+eviction nor TTL expiry can push them out mid-exam. An edit during the exam still
+replaces the cached copy; the pin carries over to the reloaded entry.
+
+Prewarming runs from maybe_prewarm() on the student test path (at most once every
+CHECK_INTERVAL seconds per instance) and from POST /api/exams/prewarm, which a
+scheduler can call just before each window.
+"""
+import os
+import threading
+import time
+from typing import List
+
+import crud
+
+PREWARM_LEAD = float(os.environ.get("EXAM_PREWARM_LEAD", 10 * 60))  # seconds before start
+CHECK_INTERVAL = float(os.environ.get("EXAM_PREWARM_INTERVAL", 60))
+
+_lock = threading.Lock()
+_next_check = 0.0
+
+
+def prewarm_due(db, now: float = None) -> List[dict]:
+    """Pin every test whose window is open or opens within PREWARM_LEAD seconds"""
+    now = time.time() if now is None else now
+    warmed = []
+    for window in crud.get_exam_windows(db, ending_after=now):
+        if window.get("start_ts", 0) - PREWARM_LEAD > now:
+            continue
+        version = crud.pin_published_test(db, window["test_id"], window["end_ts"])
+        warmed.append({
+            "window_id": window["id"],
+            "test_id": window["test_id"],
+            "version": version,
+            "pinned_until": window["end_at"],
+        })
+    return warmed
+
+
+def maybe_prewarm(db):
+    """prewarm_due(), rate limited per process; never fails the request that triggered it"""
+    global _next_check
+    now = time.monotonic()
+    with _lock:
+        if now < _next_check:
+            return
+        _next_check = now + CHECK_INTERVAL
+    try:
+        prewarm_due(db)
+    except Exception as e:
+        print(f"Exam prewarm failed: {e}")
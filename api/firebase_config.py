@@ -2,7 +2,11 @@ import os
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 
+# Raw service account JSON the app was initialized with (see loaded_credentials)
+_loaded_credentials = None
+
 def initialize_firebase():
+    global _loaded_credentials
     if not firebase_admin._apps:
         try:
             # First check for an environment variable (used in Vercel)
@@ -12,20 +16,28 @@ def initialize_firebase():
                 import json
                 cred_dict = json.loads(firebase_creds_str)
                 cred = credentials.Certificate(cred_dict)
+                raw_creds = firebase_creds_str
                 print("Firebase Admin initialized from environment variable.")
             else:
                 # Fallback to local file
                 cred_path = os.path.join(os.path.dirname(__file__), "firebase_credentials.json")
                 cred = credentials.Certificate(cred_path)
+                with open(cred_path) as f:
+                    raw_creds = f.read()
                 print("Firebase Admin initialized from local JSON file.")
                 
             firebase_admin.initialize_app(cred)
+            _loaded_credentials = raw_creds
         except Exception as e:
             print(f"Error initializing Firebase: {e}")
 
 # Initialize when imported
 initialize_firebase()
 
+def loaded_credentials():
+    """Service account JSON from FIREBASE_CREDENTIALS or firebase_credentials.json, whichever was used"""
+    return _loaded_credentials
+
 def get_db():
     try:
         return firestore.client()
@@ -0,0 +1,55 @@
+"""
+Conditional GET support for read endpoints.
+
+conditional_json() serializes a payload the way FastAPI's JSONResponse does, tags it
+with a strong ETag (hash of the body) and answers 304 Not Modified when the client's
+If-None-Match already names it. Content hashes rather than catalog versions, because
+versions are per-instance counters and the same number can mean different data on
+two serverless instances.
+"""
+import hashlib
+import json
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# Data that can change after an admin edit: the browser may keep it but must revalidate
+REVALIDATE = "no-cache"
+# Per-user or randomised responses
+PRIVATE = "private, no-cache"
+# Data that ships with the code (e.g. BOARDS_DATA)
+STATIC = "public, max-age=3600, stale-while-revalidate=86400"
+
+
+def render_json(payload) -> bytes:
+    return json.dumps(
+        jsonable_encoder(payload),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return "*" in candidates or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def conditional_json(request: Request, payload, cache_control: str = REVALIDATE, body: bytes = None,
+                     etag: str = None) -> Response:
+    """JSON response with ETag/Cache-Control, or an empty 304 if the client's copy is current"""
+    if body is None:
+        body = render_json(payload)
+    if etag is None:
+        etag = make_etag(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
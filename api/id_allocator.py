@@ -0,0 +1,103 @@
+"""
+Integer ID allocator for document collections.
+
+Documents keep the legacy integer ids (document name == str(id)), but instead of
+querying the current max id before every insert, each process leases a block of
+ids from a counter document (`counters/<collection>`) in a single transaction and
+hands them out locally until the block is used up. Concurrent writers on other
+instances lease disjoint blocks, so ids never collide. Gaps are expected when an
+instance dies with part of a block unused.
+"""
+import threading
+from typing import List
+
+try:
+    from storage import DESCENDING
+except ImportError:
+    from .storage import DESCENDING
+
+COUNTERS_COLLECTION = "counters"
+DEFAULT_BLOCK_SIZE = 10
+
+# Collections that see bursts of inserts lease bigger blocks
+BLOCK_SIZES = {
+    "test_attempts": 50,
+    "mcq_questions": 50,
+    "enquiries": 20,
+    "demo_bookings": 20,
+}
+
+_guard = threading.Lock()
+_locks = {}
+_leases = {}  # collection -> [next_id, end_id)
+
+
+def _lock_for(collection):
+    with _guard:
+        if collection not in _locks:
+            _locks[collection] = threading.Lock()
+        return _locks[collection]
+
+
+def _max_existing_id(store, collection) -> int:
+    docs = store.query(collection, order_by=[("id", DESCENDING)], limit=1, select=["id"])
+    if docs:
+        return docs[0].get("id", 0) or 0
+    return 0
+
+
+def _reserve_block(store, collection: str, size: int) -> int:
+    """Reserve `size` ids in one transaction and return the first one"""
+    # Only needed the first time a collection is allocated from; a racing writer at
+    # worst seeds from a slightly older max, which the counter read below settles.
+    floor = None
+
+    def _reserve(txn):
+        nonlocal floor
+        counter = txn.get(COUNTERS_COLLECTION, collection)
+        if counter is not None:
+            start = counter.get("next_id", 1)
+        else:
+            # First allocation for this collection: continue after the existing data
+            if floor is None:
+                floor = _max_existing_id(store, collection) + 1
+            start = floor
+        txn.set(COUNTERS_COLLECTION, collection, {"next_id": start + size})
+        return start
+
+    return store.run_transaction(_reserve)
+
+
+def allocate_ids(store, collection: str, count: int) -> List[int]:
+    """Hand out `count` unused ids for `collection`, leasing new blocks as needed"""
+    ids = []
+    with _lock_for(collection):
+        lease = _leases.get(collection)
+        while len(ids) < count:
+            if not lease or lease[0] >= lease[1]:
+                size = max(BLOCK_SIZES.get(collection, DEFAULT_BLOCK_SIZE), count - len(ids))
+                start = _reserve_block(store, collection, size)
+                lease = [start, start + size]
+                _leases[collection] = lease
+            take = min(count - len(ids), lease[1] - lease[0])
+            ids.extend(range(lease[0], lease[0] + take))
+            lease[0] += take
+    return ids
+
+
+def allocate_id(store, collection: str) -> int:
+    return allocate_ids(store, collection, 1)[0]
+
+
+def resync_counter(store, collection: str):
+    """Move the counter past the highest stored id (run after bulk imports that set ids directly)"""
+    floor = _max_existing_id(store, collection) + 1
+
+    def _resync(txn):
+        counter = txn.get(COUNTERS_COLLECTION, collection)
+        current = counter.get("next_id", 1) if counter is not None else 1
+        txn.set(COUNTERS_COLLECTION, collection, {"next_id": max(current, floor)})
+
+    store.run_transaction(_resync)
+    with _lock_for(collection):
+        _leases.pop(collection, None)
@@ -3,7 +3,8 @@ Linear Academy API - Main FastAPI Application
 This file serves as the single entry point for all Vercel serverless functions.
 ULTRA-DEFENSIVE: Wraps all imports to prevent crashes on Vercel.
 """
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Query
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from typing import Optional
@@ -46,7 +47,19 @@ except ImportError:
 
 # New Firestore imports
 import crud
-from firebase_config import get_db
+import storage
+import test_snapshots
+import scoring
+import attempt_tokens
+import exam_schedule
+from firebase_config import get_db as get_firestore_db
+
+def get_db():
+    """Request dependency: the Firestore client, or the storage backend when STORAGE_BACKEND isn't firestore"""
+    backend = storage.get_backend()
+    if backend.name == "firestore":
+        return get_firestore_db()
+    return backend
 
 
 from fastapi.middleware.gzip import GZipMiddleware
@@ -68,20 +81,51 @@ app.add_middleware(
 # Enable Gzip compression (minimum size 100 bytes)
 app.add_middleware(GZipMiddleware, minimum_size=100)
 
-# Simple in-memory cache helper
-_CACHE = {}
-CACHE_TTL = 300 # 5 minutes
-
-def get_cached_data(key):
-    if key in _CACHE:
-        val, expiry = _CACHE[key]
-        if time.time() < expiry:
-            return val
-        del _CACHE[key]
-    return None
-
-def set_cached_data(key, val, ttl=CACHE_TTL):
-    _CACHE[key] = (val, time.time() + ttl)
+# In-memory response cache (size-bounded LRU, single-flight loads; see cache.py).
+# Writes on any instance clear it everywhere via cache_generation, so the TTL is only a backstop.
+from cache import LRUCache
+import cache_generation
+CACHE_TTL = 3600 # 1 hour
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 32 * 1024 * 1024))
+api_cache = LRUCache(max_bytes=CACHE_MAX_BYTES, default_ttl=CACHE_TTL)
+cache_generation.on_change(api_cache.clear)
+
+@app.middleware("http")
+async def bump_cache_generation_once(request: Request, call_next):
+    """A write request may touch several cached things; one generation bump covers them all"""
+    state = None
+    try:
+        with cache_generation.deferred() as state:
+            return await call_next(request)
+    finally:
+        if state is not None and state.pending:
+            await run_in_threadpool(cache_generation.bump)
+
+def get_cached(key, loader):
+    cache_generation.check()
+    return api_cache.get_or_load(key, loader)
+
+# ETag / 304 handling for read endpoints
+from http_cache import conditional_json, render_json, make_etag, PRIVATE, REVALIDATE, STATIC
+
+# Grading fields of a question; changing any of them means existing attempts need regrading
+GRADING_FIELDS = ("correct_option", "marks", "test_id")
+REGRADE_INLINE_BUDGET = 20  # seconds; POST /api/tests/{id}/regrade resumes anything left
+
+def _regrade_after_edit(db, before, after):
+    """Regrade the affected tests if an edit changed how the question is graded"""
+    if not before or not after or all(before.get(f) == after.get(f) for f in GRADING_FIELDS):
+        return None
+    test_ids = {before.get("test_id"), after.get("test_id")} - {None}
+    return [crud.regrade_test_attempts(db, tid, restart=True, time_budget=REGRADE_INLINE_BUDGET) for tid in sorted(test_ids)]
+
+def _cascade_response(result, message):
+    """Shape a cascade_delete report; 202 tells the client to call DELETE again to resume"""
+    from fastapi.responses import JSONResponse
+    body = {k: v for k, v in result.items() if k != "item"}
+    if not result.get("done"):
+        return JSONResponse(status_code=202, content={"message": "Deletion in progress, call again to resume", **body})
+    return {"message": message, **body}
 
 # ================== ROOT ==================
 @app.get("/")
@@ -132,6 +176,27 @@ def debug_info():
         "db_available": DB_AVAILABLE
     }
 
+@app.get("/api/cache-stats")
+def cache_stats():
+    return api_cache.stats()
+
+import query_stats
+
+@app.get("/api/query-stats")
+def read_query_stats():
+    """Recorded query shapes, worst read amplification first (needs QUERY_STATS=1)"""
+    return {"enabled": query_stats.ENABLED, "shapes": query_stats.report()}
+
+@app.get("/api/query-stats/indexes")
+def read_query_stats_indexes():
+    """firestore.indexes.json for the recorded shapes, in-memory sorts included"""
+    return query_stats.manifest()
+
+@app.delete("/api/query-stats")
+def reset_query_stats():
+    query_stats.reset()
+    return {"message": "Query stats reset"}
+
 # Database is already imported above
 if DB_AVAILABLE:
     try:
@@ -147,91 +212,71 @@ if DB_AVAILABLE and schemas is not None:
     # ================== SITE CONFIG ==================
     @app.get("/api/config")
     def read_config(db = Depends(get_db)):
-        cache_key = "site_config"
-        cached = get_cached_data(cache_key)
-        if cached:
-            return cached
-
         try:
-            config = crud.get_site_config(db)
-            if config is None:
-                res = {
-                    "id": 0,
-                    "phone_number": "+91 87961 26936", 
-                    "email": "info@linearclasses.com", 
-                    "address": "Sr no 253 khese park, Lane number 18D lohegaon pune 411032"
-                }
-                set_cached_data(cache_key, res)
-                return res
-            
-            # Hotfix: Enforce new contact info if old info is present
-            if "Nagpur" in config.address or "98765" in config.phone_number or "7028" in config.phone_number:
-                config.phone_number = "+91 87961 26936"
-                config.address = "Sr no 253 khese park, Lane number 18D lohegaon pune 411032"
-                try:
-                    db.commit()
-                    db.refresh(config)
-                except:
-                    pass # Ignore db errors, just return correct data
-            
-            res = dict(config) if hasattr(config, "__dict__") else config
-            set_cached_data(cache_key, res)
-            return res
+            return get_cached("site_config", lambda: _load_config(db))
         except Exception as e:
              raise HTTPException(status_code=500, detail=str(e))
 
+    def _load_config(db):
+        config = crud.get_site_config(db)
+        if config is None:
+            return {
+                "id": 0,
+                "phone_number": "+91 87961 26936", 
+                "email": "info@linearclasses.com", 
+                "address": "Sr no 253 khese park, Lane number 18D lohegaon pune 411032"
+            }
+        
+        # Hotfix: Enforce new contact info if old info is present
+        if "Nagpur" in config.address or "98765" in config.phone_number or "7028" in config.phone_number:
+            config.phone_number = "+91 87961 26936"
+            config.address = "Sr no 253 khese park, Lane number 18D lohegaon pune 411032"
+            try:
+                db.commit()
+                db.refresh(config)
+            except:
+                pass # Ignore db errors, just return correct data
+        
+        return dict(config) if hasattr(config, "__dict__") else config
+
     @app.post("/api/config")
     def update_config(config: schemas.SiteConfigCreate, db = Depends(get_db)):
-        return crud.create_or_update_site_config(db, config)
+        result = crud.create_or_update_site_config(db, config)
+        api_cache.delete("site_config")
+        return result
 
     # ================== STUDENTS ==================
+    def _cursor_page(fetch, db, limit, cursor):
+        try:
+            return fetch(db, limit=limit, cursor=cursor or None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     @app.get("/api/students")
-    def read_students(skip: int = 0, limit: int = 100, db = Depends(get_db)):
-        cache_key = f"students_{skip}_{limit}_sorted"
-        cached = get_cached_data(cache_key)
-        if cached:
-            return cached
+    def read_students(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                      db = Depends(get_db)):
+        """Toppers by grade. Pass cursor (empty for the first page) to get {"items", "next_cursor"}."""
+        if cursor is not None:
+            page = get_cached(f"students_cursor_{cursor}_{limit}",
+                              lambda: _cursor_page(crud.get_ranked_students_page, db, limit, cursor))
+            return conditional_json(request, {"items": [_student_item(s) for s in page["items"]],
+                                              "next_cursor": page["next_cursor"]})
+        students = get_cached(f"students_{skip}_{limit}_sorted", lambda: _load_students(db, skip, limit))
+        return conditional_json(request, students)
+
+    def _student_item(s):
+        return {
+            "id": s.id,
+            "name": s.name,
+            "rank": s.rank,
+            "description": s.description,
+            "is_active": s.is_active,
+            "image_url": f"/api/students/{s.id}/image" if s.image_url else None,
+        }
 
-        students = crud.get_students(db, skip=0, limit=1000) # Fetch all for proper sorting
-        
-        # Transform and parse grade
-        import re
-        results = []
-        for s in students:
-            # Try to extract a numeric grade for sorting
-            grade_val = 0.0
-            if s.rank:
-                match = re.search(r"(\d+\.?\d*)", s.rank)
-                if match:
-                    try:
-                        grade_val = float(match.group(1))
-                    except:
-                        pass
-            
-            s_dict = {
-                "id": s.id,
-                "name": s.name,
-                "rank": s.rank,
-                "description": s.description,
-                "is_active": s.is_active,
-                "image_url": f"/api/students/{s.id}/image" if s.image_url else None,
-                "_grade": grade_val # Hidden field for sorting
-            }
-            results.append(s_dict)
-        
-        # Sort by grade (descending)
-        results.sort(key=lambda x: x["_grade"], reverse=True)
-        
-        # Remove hidden field and apply pagination
-        final_results = []
-        for r in results:
-            del r["_grade"]
-            final_results.append(r)
-            
-        paginated_results = final_results[skip : skip + limit]
-        
-        set_cached_data(cache_key, paginated_results)
-        return paginated_results
+    def _load_students(db, skip, limit):
+        # Ordered by the grade_value stored at create time, so only the page is read
+        return [_student_item(s) for s in crud.get_ranked_students(db, skip=skip, limit=limit)]
 
     @app.get("/api/students/{student_id}/image")
     def serve_student_image(student_id: int, db = Depends(get_db)):
@@ -279,11 +324,23 @@ if DB_AVAILABLE and schemas is not None:
 
     @app.post("/api/students")
     def create_student(student: schemas.StudentCreate, db = Depends(get_db)):
-        return crud.create_student(db, student)
+        result = crud.create_student(db, student)
+        api_cache.delete_prefix("students_")
+        return result
+
+    @app.post("/api/students/backfill-grades")
+    def backfill_student_grades(db = Depends(get_db)):
+        """Recompute grade_value from rank for every student (e.g. after bulk imports).
+        Reads never backfill; run this (or scripts/backfill_student_grades.py) after a deploy"""
+        updated = crud.backfill_student_grades(db)
+        api_cache.delete_prefix("students_")
+        return {"updated": updated}
 
     @app.delete("/api/students/{student_id}")
     def delete_student(student_id: int, db = Depends(get_db)):
-        return crud.delete_student(db, student_id)
+        result = crud.delete_student(db, student_id)
+        api_cache.delete_prefix("students_")
+        return result
 
     # ================== ENQUIRIES ==================
     @app.post("/api/enquiries")
@@ -291,7 +348,10 @@ if DB_AVAILABLE and schemas is not None:
         return crud.create_enquiry(db, enquiry)
 
     @app.get("/api/enquiries")
-    def read_enquiries(skip: int = 0, limit: int = 100, db = Depends(get_db)):
+    def read_enquiries(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db = Depends(get_db)):
+        """Pass cursor (empty for the first page) to get {"items", "next_cursor"}; skip is the old paging"""
+        if cursor is not None:
+            return _cursor_page(crud.get_enquiries_page, db, limit, cursor)
         return crud.get_enquiries(db, skip=skip, limit=limit)
 
     @app.delete("/api/enquiries/{enquiry_id}")
@@ -307,7 +367,10 @@ if DB_AVAILABLE and schemas is not None:
         return crud.create_demo_booking(db, booking)
 
     @app.get("/api/demo-bookings")
-    def read_demo_bookings(skip: int = 0, limit: int = 100, db = Depends(get_db)):
+    def read_demo_bookings(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db = Depends(get_db)):
+        """Pass cursor (empty for the first page) to get {"items", "next_cursor"}; skip is the old paging"""
+        if cursor is not None:
+            return _cursor_page(crud.get_demo_bookings_page, db, limit, cursor)
         return crud.get_demo_bookings(db, skip=skip, limit=limit)
 
     @app.put("/api/demo-bookings/{booking_id}/status")
@@ -326,8 +389,13 @@ if DB_AVAILABLE and schemas is not None:
 
     # ================== ACADEMIC CLASSES ==================
     @app.get("/api/classes")
-    def read_classes(board: str = None, db = Depends(get_db)):
-        return crud.get_academic_classes(db, board=board)
+    def read_classes(request: Request, board: str = None, db = Depends(get_db)):
+        return conditional_json(request, crud.get_academic_classes(db, board=board))
+
+    @app.get("/api/catalog")
+    def read_catalog(request: Request, board: str = None, db = Depends(get_db)):
+        """Whole class -> subject -> series -> test tree, so a page needs one request"""
+        return conditional_json(request, crud.get_catalog_tree(db, board=board))
 
     @app.get("/api/classes/{class_id}")
     def read_class(class_id: int, db = Depends(get_db)):
@@ -382,10 +450,10 @@ if DB_AVAILABLE and schemas is not None:
 
     @app.delete("/api/test-series/{series_id}")
     def delete_test_series(series_id: int, db = Depends(get_db)):
-        series = crud.delete_test_series(db, series_id)
-        if not series:
+        result = crud.delete_test_series(db, series_id)
+        if not result:
             raise HTTPException(status_code=404, detail="Test series not found")
-        return {"message": "Test series deleted"}
+        return _cascade_response(result, "Test series deleted")
 
     # ================== PDF RESOURCES ==================
     @app.get("/api/test-series/{series_id}/pdfs")
@@ -409,8 +477,25 @@ if DB_AVAILABLE and schemas is not None:
 
     # ================== QUESTION BANK ==================
     @app.get("/api/question-bank/pdfs")
-    def read_question_bank_pdfs(board: str = None, class_name: str = None, subject_name: str = None, db = Depends(get_db)):
-        return crud.get_question_bank_pdfs(db, board=board, class_name=class_name, subject_name=subject_name)
+    def read_question_bank_pdfs(request: Request, board: str = None, class_name: str = None, subject_name: str = None, db = Depends(get_db)):
+        pdfs = crud.get_question_bank_pdfs(db, board=board, class_name=class_name, subject_name=subject_name)
+        return conditional_json(request, pdfs)
+
+    @app.get("/api/question-bank/search")
+    def search_question_bank_pdfs(request: Request, q: str = "", board: str = None, class_name: str = None,
+                                  subject_name: str = None, limit: int = Query(20, ge=1, le=100),
+                                  offset: int = Query(0, ge=0), db = Depends(get_db)):
+        """Prefix/token search over PDF metadata with facet counts; no file contents"""
+        return conditional_json(request, crud.search_question_bank_pdfs(
+            db, q, board=board, class_name=class_name, subject_name=subject_name, limit=limit, offset=offset))
+
+    @app.get("/api/question-bank/pdfs/{pdf_id}")
+    def read_question_bank_pdf(pdf_id: int, db = Depends(get_db)):
+        """One PDF including file_url, for downloading a search result"""
+        pdf = crud.get_question_bank_pdf(db, pdf_id)
+        if not pdf:
+            raise HTTPException(status_code=404, detail="Question Bank PDF not found")
+        return pdf
 
     @app.post("/api/question-bank/pdfs")
     def create_question_bank_pdf(pdf: schemas.QuestionBankPDFCreate, db = Depends(get_db)):
@@ -425,19 +510,27 @@ if DB_AVAILABLE and schemas is not None:
 
     # ================== MCQ TESTS ==================
     @app.get("/api/test-series/{series_id}/tests")
-    def read_tests_by_series(series_id: int, db = Depends(get_db)):
-        return crud.get_mcq_tests_by_test_series(db, series_id)
+    def read_tests_by_series(request: Request, series_id: int, db = Depends(get_db)):
+        return conditional_json(request, crud.get_mcq_tests_by_test_series(db, series_id))
 
     @app.get("/api/tests")
-    def read_all_tests(db = Depends(get_db)):
-        return crud.get_all_mcq_tests(db)
+    def read_all_tests(request: Request, db = Depends(get_db)):
+        return conditional_json(request, crud.get_all_mcq_tests(db))
 
     @app.get("/api/tests/{test_id}")
-    def read_test(test_id: int, admin: bool = False, db = Depends(get_db)):
-        test = crud.get_mcq_test(db, test_id)
+    def read_test(request: Request, test_id: int, admin: bool = False, db = Depends(get_db)):
+        if admin:
+            test = crud.get_mcq_test(db, test_id)
+            all_questions = crud.get_questions_by_test(db, test_id)
+        else:
+            exam_schedule.maybe_prewarm(db)
+            # Students read the published snapshot: a single document
+            published = crud.get_published_test(db, test_id)
+            test = published["test"] if published else None
+            all_questions = published["questions"] if published else []
+            version = published["version"] if published else None
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
-        all_questions = crud.get_questions_by_test(db, test_id)
         
         if admin:
             questions = [dict(q) for q in all_questions]
@@ -447,13 +540,25 @@ if DB_AVAILABLE and schemas is not None:
                 selected = all_questions
             else:
                 selected = random.sample(all_questions, questions_to_show)
-            questions = [dict(q) for q in selected]
+            # Stem and options only; answers stay on the server until submit
+            questions = [{field: q.get(field) for field in test_snapshots.STUDENT_FIELDS} for q in selected]
         
-        return {
+        payload = {
             **dict(test),
             "questions": questions,
             "total_questions_in_bank": len(all_questions)
         }
+        if not admin:
+            payload["version"] = version
+            # submit_test scores exactly these questions
+            try:
+                payload["attempt_token"] = attempt_tokens.issue(
+                    test_id, version, [q["id"] for q in questions], getattr(test, "duration_minutes", 0) or 0
+                )
+            except attempt_tokens.SecretNotConfigured as e:
+                raise HTTPException(status_code=503, detail=str(e))
+        # Student copies are a random sample, so only the admin view is worth revalidating
+        return conditional_json(request, payload, cache_control=PRIVATE if not admin else REVALIDATE)
 
     @app.post("/api/tests")
     def create_test(test: schemas.MCQTestCreate, db = Depends(get_db)):
@@ -468,10 +573,35 @@ if DB_AVAILABLE and schemas is not None:
 
     @app.delete("/api/tests/{test_id}")
     def delete_test(test_id: int, db = Depends(get_db)):
-        test = crud.delete_mcq_test(db, test_id)
-        if not test:
+        result = crud.delete_mcq_test(db, test_id)
+        if not result:
             raise HTTPException(status_code=404, detail="Test not found")
-        return {"message": "Test deleted"}
+        return _cascade_response(result, "Test deleted")
+
+    @app.post("/api/tests/{test_id}/regrade")
+    def regrade_test(test_id: int, restart: bool = False, db = Depends(get_db)):
+        """Re-score all attempts against the current answer key; call again while done is false"""
+        result = crud.regrade_test_attempts(db, test_id, restart=restart)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Test not found")
+        if not result.get("done"):
+            from fastapi.responses import JSONResponse
+            return JSONResponse(status_code=202, content={"message": "Regrade in progress, call again to resume", **result})
+        return {"message": "Regrade complete", **result}
+
+    @app.get("/api/regrade-jobs/{job_id}")
+    def read_regrade_job(job_id: str, db = Depends(get_db)):
+        job = crud.get_regrade_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Regrade job not found")
+        return job
+
+    @app.get("/api/delete-jobs/{job_id}")
+    def read_delete_job(job_id: str, db = Depends(get_db)):
+        job = crud.get_delete_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Delete job not found")
+        return job
 
     # ================== MCQ QUESTIONS ==================
     @app.get("/api/tests/{test_id}/questions")
@@ -482,11 +612,21 @@ if DB_AVAILABLE and schemas is not None:
     def create_question(question: schemas.MCQQuestionCreate, db = Depends(get_db)):
         return crud.create_mcq_question(db, question)
 
+    @app.post("/api/tests/{test_id}/questions:bulk")
+    def create_questions_bulk(test_id: int, payload: schemas.MCQQuestionBulkCreate, db = Depends(get_db)):
+        if not crud.get_mcq_test(db, test_id):
+            raise HTTPException(status_code=404, detail="Test not found")
+        return crud.create_mcq_questions_bulk(db, test_id, payload.questions)
+
     @app.put("/api/questions/{question_id}")
     def update_question(question_id: int, question: schemas.MCQQuestionCreate, db = Depends(get_db)):
+        before = crud.get_mcq_question(db, question_id)
         updated = crud.update_mcq_question(db, question_id, question)
         if not updated:
             raise HTTPException(status_code=404, detail="Question not found")
+        regrade_jobs = _regrade_after_edit(db, before, updated)
+        if regrade_jobs:
+            return {**updated, "regrade": regrade_jobs}
         return updated
 
     @app.delete("/api/questions/{question_id}")
@@ -582,63 +722,190 @@ if DB_AVAILABLE and schemas is not None:
     # ================== TEST ATTEMPTS & SCORING ==================
     @app.post("/api/tests/{test_id}/submit")
     def submit_test(test_id: int, attempt: schemas.TestAttemptCreate, time_taken: int = 0, db = Depends(get_db)):
-        test = crud.get_mcq_test(db, test_id)
+        test = crud.get_mcq_test_cached(db, test_id)
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
         
-        questions = crud.get_questions_by_test(db, test_id)
+        # The token says which questions were served (and from which snapshot version);
+        # clients that predate it are scored against the whole bank as before
+        served = None
+        version = attempt.test_version
+        if attempt.attempt_token:
+            try:
+                token = attempt_tokens.verify(attempt.attempt_token, test_id)
+            except attempt_tokens.InvalidToken as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except attempt_tokens.SecretNotConfigured as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            served = token["question_ids"]
+            version = token["version"]
+        
+        # Scored against the server-held key for the version the student was served
+        key = crud.get_answer_key(db, test_id, version)
+        if served is not None:
+            key = key.subset(served)
         
         try:
-            student_answers = json.loads(attempt.answers_json)
+            student_answers = scoring.parse_answers(attempt.answers_json)
+            result = scoring.score_one(key, student_answers)
         except:
             raise HTTPException(status_code=400, detail="Invalid answers format")
         
-        score = 0
-        correct = 0
-        wrong = 0
-        total_marks = 0
-        
-        for q in questions:
-            total_marks += q.marks
-            answer = student_answers.get(str(q.id))
-            if answer:
-                if answer.lower() == q.correct_option.lower():
-                    score += q.marks
-                    correct += 1
-                else:
-                    wrong += 1
-        
-        unanswered = len(questions) - correct - wrong
+        score = result["score"]
+        total_marks = result["total_marks"]
+        attempt.test_version = key.version
         
         db_attempt = crud.create_test_attempt(
-            db, attempt, score, total_marks, correct, wrong, unanswered, time_taken
+            db, attempt, score, total_marks, result["correct_answers"], result["wrong_answers"],
+            result["unanswered"], time_taken, question_ids=served
         )
         
-        return {
+        response = {
             "id": db_attempt.id,
-            "score": score,
-            "total_marks": total_marks,
-            "correct_answers": correct,
-            "wrong_answers": wrong,
-            "unanswered": unanswered,
+            **result,
             "percentage": round((score / total_marks * 100) if total_marks > 0 else 0, 2),
-            "passed": score >= test.passing_marks
+            "passed": score >= test.passing_marks,
         }
+        # Answers for the review screen, only for the questions this attempt was served;
+        # without a token that would be the whole bank, so tokenless clients get none
+        if served is not None:
+            response["review"] = key.review()
+        return response
+
+    # ================== EXAM SCHEDULE ==================
+    @app.get("/api/exams")
+    def read_exam_windows(upcoming: bool = False, db = Depends(get_db)):
+        return crud.get_exam_windows(db, ending_after=time.time() if upcoming else None)
+
+    @app.post("/api/exams")
+    def create_exam_window(window: schemas.ExamWindowCreate, db = Depends(get_db)):
+        if window.end_at <= window.start_at:
+            raise HTTPException(status_code=400, detail="end_at must be after start_at")
+        if not crud.get_mcq_test(db, window.test_id):
+            raise HTTPException(status_code=404, detail="Test not found")
+        created = crud.create_exam_window(db, window)
+        # Warm straight away if the window is close enough
+        exam_schedule.prewarm_due(db)
+        return created
+
+    @app.delete("/api/exams/{window_id}")
+    def delete_exam_window(window_id: int, db = Depends(get_db)):
+        if not crud.delete_exam_window(db, window_id):
+            raise HTTPException(status_code=404, detail="Exam window not found")
+        return {"message": "Exam window deleted"}
+
+    @app.post("/api/exams/prewarm")
+    def prewarm_exams(db = Depends(get_db)):
+        """Pin tests of open or imminent exam windows in this instance's caches (for a scheduler)"""
+        return {"warmed": exam_schedule.prewarm_due(db), "caches": crud.published_cache_stats(db)}
+
+    @app.post("/api/test-attempts/flush")
+    def flush_test_attempts(db = Depends(get_db)):
+        """Write buffered submissions (SUBMISSION_BUFFER=jsonl) to the store now"""
+        return {"flushed": crud.flush_submissions(db)}
+
+    @app.get("/api/tests/{test_id}/leaderboard")
+    def read_leaderboard(request: Request, test_id: int, limit: int = Query(10, ge=1, le=100), db = Depends(get_db)):
+        """Top attempts of a test: score descending, then fastest"""
+        if not crud.get_mcq_test_cached(db, test_id):
+            raise HTTPException(status_code=404, detail="Test not found")
+        return conditional_json(request, crud.get_leaderboard(db, test_id, limit), cache_control=REVALIDATE)
+
+    @app.get("/api/tests/{test_id}/item-stats")
+    def read_item_stats(request: Request, test_id: int, db = Depends(get_db)):
+        """Per-question served/answered/correct counts and chosen-option distribution"""
+        if not crud.get_mcq_test_cached(db, test_id):
+            raise HTTPException(status_code=404, detail="Test not found")
+        return conditional_json(request, crud.get_item_stats(db, test_id), cache_control=REVALIDATE)
+
+    @app.post("/api/tests/{test_id}/item-stats/rebuild")
+    def rebuild_item_stats(test_id: int, restart: bool = False, db = Depends(get_db)):
+        """Recount item stats from all stored attempts (backfill); call again while done is false"""
+        result = crud.rebuild_item_stats(db, test_id, restart=restart)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Test not found")
+        if not result.get("done"):
+            from fastapi.responses import JSONResponse
+            return JSONResponse(status_code=202, content={"message": "Rebuild in progress, call again to resume", **result})
+        return {**result, **crud.get_item_stats(db, test_id)}
+
+    @app.get("/api/item-stats-jobs/{job_id}")
+    def read_item_stats_job(job_id: str, db = Depends(get_db)):
+        job = crud.get_item_stats_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Item stats job not found")
+        return job
+
+    EXPORT_FIELDS = (
+        "id", "test_id", "student_name", "student_email", "student_phone", "score", "total_marks",
+        "correct_answers", "wrong_answers", "unanswered", "time_taken_seconds", "test_version",
+        "completed_at", "answers_json", "question_ids_json",
+    )
+
+    @app.get("/api/test-attempts/export")
+    def export_test_attempts(format: str = "csv", test_id: Optional[int] = None, since: Optional[str] = None,
+                             db = Depends(get_db)):
+        """Stream attempts as CSV or NDJSON, oldest first; since is an ISO date/datetime"""
+        from fastapi.responses import StreamingResponse
+        import csv
+        import io
+        import datetime
+        if format not in ("csv", "ndjson"):
+            raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+        if since:
+            try:
+                # completed_at is stored as "%Y-%m-%d %H:%M:%S", which sorts as text
+                since = datetime.datetime.fromisoformat(since).strftime("%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="since must be an ISO date or datetime")
+        crud.flush_submissions(db)
+        attempts = crud.iter_test_attempts(db, test_id, since)
+
+        def _csv_rows():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for attempt in attempts:
+                writer.writerow(attempt)
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        def _ndjson_rows():
+            for attempt in attempts:
+                yield json.dumps({field: attempt.get(field) for field in EXPORT_FIELDS}, default=str) + "\n"
+
+        name = f"test_attempts{f'_test{test_id}' if test_id else ''}.{format}"
+        return StreamingResponse(
+            _csv_rows() if format == "csv" else _ndjson_rows(),
+            media_type="text/csv" if format == "csv" else "application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{name}"'},
+        )
 
     @app.get("/api/test-attempts")
-    def read_test_attempts(test_id: Optional[int] = None, db = Depends(get_db)):
+    def read_test_attempts(test_id: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=1000),
+                           cursor: Optional[str] = None, db = Depends(get_db)):
+        """Newest first. Pass cursor (empty for the first page) to get {"items", "next_cursor"}."""
+        crud.flush_submissions(db)
+        if cursor is not None:
+            from functools import partial
+            return _cursor_page(partial(crud.get_test_attempts_page, test_id=test_id), db, limit or 100, cursor)
         if test_id:
-            return crud.get_test_attempts(db, test_id)
-        return crud.get_all_test_attempts(db)
+            return crud.get_test_attempts(db, test_id, limit=limit)
+        return crud.get_all_test_attempts(db, limit=limit or 100)
 
     # ================== COURSES ==================
     @app.get("/api/courses")
-    def read_courses(type: Optional[str] = None, db = Depends(get_db)):
+    def read_courses(request: Request, type: Optional[str] = None, db = Depends(get_db)):
         if type == "free":
-            return crud.get_courses(db, is_free=True)
+            courses = crud.get_courses(db, is_free=True)
         elif type == "paid":
-            return crud.get_courses(db, is_free=False)
-        return crud.get_courses(db)
+            courses = crud.get_courses(db, is_free=False)
+        else:
+            courses = crud.get_courses(db)
+        return conditional_json(request, courses)
 
     @app.get("/api/courses/{course_id}")
     def read_course(course_id: int, db = Depends(get_db)):
@@ -707,6 +974,8 @@ if DB_AVAILABLE and schemas is not None:
         app.mount("/static", StaticFiles(directory=static_path), name="static")
 
     # ================== EMERGENCY DATA FIX ==================
+    FIX_IMAGES_PAGE_SIZE = 100
+
     @app.post("/api/fix-server-images")
     def fix_server_images(db = Depends(get_db)):
         """
@@ -720,10 +989,19 @@ if DB_AVAILABLE and schemas is not None:
         except ImportError:
             return {"error": "Pillow not installed. Please add 'Pillow' to requirements.txt"}
 
-        students = crud.get_students(db, limit=1000)
+        def _all_students():
+            # A page at a time: every student, without holding all their images at once
+            cursor = None
+            while True:
+                page = crud.get_students_page(db, limit=FIX_IMAGES_PAGE_SIZE, cursor=cursor)
+                yield from page["items"]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return
+
         report = []
         
-        for s in students:
+        for s in _all_students():
             if s.get("image_url") and s.get("image_url").startswith("data:image"):
                 try:
                     # 1. Decode
@@ -748,7 +1026,7 @@ if DB_AVAILABLE and schemas is not None:
                     new_base64 = base64.b64encode(new_data).decode('utf-8')
                     # Update in firestore
                     new_url = f"data:image/jpeg;base64,{new_base64}"
-                    crud.firestore_db.collection("students").document(str(s.get('id'))).update({"image_url": new_url})
+                    crud.update_student_image(db, s.get('id'), new_url)
                     
                     report.append(f"Fixed Student {s.get('id')}: {len(data)//1024}KB -> {len(new_data)//1024}KB")
                 except Exception as e:
@@ -756,6 +1034,16 @@ if DB_AVAILABLE and schemas is not None:
         
         return {"status": "Complete", "report": report}
 
+    @app.post("/api/fix-test-aggregates")
+    def fix_test_aggregates(test_id: Optional[int] = None, db = Depends(get_db)):
+        """
+        Repair Tool: Recomputes total_questions / total_marks from the question bank.
+        Question writes keep these as running deltas, so this is only needed if they drift
+        (e.g. questions edited by hand in the Firebase console).
+        """
+        fixed = crud.rebuild_test_aggregates(db, test_id)
+        return {"status": "Complete", "fixed": fixed}
+
 
 # ================== BOARDS DATA (No DB required) ==================
 try:
@@ -766,10 +1054,18 @@ except ImportError:
     except ImportError:
         BOARDS_DATA = {}
 
+_BOARDS_BODY = None
+
 @app.get("/api/boards")
-def get_boards():
+def get_boards(request: Request):
     """Return the full board → class → subject → chapter hierarchy"""
-    return BOARDS_DATA
+    global _BOARDS_BODY
+    # Static for the life of the process: serialize and hash it once
+    if _BOARDS_BODY is None:
+        body = render_json(BOARDS_DATA)
+        _BOARDS_BODY = (body, make_etag(body))
+    body, etag = _BOARDS_BODY
+    return conditional_json(request, None, cache_control=STATIC, body=body, etag=etag)
 
 class GenerateMCQRequest(BaseModel):
     board: str
@@ -793,9 +1089,8 @@ def flip_mcq_question(question_id: int, request: FlipMCQRequest, db = Depends(ge
         raise HTTPException(status_code=500, detail="Database unavailable")
     
     # Verify the question exists first
-    doc_ref = crud.firestore_db.collection("mcq_questions").document(str(question_id))
-    doc = doc_ref.get()
-    if not doc.exists:
+    existing = crud.get_mcq_question(db, question_id)
+    if not existing:
         raise HTTPException(status_code=404, detail="Question not found")
         
     api_key = request.api_key.strip() if request.api_key.strip() else os.environ.get("OPENAI_API_KEY", "")
@@ -862,16 +1157,14 @@ Return ONLY the JSON object, no other text."""
             "correct_option": q_data.get("correct_option", "a").lower(),
             "explanation": q_data.get("explanation", "")
         }
-        doc_ref.update(updated_fields)
-        
-        # Return the new complete dict
-        final_data = doc.to_dict()
-        final_data.update(updated_fields)
+        final_data = dict(crud.update_mcq_question_fields(db, question_id, updated_fields))
         final_data["id"] = int(question_id)
+        regrade_jobs = _regrade_after_edit(db, existing, final_data)
         
         return {
             "message": "Question flipped successfully!",
-            "question": final_data
+            "question": final_data,
+            "regrade": regrade_jobs
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to flip question: {str(e)}")
@@ -1035,19 +1328,15 @@ Return ONLY the JSON object, no other text."""
             test_series_id=db_series.id,
             title=test_title,
             description=f"AI-Generated MCQ test for {request.board} - {request.class_name} - {request.subject} - {request.chapter}",
-            total_questions=num_questions,
             questions_to_show=num_questions,
-            total_marks=num_questions,
             duration_minutes=15,
             passing_marks=int(num_questions * 0.4),
             is_active=False
         ))
         
-        # Create all questions
-        saved_questions = []
-        for idx, q in enumerate(questions_data):
-            db_question = crud.create_mcq_question(db, schemas.MCQQuestionCreate(
-                test_id=db_test.id,
+        # Create all questions in one batch
+        db_questions = crud.create_mcq_questions_bulk(db, db_test.id, [
+            schemas.MCQQuestionContent(
                 question_text=q.get("question", ""),
                 option_a=q.get("option_a", ""),
                 option_b=q.get("option_b", ""),
@@ -1057,7 +1346,11 @@ Return ONLY the JSON object, no other text."""
                 marks=1,
                 explanation=q.get("explanation", ""),
                 order_index=idx
-            ))
+            )
+            for idx, q in enumerate(questions_data)
+        ])
+        saved_questions = []
+        for db_question in db_questions:
             saved_questions.append({
                 "id": db_question.id,
                 "question_text": db_question.question_text,
@@ -1075,7 +1368,7 @@ Return ONLY the JSON object, no other text."""
                 "id": db_test.id,
                 "title": db_test.title,
                 "description": db_test.description,
-                "total_questions": db_test.total_questions,
+                "total_questions": len(db_questions),
                 "duration_minutes": db_test.duration_minutes,
                 "board": request.board,
                 "class_name": request.class_name,
@@ -1100,12 +1393,9 @@ def get_generated_tests(db = Depends(get_db)):
         return []
     try:
         # We need custom logic to get ALL tests including inactive ones for the Admin Panel
-        docs = crud.firestore_db.collection("mcq_tests").get()
-        tests = crud._docs_to_list(docs)
-        tests.sort(key=lambda x: x.get("id", 0), reverse=True)
+        # One query for the tests plus one batched lookup of their series
         result = []
-        for t in tests:
-            series = crud.get_test_series(db, t.get("test_series_id"))
+        for t, series in crud.get_tests_with_series(db):
             result.append({
                 "id": t.get("id"),
                 "title": t.get("title"),
@@ -1127,12 +1417,8 @@ def publish_generated_test(test_id: int, db = Depends(get_db)):
     if not DB_AVAILABLE or db is None:
         raise HTTPException(status_code=503, detail="Database unavailable")
     try:
-        doc_ref = crud.firestore_db.collection("mcq_tests").document(str(test_id))
-        doc = doc_ref.get()
-        if not doc.exists:
+        if not crud.set_mcq_test_active(db, test_id, True):
             raise HTTPException(status_code=404, detail="Test not found")
-        
-        doc_ref.update({"is_active": True})
         return {"message": "Test published successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1144,14 +1430,11 @@ def delete_generated_test(test_id: int, db = Depends(get_db)):
     if not DB_AVAILABLE or db is None:
         raise HTTPException(status_code=503, detail="Database unavailable")
     try:
-        crud.delete_mcq_test(db, test_id)
-        # Note: delete_mcq_test already deletes questions natively. Wait, we also need to delete TestAttempts?
-        # We can implement that dynamically
-        docs = crud.firestore_db.collection("test_attempts").where(filter=crud.FieldFilter("test_id", "==", test_id)).get()
-        for doc in docs:
-            doc.reference.delete()
-        
-        return {"message": "Test deleted successfully"}
+        # Questions and attempts are removed by the cascade as well
+        result = crud.delete_mcq_test(db, test_id)
+        if not result:
+            raise HTTPException(status_code=404, detail="Test not found")
+        return _cascade_response(result, "Test deleted successfully")
     except HTTPException:
         raise
     except Exception as e:
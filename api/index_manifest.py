@@ -0,0 +1,85 @@
+"""
+Composite index manifest for Firestore.
+
+Firestore serves single-field queries from automatic indexes, but a query that
+filters on one field and orders by another (or orders by several fields) needs a
+composite index, and fails with FAILED_PRECONDITION until one exists. QUERY_SHAPES
+lists the queries crud pushes down to the store; composite_index() works out the
+index each one needs and manifest() renders them in the firestore.indexes.json
+format the Firebase CLI deploys:
+
+    python api/index_manifest.py > firestore.indexes.json
+    firebase deploy --only firestore:indexes
+
+Add a shape here whenever a new filtered + ordered query is added to crud.
+"""
+import json
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+try:
+    from storage import ASCENDING, DESCENDING
+except ImportError:
+    from .storage import ASCENDING, DESCENDING
+
+EQUALITY_OPS = ("==", "in", "array_contains")
+
+# (collection, [(field, op), ...], [(field, direction), ...])
+QUERY_SHAPES = [
+    # get_test_attempts / get_test_attempts_page: newest first, optionally for one test
+    ("test_attempts", [], [("completed_at", DESCENDING), ("id", DESCENDING)]),
+    ("test_attempts", [("test_id", "==")], [("completed_at", DESCENDING), ("id", DESCENDING)]),
+    # get_enquiries / get_demo_bookings and their pages: newest first
+    ("enquiries", [], [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("demo_bookings", [], [("created_at", DESCENDING), ("id", DESCENDING)]),
+    # regrade, item_stats.rebuild: one test's attempts in id order
+    ("test_attempts", [("test_id", "==")], [("id", ASCENDING)]),
+    # iter_test_attempts (export), with and without a test and a since bound
+    ("test_attempts", [], [("completed_at", ASCENDING), ("id", ASCENDING)]),
+    ("test_attempts", [("test_id", "==")], [("completed_at", ASCENDING), ("id", ASCENDING)]),
+    ("test_attempts", [("completed_at", ">=")], [("completed_at", ASCENDING), ("id", ASCENDING)]),
+    ("test_attempts", [("test_id", "=="), ("completed_at", ">=")], [("completed_at", ASCENDING), ("id", ASCENDING)]),
+    # get_ranked_students / get_ranked_students_page: toppers by grade
+    ("students", [], [("grade_value", DESCENDING), ("id", ASCENDING)]),
+    # leaderboard.rebuild
+    ("test_attempts", [("test_id", "==")],
+     [("score", DESCENDING), ("time_taken_seconds", ASCENDING), ("id", ASCENDING)]),
+]
+
+Shape = Tuple[str, Sequence[Tuple[str, str]], Sequence[Tuple[str, str]]]
+
+
+def composite_index(collection: str, filters: Sequence[Tuple[str, str]],
+                    order_by: Sequence[Tuple[str, str]]) -> Optional[dict]:
+    """The composite index a query needs, or None if single-field indexes cover it"""
+    equality = [field for field, op in filters if op in EQUALITY_OPS]
+    ranged = [field for field, op in filters if op not in EQUALITY_OPS]
+    order = list(order_by)
+    # Firestore orders by the inequality field first, implicitly if not asked to
+    for field in ranged:
+        if field not in [f for f, _ in order]:
+            order.insert(0, (field, ASCENDING))
+
+    fields = [(field, ASCENDING) for field in equality if field not in [f for f, _ in order]] + order
+    if len(fields) < 2:
+        return None
+    # Equality filters alone are served by merging single-field indexes
+    if not order and not ranged:
+        return None
+    return {
+        "collectionGroup": collection,
+        "queryScope": "COLLECTION",
+        "fields": [{"fieldPath": field, "order": direction} for field, direction in fields],
+    }
+
+
+def manifest(shapes: Iterable[Shape] = None) -> dict:
+    indexes: List[dict] = []
+    for collection, filters, order_by in (QUERY_SHAPES if shapes is None else shapes):
+        index = composite_index(collection, filters, order_by)
+        if index is not None and index not in indexes:
+            indexes.append(index)
+    return {"indexes": indexes, "fieldOverrides": []}
+
+
+if __name__ == "__main__":
+    print(json.dumps(manifest(), indent=2))
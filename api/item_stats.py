@@ -0,0 +1,225 @@
+"""
+Per-question item statistics.
+
+`item_stats/<test_id>` rolls a test's attempts up per question:
+
+    {"test_id": 1, "attempts": 120,
+     "questions": {"12": {"served": 118, "answered": 110, "correct": 71,
+                          "options": {"a": 71, "b": 20, "c": 15, "d": 4}}, ...}}
+
+tally() counts a group of attempts against the answer key and record() adds those
+counts to the document with Increment in a single merge write, so submissions on
+different instances never lose each other's updates; if that write fails the
+document is marked stale. rebuild() recounts everything from test_attempts as a
+resumable job with a time budget, like regrade.py (backfill for older attempts,
+after a regrade changes which answers are correct, and to repair stale counts).
+
+Attempts from before attempt tokens don't record which questions were served; for
+those only the questions they answered count as served.
+"""
+import json
+import time
+from typing import Callable, Iterable, Optional
+
+import jobs
+import scoring
+from storage import ASCENDING, Increment
+
+COLLECTION = "item_stats"
+JOBS_COLLECTION = "item_stats_jobs"
+PAGE_SIZE = 1000
+REPORT_FIELDS = ("test_id", "status", "key_version", "scanned", "started_at", "updated_at")
+OPTIONS = ("a", "b", "c", "d")
+
+
+def _empty_question() -> dict:
+    return {"served": 0, "answered": 0, "correct": 0, "options": {}}
+
+
+def tally(key_for: Callable[[dict], Optional[scoring.CompiledKey]], attempts: Iterable[dict]) -> dict:
+    """Counts for a group of attempts; key_for(attempt) gives the key it is marked against"""
+    counts = {"attempts": 0, "questions": {}}
+    for attempt in attempts:
+        key = key_for(attempt)
+        try:
+            answers = {str(q): a for q, a in scoring.parse_answers(attempt.get("answers_json")).items()}
+            served = json.loads(attempt["question_ids_json"]) if attempt.get("question_ids_json") else list(answers)
+        except (ValueError, TypeError, AttributeError):
+            continue
+        counts["attempts"] += 1
+        for q_id in served:
+            q_id = str(q_id)
+            stats = counts["questions"].setdefault(q_id, _empty_question())
+            stats["served"] += 1
+            answer = answers.get(q_id)
+            if not answer:
+                continue
+            stats["answered"] += 1
+            option = str(answer).strip().lower()
+            option = option if option in OPTIONS else "other"
+            stats["options"][option] = stats["options"].get(option, 0) + 1
+            i = key.position.get(q_id) if key is not None else None
+            if i is not None and scoring.option_code(answer) == int(key.correct[i]):
+                stats["correct"] += 1
+    return counts
+
+
+def _increments(value):
+    if isinstance(value, dict):
+        return {k: _increments(v) for k, v in value.items()}
+    return Increment(value)
+
+
+def record(store, test_id: int, counts: dict):
+    """Add tally() counts to the test's document"""
+    if not counts["attempts"]:
+        return
+    store.set(COLLECTION, test_id, {
+        "test_id": test_id,
+        "attempts": Increment(counts["attempts"]),
+        "questions": _increments(counts["questions"]),
+    }, merge=True)
+
+
+def mark_stale(store, test_id: int):
+    """Some attempts never made it into the counts (a failed record); get() reports it until a rebuild"""
+    try:
+        store.set(COLLECTION, test_id, {"test_id": test_id, "stale_at": time.time()}, merge=True)
+    except Exception as e:
+        print(f"Could not mark item stats of test {test_id} stale: {e}")
+
+
+def _counts(doc: Optional[dict]) -> dict:
+    doc = doc or {}
+    return {"attempts": doc.get("attempts", 0), "questions": doc.get("questions") or {}}
+
+
+def _add(total: dict, counts: dict, sign: int = 1):
+    total["attempts"] += sign * counts.get("attempts", 0)
+    for q_id, stats in counts["questions"].items():
+        into = total["questions"].setdefault(q_id, _empty_question())
+        for field in ("served", "answered", "correct"):
+            into[field] += sign * stats.get(field, 0)
+        for option, n in (stats.get("options") or {}).items():
+            into["options"][option] = into["options"].get(option, 0) + sign * n
+
+
+def job_id_for(test_id: int) -> str:
+    return f"item_stats_{test_id}"
+
+
+class RebuildJob(jobs.Job):
+    """Recount a test's attempts against key, a page at a time within a time budget.
+
+    The job reads the live document (baseline) and only then notes its start time;
+    it counts only attempts written to test_attempts before that (written_at, see
+    crud.create_test_attempt and submission_buffer), while record() keeps adding later
+    ones to the live document. Attempt ids are leased per process, so they are not a
+    time order and can't be the boundary. The finished totals are swapped in with a
+    transaction that carries over whatever record() added since the baseline (live
+    now - baseline), so neither is lost.
+    """
+    collection = JOBS_COLLECTION
+    report_fields = REPORT_FIELDS
+
+    def __init__(self, store, test_id: int, key: scoring.CompiledKey, **kwargs):
+        super().__init__(store, job_id_for(test_id), **kwargs)
+        self.test_id = test_id
+        self.key = key
+
+    def _start(self):
+        # Baseline first: anything recorded after it must be left to the carry-over
+        baseline = _counts(self.store.get(COLLECTION, self.test_id))
+        self.state = {
+            "test_id": self.test_id, "status": "running", "key_version": self.key.version,
+            "cursor": None, "scanned": 0, "started_at": time.time(),
+            "totals": {"attempts": 0, "questions": {}}, "baseline": baseline,
+        }
+        self._save()
+
+    def _swap(self):
+        state = self.state
+
+        def _apply(txn):
+            live = txn.get(COLLECTION, self.test_id) or {}
+            doc = {"attempts": 0, "questions": {}}
+            _add(doc, state["totals"])
+            _add(doc, _counts(live))
+            _add(doc, state["baseline"], sign=-1)
+            doc = {"test_id": self.test_id, **doc}
+            # A record that failed after the job started may have missed the scanned range
+            if (live.get("stale_at") or 0) > state["started_at"]:
+                doc["stale_at"] = live["stale_at"]
+            txn.set(COLLECTION, self.test_id, doc)
+
+        self.store.run_transaction(_apply)
+
+    def run(self, restart: bool = False) -> dict:
+        previous = self.load()
+        same_key = previous is not None and previous.get("key_version") == self.key.version
+        if same_key and not restart and previous.get("status") in ("running", "done"):
+            self.state = previous
+            if previous["status"] == "done":
+                return {**self.report(), "done": True}
+        else:
+            self._start()
+
+        started_at = self.state["started_at"]
+        while True:
+            if self.out_of_time():
+                return {**self.report(), "done": False}
+            cursor = self.state["cursor"]
+            page = self.store.query(
+                "test_attempts",
+                filters=[("test_id", "==", self.test_id)],
+                order_by=[("id", ASCENDING)],
+                start_after={"id": cursor} if cursor is not None else None,
+                limit=PAGE_SIZE,
+                select=["id", "answers_json", "question_ids_json", "written_at"],
+            )
+            if not page:
+                break
+            # Attempts from before written_at existed are all older than any job
+            counted = [attempt for attempt in page if (attempt.get("written_at") or 0) < started_at]
+            _add(self.state["totals"], tally(lambda attempt: self.key, counted))
+            self._save(cursor=page[-1]["id"], scanned=self.state["scanned"] + len(counted))
+            if len(page) < PAGE_SIZE:
+                break
+
+        self._swap()
+        self._save(status="done", totals=None, baseline=None)
+        return {**self.report(), "done": True}
+
+
+def rebuild(store, test_id: int, key: scoring.CompiledKey, restart: bool = False, **kwargs) -> dict:
+    """Recount every attempt of the test against key (resumable); a finished rebuild for
+    the same key version is kept unless restart"""
+    return RebuildJob(store, test_id, key, **kwargs).run(restart=restart)
+
+
+def get(store, test_id: int) -> dict:
+    """Per-question counts with answer and correct rates, in question id order"""
+    doc = store.get(COLLECTION, test_id) or {}
+    questions = []
+    for q_id, stats in sorted((doc.get("questions") or {}).items(), key=lambda item: int(item[0])):
+        served, answered, correct = stats.get("served", 0), stats.get("answered", 0), stats.get("correct", 0)
+        questions.append({
+            "question_id": int(q_id),
+            "served": served,
+            "answered": answered,
+            "correct": correct,
+            "options": stats.get("options") or {},
+            "answer_rate": round(answered / served, 4) if served else None,
+            "correct_rate": round(correct / answered, 4) if answered else None,
+        })
+    return {"test_id": test_id, "attempts": doc.get("attempts", 0), "stale": bool(doc.get("stale_at")),
+            "questions": questions}
+
+
+def get_job(store, job_id: str) -> Optional[dict]:
+    return jobs.get_job(store, JOBS_COLLECTION, job_id, REPORT_FIELDS)
+
+
+def delete(store, test_id: int):
+    store.delete(COLLECTION, test_id)
+    store.delete(JOBS_COLLECTION, job_id_for(test_id))
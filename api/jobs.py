@@ -0,0 +1,57 @@
+"""
+Shared scaffolding for the resumable admin jobs (cascade_delete, regrade, item_stats).
+
+A job keeps its progress in one document of its own jobs collection, works until its
+time budget runs out and reports done=False, and the next request picks up from the
+saved state. Writes go out in WriteBatches of at most BATCH_LIMIT operations.
+"""
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+BATCH_LIMIT = 500  # Firestore's maximum operations per WriteBatch
+DEFAULT_TIME_BUDGET = 45  # seconds, leaves headroom under the 60s function limit
+
+
+def view(job_id: str, data: dict, fields: Optional[Iterable[str]] = None) -> dict:
+    """A job document as reported to clients: `fields` only, or everything but the cursor"""
+    if fields is None:
+        shown = {k: v for k, v in data.items() if k != "cursor"}
+    else:
+        shown = {k: v for k, v in data.items() if k in fields}
+    return {"job_id": job_id, **shown}
+
+
+def get_job(store, collection: str, job_id: str, fields: Optional[Iterable[str]] = None) -> Optional[dict]:
+    data = store.get(collection, job_id)
+    if data is None:
+        return None
+    return view(job_id, data, fields)
+
+
+class Job:
+    """A job whose state lives in `collection/<job_id>`"""
+    collection: str = ""
+    report_fields: Optional[Iterable[str]] = None  # None reports everything but the cursor
+
+    def __init__(self, store, job_id: str, time_budget: float = DEFAULT_TIME_BUDGET,
+                 on_progress: Optional[Callable[[dict], None]] = None):
+        self.store = store
+        self.job_id = job_id
+        self.deadline = time.monotonic() + time_budget
+        self.on_progress = on_progress
+        self.state: Dict = {}
+
+    def out_of_time(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def load(self) -> Optional[dict]:
+        return self.store.get(self.collection, self.job_id)
+
+    def _save(self, **fields):
+        self.state.update(fields, updated_at=time.time())
+        self.store.set(self.collection, self.job_id, self.state)
+        if self.on_progress:
+            self.on_progress(self.report())
+
+    def report(self) -> dict:
+        return view(self.job_id, self.state, self.report_fields)
@@ -0,0 +1,132 @@
+"""
+Per-test leaderboards.
+
+`leaderboards/<test_id>` holds the best SIZE attempts of a test as a compact list of
+entries, best first: score descending, then time taken ascending, then the earlier
+attempt. New attempts are merged into it in a transaction as they are written, so
+GET /api/tests/{id}/leaderboard is one document read however many attempts the test
+has. rebuild() recomputes a board with one ordered, limited query (after a regrade,
+a failed merge, or the first time a test that predates leaderboards is asked for).
+
+Each process remembers the last entry of every full board it has written or read;
+attempts that can't beat it skip the transaction altogether, which is most of them
+once a test is popular.
+"""
+import datetime
+import threading
+from typing import Dict, List
+
+import cache_generation
+from storage import ASCENDING, DESCENDING
+
+COLLECTION = "leaderboards"
+SIZE = 100
+
+ENTRY_FIELDS = ("id", "student_name", "score", "total_marks", "time_taken_seconds", "completed_at")
+
+_lock = threading.Lock()
+_cutoffs: Dict[int, tuple] = {}  # test_id -> rank key of the last entry of a full board
+
+# Another instance may have rebuilt a board lower (regrade); forget what we knew
+cache_generation.on_change(_cutoffs.clear)
+
+
+def _rank_key(entry: dict) -> tuple:
+    return (-(entry.get("score") or 0), entry.get("time_taken_seconds") or 0, entry.get("id") or 0)
+
+
+def _entry(attempt: dict) -> dict:
+    return {field: attempt.get(field) for field in ENTRY_FIELDS}
+
+
+def _remember(test_id: int, entries: List[dict]):
+    with _lock:
+        if len(entries) >= SIZE:
+            _cutoffs[test_id] = _rank_key(entries[-1])
+        else:
+            _cutoffs.pop(test_id, None)
+
+
+def _save(store_or_txn, test_id: int, entries: List[dict], stale: bool = False):
+    board = {
+        "test_id": test_id,
+        "entries": entries,
+        "updated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if stale:
+        board["stale"] = True
+    store_or_txn.set(COLLECTION, test_id, board)
+
+
+def mark_stale(store, test_id: int):
+    """Some attempts never made it onto the board; the next get() rebuilds it from the attempts"""
+    try:
+        store.set(COLLECTION, test_id, {"test_id": test_id, "stale": True}, merge=True)
+    except Exception as e:
+        print(f"Could not mark leaderboard of test {test_id} stale: {e}")
+
+
+def merge(store, test_id: int, attempts: List[dict]) -> bool:
+    """Add attempts of one test to its board; False if none of them made it"""
+    with _lock:
+        cutoff = _cutoffs.get(test_id)
+    candidates = [_entry(a) for a in attempts if cutoff is None or _rank_key(a) < cutoff]
+    if not candidates:
+        return False
+
+    def _merge(txn):
+        board = txn.get(COLLECTION, test_id) or {}
+        # Keyed by attempt id so replaying the same attempts changes nothing
+        entries = {entry["id"]: entry for entry in board.get("entries") or []}
+        for entry in candidates:
+            entries[entry["id"]] = entry
+        ranked = sorted(entries.values(), key=_rank_key)[:SIZE]
+        # Still missing whatever an earlier failed merge dropped
+        _save(txn, test_id, ranked, stale=bool(board.get("stale")))
+        return ranked
+
+    try:
+        ranked = store.run_transaction(_merge)
+    except Exception:
+        # The board would silently miss these attempts; flag it so the next get() rebuilds it
+        mark_stale(store, test_id)
+        raise
+    _remember(test_id, ranked)
+    return True
+
+
+def rebuild(store, test_id: int) -> List[dict]:
+    """Recompute a board from the attempts themselves"""
+    docs = store.query(
+        "test_attempts",
+        filters=[("test_id", "==", test_id)],
+        order_by=[("score", DESCENDING), ("time_taken_seconds", ASCENDING), ("id", ASCENDING)],
+        limit=SIZE,
+        select=list(ENTRY_FIELDS),
+    )
+    entries = [_entry(doc) for doc in docs]
+    _save(store, test_id, entries)
+    _remember(test_id, entries)
+    return entries
+
+
+def get(store, test_id: int, limit: int = SIZE) -> dict:
+    board = store.get(COLLECTION, test_id)
+    if board is None or board.get("stale"):
+        entries = rebuild(store, test_id)
+        updated_at = None
+    else:
+        entries = board.get("entries") or []
+        updated_at = board.get("updated_at")
+        _remember(test_id, entries)
+    return {
+        "test_id": test_id,
+        "updated_at": updated_at,
+        "entries": [{"rank": i + 1, **entry} for i, entry in enumerate(entries[:limit])],
+    }
+
+
+def delete(store, test_id: int):
+    store.delete(COLLECTION, test_id)
+    with _lock:
+        _cutoffs.pop(test_id, None)
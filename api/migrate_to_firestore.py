@@ -1,7 +1,10 @@
 import os
 import sys
 import sqlite3
+from crud import student_grade
 from firebase_config import get_db
+from id_allocator import resync_counter
+from storage_firestore import FirestoreBackend
 
 def migrate_table(cursor, table_name, collection_name, firestore_db):
     print(f"Migrating {table_name} to {collection_name}...")
@@ -24,11 +27,17 @@ def migrate_table(cursor, table_name, collection_name, firestore_db):
             doc_id = str(item_dict['id'])
         else:
             continue
+
+        # Toppers are listed by grade_value; older SQLite rows don't have it
+        if collection_name == "students" and item_dict.get("grade_value") is None:
+            item_dict["grade_value"] = student_grade(item_dict.get("rank"))
             
         # Push to Firestore
         firestore_db.collection(collection_name).document(doc_id).set(item_dict)
         count += 1
         
+    # Ids were copied verbatim, so move the allocator past them
+    resync_counter(FirestoreBackend(firestore_db), collection_name)
     print(f"Successfully migrated {count} records to {collection_name}.\n")
 
 def run_migration():
@@ -1,5 +1,8 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text
-from .database import Base
+from sqlalchemy import Boolean, Column, Float, Index, Integer, String, Text
+try:
+    from .database import Base
+except ImportError:
+    from database import Base
 
 class Admin(Base):
     __tablename__ = "admins"
@@ -26,12 +29,14 @@ class Student(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     rank = Column(String) # e.g., "98.5% - Class 10"
+    grade_value = Column(Float, index=True, default=0.0)  # first number in rank, for ordering toppers
     image_url = Column(Text)
     description = Column(Text)
     is_active = Column(Boolean, default=True)
 
 class Enquiry(Base):
     __tablename__ = "enquiries"
+    __table_args__ = (Index("ix_enquiries_newest", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     first_name = Column(String)
@@ -44,6 +49,7 @@ class Enquiry(Base):
 
 class DemoBooking(Base):
     __tablename__ = "demo_bookings"
+    __table_args__ = (Index("ix_demo_bookings_newest", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     student_name = Column(String)
@@ -64,10 +70,12 @@ class DemoBooking(Base):
 class AcademicClass(Base):
     """Academic classes from 8th to 12th with streams"""
     __tablename__ = "academic_classes"
+    __table_args__ = (Index("ix_academic_classes_board_active", "board", "is_active"),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)  # e.g., "Class 8th", "Class 11th Science"
     display_name = Column(String)  # e.g., "8th Standard", "11th Science"
+    board = Column(String, nullable=True)  # e.g., "CBSE"
     stream = Column(String, nullable=True)  # "science", "commerce", or null for 8-10
     order_index = Column(Integer, default=0)  # For sorting
     is_active = Column(Boolean, default=True)
@@ -76,10 +84,12 @@ class AcademicClass(Base):
 class Subject(Base):
     """Subjects within each class"""
     __tablename__ = "subjects"
+    __table_args__ = (Index("ix_subjects_class_active", "class_id", "is_active"),)
 
     id = Column(Integer, primary_key=True, index=True)
     class_id = Column(Integer, index=True)  # ForeignKey to AcademicClass
     name = Column(String)  # e.g., "Science 1", "Physics"
+    board = Column(String, nullable=True)
     icon = Column(String, nullable=True)  # Icon name or emoji
     color = Column(String, default="#D4AF37")  # Subject color
     order_index = Column(Integer, default=0)
@@ -89,6 +99,7 @@ class Subject(Base):
 class TestSeries(Base):
     """Test series container for a subject"""
     __tablename__ = "test_series"
+    __table_args__ = (Index("ix_test_series_subject_active", "subject_id", "is_active"),)
 
     id = Column(Integer, primary_key=True, index=True)
     subject_id = Column(Integer, index=True)  # ForeignKey to Subject
@@ -106,6 +117,7 @@ class TestSeries(Base):
 class PDFResource(Base):
     """PDF study materials"""
     __tablename__ = "pdf_resources"
+    __table_args__ = (Index("ix_pdf_resources_series_active", "test_series_id", "is_active"),)
 
     id = Column(Integer, primary_key=True, index=True)
     test_series_id = Column(Integer, index=True)  # ForeignKey to TestSeries
@@ -121,6 +133,7 @@ class PDFResource(Base):
 class MCQTest(Base):
     """MCQ test within a test series"""
     __tablename__ = "mcq_tests"
+    __table_args__ = (Index("ix_mcq_tests_series_active", "test_series_id", "is_active"),)
 
     id = Column(Integer, primary_key=True, index=True)
     test_series_id = Column(Integer, index=True)  # ForeignKey to TestSeries
@@ -139,6 +152,7 @@ class MCQTest(Base):
 class MCQQuestion(Base):
     """Individual MCQ question"""
     __tablename__ = "mcq_questions"
+    __table_args__ = (Index("ix_mcq_questions_test_order", "test_id", "order_index"),)
 
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, index=True)  # ForeignKey to MCQTest
@@ -157,6 +171,12 @@ class MCQQuestion(Base):
 class TestAttempt(Base):
     """Student test attempt record"""
     __tablename__ = "test_attempts"
+    __table_args__ = (
+        Index("ix_test_attempts_test_newest", "test_id", "id"),
+        Index("ix_test_attempts_newest", "completed_at", "id"),
+        Index("ix_test_attempts_test_completed", "test_id", "completed_at", "id"),
+        Index("ix_test_attempts_test_ranking", "test_id", "score", "time_taken_seconds", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, index=True)  # ForeignKey to MCQTest
@@ -170,6 +190,9 @@ class TestAttempt(Base):
     unanswered = Column(Integer, default=0)
     time_taken_seconds = Column(Integer, default=0)
     answers_json = Column(Text, nullable=True)  # JSON string of answers
+    test_version = Column(Integer, nullable=True)  # Snapshot version the answers were scored against
+    question_ids_json = Column(Text, nullable=True)  # JSON list of the questions served
+    written_at = Column(Float, nullable=True)  # time.time() it reached test_attempts (item stats rebuilds)
     completed_at = Column(String)
 
 
@@ -178,6 +201,7 @@ class TestAttempt(Base):
 class Course(Base):
     """Courses (Free and Paid)"""
     __tablename__ = "courses"
+    __table_args__ = (Index("ix_courses_active_free", "is_active", "is_free"),)
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
@@ -198,6 +222,7 @@ class Course(Base):
 class QuestionBankPDF(Base):
     """PDF question banks organized by Board, Class and Subject"""
     __tablename__ = "question_bank_pdfs"
+    __table_args__ = (Index("ix_question_bank_pdfs_filters", "board", "class_name", "subject_name"),)
 
     id = Column(Integer, primary_key=True, index=True)
     board = Column(String, index=True)  # e.g., "CBSE"
@@ -212,3 +237,10 @@ class QuestionBankPDF(Base):
     created_at = Column(String)
 
 
+class Document(Base):
+    """Schemaless documents for collections without a table of their own (counters, jobs, ...)"""
+    __tablename__ = "documents"
+
+    collection = Column(String, primary_key=True)
+    doc_id = Column(String, primary_key=True)
+    data = Column(Text)  # JSON
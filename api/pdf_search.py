@@ -0,0 +1,142 @@
+"""
+In-process search over the question bank PDF library.
+
+get_question_bank_pdfs can only filter on exact board/class/subject and loads every
+match including file_url, which holds the whole PDF as base64. This index keeps the
+metadata only (METADATA_FIELDS, loaded with a select so file_url is never read)
+and answers free-text queries from memory:
+
+- title, description, board, class_name and subject_name are split into lower-case
+  word tokens; every query token must match some indexed token, exactly or as a
+  prefix ("phy" finds "Physics"), so results narrow as the user types;
+- matches in the title rank above subject/class/board, which rank above the
+  description, and exact tokens above prefixes; ties go to the newest PDF;
+- board/class_name/subject_name filters are exact, and the response carries facet
+  counts for each of them over the matching PDFs.
+
+crud keeps it current: add() on create, remove() on delete, and a full reload
+(one metadata query) the first time it's used and after cache_generation reports
+a write from another instance.
+"""
+import bisect
+import re
+import threading
+from typing import Dict, List, Optional, Set
+
+METADATA_FIELDS = [
+    "id", "board", "class_name", "subject_name", "title", "description",
+    "file_size", "download_count", "is_active", "created_at",
+]
+FACET_FIELDS = ("board", "class_name", "subject_name")
+
+# How much a token in each field counts towards relevance
+FIELD_WEIGHTS = {"title": 3, "subject_name": 2, "class_name": 2, "board": 2, "description": 1}
+EXACT_BONUS = 1
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text) -> List[str]:
+    return _TOKEN.findall(str(text or "").lower())
+
+
+class PdfSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: Dict[int, dict] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}  # token -> {pdf id: best field weight}
+        self._tokens: List[str] = []  # sorted, for prefix lookups
+        self.loaded = False
+
+    # --- maintenance ---
+    def _add(self, doc: dict):
+        pdf_id = doc["id"]
+        self._docs[pdf_id] = {field: doc.get(field) for field in METADATA_FIELDS}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(doc.get(field)):
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = {}
+                    bisect.insort(self._tokens, token)
+                posting[pdf_id] = max(weight, posting.get(pdf_id, 0))
+
+    def _remove(self, pdf_id: int):
+        doc = self._docs.pop(pdf_id, None)
+        if doc is None:
+            return
+        for token in {t for field in FIELD_WEIGHTS for t in tokenize(doc.get(field))}:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(pdf_id, None)
+            if not posting:
+                del self._postings[token]
+                i = bisect.bisect_left(self._tokens, token)
+                if i < len(self._tokens) and self._tokens[i] == token:
+                    del self._tokens[i]
+
+    def load(self, docs: List[dict]):
+        with self._lock:
+            self._docs, self._postings, self._tokens = {}, {}, []
+            for doc in docs:
+                self._add(doc)
+            self.loaded = True
+
+    def add(self, doc: dict):
+        with self._lock:
+            if self.loaded:
+                self._remove(doc["id"])
+                self._add(doc)
+
+    def remove(self, pdf_id: int):
+        with self._lock:
+            self._remove(pdf_id)
+
+    def invalidate(self):
+        """Reload on next use"""
+        self.loaded = False
+
+    # --- queries ---
+    def _match(self, query_token: str) -> Dict[int, int]:
+        """pdf id -> score for one query token, over every indexed token it prefixes"""
+        scores: Dict[int, int] = {}
+        i = bisect.bisect_left(self._tokens, query_token)
+        while i < len(self._tokens) and self._tokens[i].startswith(query_token):
+            token = self._tokens[i]
+            bonus = EXACT_BONUS if token == query_token else 0
+            for pdf_id, weight in self._postings[token].items():
+                scores[pdf_id] = max(scores.get(pdf_id, 0), weight + bonus)
+            i += 1
+        return scores
+
+    def search(self, q: str = "", board: Optional[str] = None, class_name: Optional[str] = None,
+               subject_name: Optional[str] = None, limit: int = 20, offset: int = 0) -> dict:
+        filters = {"board": board, "class_name": class_name, "subject_name": subject_name}
+        with self._lock:
+            scores: Optional[Dict[int, int]] = None
+            for query_token in dict.fromkeys(tokenize(q)):
+                matched = self._match(query_token)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {pdf_id: s + matched[pdf_id] for pdf_id, s in scores.items() if pdf_id in matched}
+                if not scores:
+                    break
+            candidates: Set[int] = set(self._docs) if scores is None else set(scores)
+            hits = [
+                self._docs[pdf_id] for pdf_id in candidates
+                if all(value is None or self._docs[pdf_id].get(field) == value for field, value in filters.items())
+            ]
+
+        scores = scores or {}
+        hits.sort(key=lambda doc: (-scores.get(doc["id"], 0), -(doc["id"] or 0)))
+        facets = {field: {} for field in FACET_FIELDS}
+        for doc in hits:
+            for field in FACET_FIELDS:
+                value = doc.get(field)
+                facets[field][value] = facets[field].get(value, 0) + 1
+        return {
+            "total": len(hits),
+            "items": [dict(doc) for doc in hits[offset:offset + limit]],
+            "facets": facets,
+        }
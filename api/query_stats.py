@@ -0,0 +1,194 @@
+"""
+Query-shape instrumentation.
+
+With QUERY_STATS=1 every store query made on behalf of crud is recorded by shape:
+the crud function that issued it, the collection, the filter fields and operators,
+order_by and whether a limit was pushed down, plus how many documents came back.
+crud reports what it then does with the results:
+
+- sort(docs, order_by) sorts in Python and records the sort fields against the
+  query that produced docs (that is what a composite index would have done);
+- used(docs, n) records that only n of those documents were actually needed.
+
+report() lists shapes by read amplification (documents returned / used) and flags
+in-memory sorts and over-fetching; manifest() feeds the recorded shapes, with any
+in-memory sort as their order, to index_manifest to produce the composite indexes
+that would let the store do that work.
+
+Off by default: recording walks the stack on every query. sort() still sorts when off.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from storage import DESCENDING
+    import index_manifest
+except ImportError:
+    from .storage import DESCENDING
+    from . import index_manifest
+
+ENABLED = os.environ.get("QUERY_STATS", "").lower() in ("1", "true", "yes")
+CALLER_MODULES = ("crud", "api.crud")
+OVER_FETCH_RATIO = 1.5  # returned / used above this is flagged
+TRACKED_RESULTS = 32  # recent result lists per thread that sort()/used() can be matched to
+
+_lock = threading.Lock()
+_shapes: Dict[tuple, dict] = {}
+_local = threading.local()
+
+
+def enable(on: bool = True):
+    global ENABLED
+    ENABLED = on
+
+
+def reset():
+    with _lock:
+        _shapes.clear()
+
+
+def _caller() -> str:
+    """Name of the nearest crud function on the stack (closures report their enclosing function)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") in CALLER_MODULES:
+            code = frame.f_code
+            return getattr(code, "co_qualname", code.co_name).split(".<locals>")[0]
+        frame = frame.f_back
+    return "?"
+
+
+def _recent() -> "OrderedDict[int, tuple]":
+    if not hasattr(_local, "results"):
+        _local.results = OrderedDict()  # id(result list) -> (shape key, returned, list)
+    return _local.results
+
+
+def _record(collection, filters, order_by, limit, docs):
+    function = _caller()
+    key = (
+        function,
+        collection,
+        tuple((field, op) for field, op, _ in filters or ()),
+        tuple(tuple(o) for o in order_by or ()),
+        limit is not None,
+    )
+    with _lock:
+        shape = _shapes.get(key)
+        if shape is None:
+            shape = _shapes[key] = {"calls": 0, "docs_returned": 0, "docs_used": 0, "in_memory_sort": None}
+        shape["calls"] += 1
+        shape["docs_returned"] += len(docs)
+        shape["docs_used"] += len(docs)
+    recent = _recent()
+    # Keep the list itself so its id can't be reused while it's tracked
+    recent[id(docs)] = (key, len(docs), docs)
+    while len(recent) > TRACKED_RESULTS:
+        recent.popitem(last=False)
+    _local.last = (function, key, len(docs))
+
+
+def _shape_for(docs) -> Optional[Tuple[tuple, int]]:
+    """The query docs came from: matched by identity, else the caller's most recent query"""
+    entry = _recent().get(id(docs))
+    if entry is not None and entry[2] is docs:
+        return entry[0], entry[1]
+    last = getattr(_local, "last", None)
+    if last is not None and last[0] == _caller():
+        return last[1], last[2]
+    return None
+
+
+class InstrumentedStore:
+    """Wraps a storage backend and records every query() through it"""
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def query(self, collection, filters=None, order_by=None, limit=None, offset=None, start_after=None, select=None):
+        docs = self._backend.query(collection, filters=filters, order_by=order_by, limit=limit, offset=offset,
+                                   start_after=start_after, select=select)
+        if ENABLED:
+            _record(collection, filters, order_by, limit, docs)
+        return docs
+
+
+_wrappers: Dict[int, InstrumentedStore] = {}
+
+
+def instrument(backend):
+    """backend itself when instrumentation is off, else its (cached) recording wrapper"""
+    if not ENABLED:
+        return backend
+    wrapper = _wrappers.get(id(backend))
+    if wrapper is None or wrapper._backend is not backend:
+        wrapper = _wrappers[id(backend)] = InstrumentedStore(backend)
+    return wrapper
+
+
+def sort(docs: List[dict], order_by: Sequence[Tuple[str, str]]) -> List[dict]:
+    """Sort query results in place by (field, direction) pairs, recording that it happened"""
+    for field, direction in reversed(order_by):
+        docs.sort(key=lambda doc: doc.get(field, 0), reverse=direction == DESCENDING)
+    if ENABLED:
+        found = _shape_for(docs)
+        if found is not None:
+            with _lock:
+                _shapes[found[0]]["in_memory_sort"] = tuple(tuple(o) for o in order_by)
+    return docs
+
+
+def used(docs: List[dict], count: int):
+    """Only `count` of the documents in docs (a query result) were needed"""
+    if not ENABLED:
+        return
+    found = _shape_for(docs)
+    if found is not None:
+        key, returned = found
+        with _lock:
+            _shapes[key]["docs_used"] -= returned - min(count, returned)
+
+
+def report() -> List[dict]:
+    """One row per query shape, worst read amplification first"""
+    rows = []
+    with _lock:
+        items = list(_shapes.items())
+    for (function, collection, filters, order_by, limited), shape in items:
+        returned, used_docs = shape["docs_returned"], shape["docs_used"]
+        amplification = round(returned / used_docs, 2) if used_docs else None
+        flags = []
+        if shape["in_memory_sort"]:
+            flags.append("in_memory_sort")
+        if returned and (not used_docs or returned / used_docs > OVER_FETCH_RATIO):
+            flags.append("over_fetch")
+        rows.append({
+            "function": function,
+            "collection": collection,
+            "filters": [f"{field} {op}" for field, op in filters],
+            "order_by": [f"{field} {direction}" for field, direction in order_by],
+            "limit_pushed": limited,
+            "in_memory_sort": [f"{field} {direction}" for field, direction in shape["in_memory_sort"] or ()],
+            "calls": shape["calls"],
+            "docs_returned": returned,
+            "docs_used": used_docs,
+            "amplification": amplification,
+            "flags": flags,
+        })
+    rows.sort(key=lambda row: (-(row["docs_returned"] - row["docs_used"]), -row["docs_returned"]))
+    return rows
+
+
+def manifest() -> dict:
+    """Composite indexes for the recorded shapes, in-memory sorts included as ordering"""
+    shapes = []
+    with _lock:
+        items = list(_shapes.items())
+    for (_, collection, filters, order_by, _), shape in items:
+        shapes.append((collection, filters, order_by or shape["in_memory_sort"] or ()))
+    return index_manifest.manifest(shapes)
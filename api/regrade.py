@@ -0,0 +1,120 @@
+"""
+Batch regrading of a test's attempts after its answer key changes.
+
+Walks `test_attempts` for one test in id order, a page at a time, re-scores each
+page's answers_json with the scoring engine (attempts served the same questions are
+scored together) and writes back only the attempts whose result changed, in
+WriteBatches. Progress and the last id processed live in `regrade_jobs/<job_id>`, so
+a run that reaches its time budget stops between pages and the next call resumes
+where it left off (see jobs.py).
+"""
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+import jobs
+import scoring
+from jobs import BATCH_LIMIT
+from storage import ASCENDING
+
+PAGE_SIZE = 1000
+JOBS_COLLECTION = "regrade_jobs"
+
+RESULT_FIELDS = ("score", "total_marks", "correct_answers", "wrong_answers", "unanswered")
+
+
+def job_id_for(test_id: int) -> str:
+    return f"regrade_{test_id}"
+
+
+class RegradeJob(jobs.Job):
+    collection = JOBS_COLLECTION
+
+    def __init__(self, store, test_id: int, key: scoring.CompiledKey, **kwargs):
+        super().__init__(store, job_id_for(test_id), **kwargs)
+        self.test_id = test_id
+        self.key = key
+        self._subsets: Dict[str, scoring.CompiledKey] = {}
+
+    def _key_for(self, attempt: dict) -> scoring.CompiledKey:
+        served = attempt.get("question_ids_json")
+        if not served:
+            return self.key
+        if served not in self._subsets:
+            self._subsets[served] = self.key.subset(json.loads(served))
+        return self._subsets[served]
+
+    def _regrade_page(self, attempts) -> Tuple[int, int]:
+        """(changed, skipped) for one page of attempts"""
+        groups: Dict[int, list] = {}
+        keys: Dict[int, scoring.CompiledKey] = {}
+        skipped = 0
+        for attempt in attempts:
+            try:
+                key = self._key_for(attempt)
+                answers = scoring.parse_answers(attempt.get("answers_json"))
+            except (ValueError, TypeError):
+                skipped += 1  # unreadable attempt: leave it as it is
+                continue
+            keys[id(key)] = key
+            groups.setdefault(id(key), []).append((attempt, answers))
+
+        batch = self.store.batch()
+        changed = 0
+        for group_key, members in groups.items():
+            results = scoring.score_many(keys[group_key], [answers for _, answers in members])
+            for (attempt, _), result in zip(members, results):
+                if all(attempt.get(field) == result[field] for field in RESULT_FIELDS):
+                    continue
+                batch.update("test_attempts", attempt["id"], {**result, "test_version": self.key.version})
+                changed += 1
+                if len(batch) == BATCH_LIMIT:
+                    batch.commit()
+        batch.commit()
+        return changed, skipped
+
+    def run(self, restart: bool = False) -> dict:
+        previous = self.load()
+        if previous and not restart and previous.get("status") == "running":
+            self.state = previous
+        elif previous and not restart and previous.get("status") == "done" and previous.get("key_version") == self.key.version:
+            # Already regraded against this key; later attempts were scored with it
+            self.state = previous
+            return {**self.report(), "done": True}
+        else:
+            self.state = {"test_id": self.test_id, "status": "running", "cursor": None,
+                          "scanned": 0, "changed": 0, "skipped": 0, "started_at": time.time()}
+        self.state["key_version"] = self.key.version
+
+        while True:
+            if self.out_of_time():
+                self._save()
+                return {**self.report(), "done": False}
+            cursor = self.state.get("cursor")
+            page = self.store.query(
+                "test_attempts",
+                filters=[("test_id", "==", self.test_id)],
+                order_by=[("id", ASCENDING)],
+                start_after={"id": cursor} if cursor is not None else None,
+                limit=PAGE_SIZE,
+            )
+            if not page:
+                break
+            changed, skipped = self._regrade_page(page)
+            self._save(cursor=page[-1]["id"], scanned=self.state["scanned"] + len(page),
+                       changed=self.state["changed"] + changed, skipped=self.state.get("skipped", 0) + skipped)
+            if len(page) < PAGE_SIZE:
+                break
+
+        self._save(status="done")
+        return {**self.report(), "done": True}
+
+
+def regrade_test(store, test_id: int, key: scoring.CompiledKey, restart: bool = False, **kwargs) -> dict:
+    """Re-score every attempt of test_id against key; resumes an unfinished run (and skips a
+    finished one for the same key version) unless restart"""
+    return RegradeJob(store, test_id, key, **kwargs).run(restart=restart)
+
+
+def get_job(store, job_id: str) -> Optional[dict]:
+    return jobs.get_job(store, JOBS_COLLECTION, job_id)
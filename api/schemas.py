@@ -1,5 +1,7 @@
-from pydantic import BaseModel
+import os
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
+from datetime import datetime, timedelta, timezone
 
 # --- Site Config ---
 class SiteConfigBase(BaseModel):
@@ -191,8 +193,7 @@ class MCQTest(MCQTestBase):
 
 
 # --- MCQ Question ---
-class MCQQuestionBase(BaseModel):
-    test_id: int
+class MCQQuestionContent(BaseModel):
     question_text: str
     question_image_url: Optional[str] = None
     option_a: str
@@ -204,9 +205,15 @@ class MCQQuestionBase(BaseModel):
     explanation: Optional[str] = None
     order_index: int = 0
 
+class MCQQuestionBase(MCQQuestionContent):
+    test_id: int
+
 class MCQQuestionCreate(MCQQuestionBase):
     pass
 
+class MCQQuestionBulkCreate(BaseModel):
+    questions: List[MCQQuestionContent]  # test_id comes from the URL
+
 class MCQQuestion(MCQQuestionBase):
     id: int
     class Config:
@@ -222,6 +229,8 @@ class TestAttemptBase(BaseModel):
 
 class TestAttemptCreate(TestAttemptBase):
     answers_json: str  # JSON string of answers
+    test_version: Optional[int] = None  # snapshot version the questions were served from
+    attempt_token: Optional[str] = None  # issued by GET /api/tests/{id}; binds the served questions
 
 class TestAttempt(TestAttemptBase):
     id: int
@@ -232,10 +241,38 @@ class TestAttempt(TestAttemptBase):
     unanswered: int = 0
     time_taken_seconds: int = 0
     answers_json: Optional[str] = None
+    test_version: Optional[int] = None
+    question_ids_json: Optional[str] = None
     completed_at: Optional[str] = None
     class Config:
         from_attributes = True
 
+# --- Exam Window ---
+# Exam times entered without an offset are the academy's local time (IST unless
+# EXAM_UTC_OFFSET_MINUTES says otherwise), not the server's, which is UTC on Vercel
+EXAM_LOCAL_TZ = timezone(timedelta(minutes=int(os.environ.get("EXAM_UTC_OFFSET_MINUTES", 330))))
+
+class ExamWindowBase(BaseModel):
+    test_id: int
+    start_at: datetime  # normalised to UTC
+    end_at: datetime
+
+    @field_validator("start_at", "end_at")
+    @classmethod
+    def to_utc(cls, value: datetime) -> datetime:
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=EXAM_LOCAL_TZ)
+        return value.astimezone(timezone.utc)
+
+class ExamWindowCreate(ExamWindowBase):
+    pass
+
+class ExamWindow(ExamWindowBase):
+    id: int
+    created_at: Optional[str] = None
+    class Config:
+        from_attributes = True
+
 
 # ================== COURSES SCHEMAS ==================
 
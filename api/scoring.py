@@ -0,0 +1,154 @@
+"""
+Batch scoring engine.
+
+compile_key() turns a test's answer key (see test_snapshots.build_answer_key) into
+arrays: question ids, correct option codes (a-d -> 0-3) and marks. Attempts are encoded
+the same way, one row per attempt, so scoring any number of them is a few vector
+operations:
+
+    correct  = (answers == key)         # n_attempts x n_questions
+    score    = correct @ marks
+    answered = answers >= 0
+
+Used by submit_test (one attempt) and by offline regrading (thousands). NumPy is
+optional; without it the same maths runs as plain Python loops.
+"""
+import json
+from typing import Dict, Iterable, List, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OPTION_CODES = {"a": 0, "b": 1, "c": 2, "d": 3}
+UNANSWERED = -1
+
+
+def option_code(answer) -> int:
+    if not answer:
+        return UNANSWERED
+    # Anything that isn't a-d still counts as answered (and wrong)
+    return OPTION_CODES.get(str(answer).strip().lower(), len(OPTION_CODES))
+
+
+class CompiledKey:
+    def __init__(self, ids: Sequence[int], correct: Sequence[str], marks: Sequence[int], version=None,
+                 explanations: Sequence[str] = None):
+        self.version = version
+        self.ids = list(ids)
+        self.explanations = list(explanations) if explanations is not None else [None] * len(self.ids)
+        self.position = {str(q_id): i for i, q_id in enumerate(self.ids)}
+        correct_codes = [OPTION_CODES.get((c or "").lower(), UNANSWERED - 1) for c in correct]
+        marks = [m or 0 for m in marks]
+        if np is not None:
+            self.correct = np.array(correct_codes, dtype=np.int8)
+            self.marks = np.array(marks, dtype=np.int32)
+        else:
+            self.correct = correct_codes
+            self.marks = marks
+        self.total_marks = int(sum(marks))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _option(self, i) -> str:
+        return _OPTIONS_BY_CODE.get(int(self.correct[i]), "")
+
+    def subset(self, question_ids: Iterable) -> "CompiledKey":
+        """Key restricted to the questions an attempt was actually served (unknown ids are skipped)"""
+        keep = [self.position[str(q_id)] for q_id in question_ids if str(q_id) in self.position]
+        return CompiledKey(
+            [self.ids[i] for i in keep],
+            [self._option(i) for i in keep],
+            [int(self.marks[i]) for i in keep],
+            self.version,
+            [self.explanations[i] for i in keep],
+        )
+
+    def review(self) -> Dict[str, dict]:
+        """{question id: {"correct_option", "explanation"}} for showing results"""
+        return {
+            str(q_id): {"correct_option": self._option(i), "explanation": self.explanations[i]}
+            for i, q_id in enumerate(self.ids)
+        }
+
+
+_OPTIONS_BY_CODE = {code: option for option, code in OPTION_CODES.items()}
+
+
+def compile_key(answer_key: dict) -> CompiledKey:
+    return CompiledKey(answer_key["ids"], answer_key["correct"], answer_key["marks"], answer_key.get("version"),
+                       answer_key.get("explanations"))
+
+
+def parse_answers(answers) -> Dict[str, str]:
+    """answers_json string (or an already-parsed dict) -> {question id: option};
+    ValueError if it isn't a JSON object (some legacy attempts stored a list)"""
+    if isinstance(answers, str):
+        answers = json.loads(answers) if answers else {}
+    if not answers:
+        return {}
+    if not isinstance(answers, dict):
+        raise ValueError("answers must be an object of question id -> option")
+    return answers
+
+
+def encode(key: CompiledKey, answers: Dict[str, str]) -> List[int]:
+    row = [UNANSWERED] * len(key)
+    for q_id, answer in answers.items():
+        i = key.position.get(str(q_id))
+        if i is not None:
+            row[i] = option_code(answer)
+    return row
+
+
+def _result(score, correct, answered, key: CompiledKey) -> dict:
+    return {
+        "score": int(score),
+        "total_marks": key.total_marks,
+        "correct_answers": int(correct),
+        "wrong_answers": int(answered - correct),
+        "unanswered": len(key) - int(answered),
+    }
+
+
+def score_many(key: CompiledKey, attempts: Iterable[Dict[str, str]]) -> List[dict]:
+    """Score parsed answer dicts; results come back in the same order"""
+    return score_encoded(key, [encode(key, answers) for answers in attempts])
+
+
+def score_encoded(key: CompiledKey, rows: List[List[int]]) -> List[dict]:
+    """Score rows already encoded with encode()"""
+    if not rows:
+        return []
+    if np is None or not len(key):
+        return [_score_row(key, row) for row in rows]
+
+    matrix = np.array(rows, dtype=np.int8)
+    answered = (matrix != UNANSWERED).sum(axis=1)
+    hits = matrix == key.correct
+    correct = hits.sum(axis=1)
+    scores = hits.astype(np.int32) @ key.marks
+    return [_result(s, c, a, key) for s, c, a in zip(scores, correct, answered)]
+
+
+def _score_row(key: CompiledKey, row: List[int]) -> dict:
+    score = correct = answered = 0
+    for code, expected, marks in zip(row, key.correct, key.marks):
+        if code == UNANSWERED:
+            continue
+        answered += 1
+        if code == expected:
+            correct += 1
+            score += marks
+    return _result(score, correct, answered, key)
+
+
+def score_one(key: CompiledKey, answers: Dict[str, str]) -> dict:
+    return score_many(key, [answers])[0]
+
+
+def score_attempts(key: CompiledKey, attempts: Iterable[dict]) -> List[dict]:
+    """Regrade stored attempt documents (their answers_json) against key"""
+    return score_many(key, [parse_answers(a.get("answers_json")) for a in attempts])
@@ -86,7 +86,7 @@ def generate_and_seed_science_mcqs():
             test_title = f"{chapter} ({board})"
             
             # Check if test already exists in this series
-            existing_tests = crud.firestore_db.collection("mcq_tests").where("test_series_id", "==", db_series.id).where("title", "==", test_title).get()
+            existing_tests = crud.storage.get_backend().query("mcq_tests", filters=[("test_series_id", "==", db_series.id), ("title", "==", test_title)], limit=1)
             if existing_tests:
                 print(f"  - Test already exists: {test_title}. Skipping.")
                 continue
@@ -141,18 +141,15 @@ Return ONLY the JSON object, no other text."""
                     test_series_id=db_series.id,
                     title=test_title,
                     description=f"AI-Generated MCQ test for {board} - {class_name} - {subject_name} - {chapter}",
-                    total_questions=num_questions,
                     questions_to_show=num_questions,
-                    total_marks=num_questions,
                     duration_minutes=15,
                     passing_marks=int(num_questions * 0.4),
                     is_active=True
                 ))
                 
-                # Create all questions
-                for idx, q in enumerate(questions_data):
-                    crud.create_mcq_question(db, schemas.MCQQuestionCreate(
-                        test_id=db_test.id,
+                # Create all questions in one batch
+                crud.create_mcq_questions_bulk(db, db_test.id, [
+                    schemas.MCQQuestionContent(
                         question_text=q.get("question", ""),
                         option_a=q.get("option_a", ""),
                         option_b=q.get("option_b", ""),
@@ -162,7 +159,9 @@ Return ONLY the JSON object, no other text."""
                         marks=1,
                         explanation=q.get("explanation", ""),
                         order_index=idx
-                    ))
+                    )
+                    for idx, q in enumerate(questions_data)
+                ])
                 
                 print(f"    Success: Created test with {num_questions} questions.")
                 
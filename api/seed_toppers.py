@@ -3,7 +3,10 @@ import shutil
 import re
 import sqlite3
 import json
+from crud import student_grade
 from firebase_config import get_db
+from id_allocator import resync_counter
+from storage_firestore import FirestoreBackend
 
 def parse_filename(filename):
     # Pattern: Name (Rank/Info).png
@@ -76,6 +79,7 @@ def seed_toppers():
                 "id": i,
                 "name": name,
                 "rank": rank,
+                "grade_value": student_grade(rank),  # toppers are listed by this
                 "image_url": image_url, # Now stores the path, handled by backend endpoint
                 "description": description,
                 "is_active": True
@@ -86,6 +90,7 @@ def seed_toppers():
             print(f"Error processing {filename}: {e}")
 
     conn.commit()
+    resync_counter(FirestoreBackend(firestore_db), "students")
     
     # Final check
     cursor.execute("SELECT count(*) FROM students")
@@ -0,0 +1,329 @@
+"""
+Storage backends for crud.
+
+crud talks to a small document-store interface instead of a concrete database, so the
+same code can run on:
+
+- FirestoreBackend (storage_firestore.py) - production
+- SQLBackend (storage_sql.py) - the SQLAlchemy models in models.py, with real indexes and joins
+- MemoryBackend (below) - plain dicts, for local perf runs without network access
+
+Pick one with STORAGE_BACKEND=firestore|sql|memory (default: firestore).
+
+Documents are dicts addressed by (collection, doc_id). Queries take Firestore-shaped
+arguments: filters are (field, op, value) tuples, order_by is a list of
+(field, ASCENDING|DESCENDING) and start_after is a dict of order-field values.
+Increment(n) can be used as a field value in any write for an atomic add, and
+update() accepts dotted paths ("questions.12.correct") for nested maps.
+"""
+import copy
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+
+class NotFound(Exception):
+    """update() on a document that doesn't exist"""
+
+
+class Increment:
+    """Atomic numeric add, usable as a field value in update / set(merge=True) / batch / transaction writes"""
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"Increment({self.value})"
+
+
+# ================== PYTHON-SIDE QUERY HELPERS ==================
+# Shared by MemoryBackend and by SQLBackend for collections without a table.
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def get_path(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def has_path(doc: dict, path: str) -> bool:
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False
+        value = value[part]
+    return True
+
+
+def match_filters(doc: dict, filters) -> bool:
+    for field, op, expected in filters or ():
+        if not _OPS[op](get_path(doc, field), expected):
+            return False
+    return True
+
+
+class _Desc:
+    """Sort key wrapper that inverts ordering (for DESCENDING fields)"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(order_by):
+    def key(doc):
+        parts = []
+        for field, direction in order_by:
+            value = get_path(doc, field)
+            # nulls sort first, as in Firestore
+            value = (0, 0) if value is None else (1, value)
+            parts.append(_Desc(value) if direction == DESCENDING else value)
+        return tuple(parts)
+    return key
+
+
+def apply_query(docs: Iterable[dict], filters=None, order_by=None, limit=None, offset=None,
+                start_after=None, select=None) -> List[dict]:
+    results = [doc for doc in docs if match_filters(doc, filters)]
+    if order_by:
+        # Like Firestore, ordering on a field drops documents that don't have it
+        results = [doc for doc in results if all(has_path(doc, field) for field, _ in order_by)]
+        key = _sort_key(order_by)
+        results.sort(key=key)
+        if start_after is not None:
+            cursor = key({field: start_after.get(field) for field, _ in order_by})
+            results = [doc for doc in results if cursor < key(doc)]
+    if offset:
+        results = results[offset:]
+    if limit is not None:
+        results = results[:limit]
+    if select is not None:
+        results = [{field: doc[field] for field in select if field in doc} for doc in results]
+    return results
+
+
+def apply_fields(doc: dict, fields: Dict[str, Any], dotted: bool = True) -> dict:
+    """Apply update()/merge fields (with Increment and dotted paths) to doc in place"""
+    for path, value in fields.items():
+        parts = path.split(".") if dotted else [path]
+        target = doc
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        leaf = parts[-1]
+        if isinstance(value, Increment):
+            target[leaf] = (target.get(leaf) or 0) + value.value
+        elif isinstance(value, dict) and not dotted:
+            existing = target.get(leaf)
+            if not isinstance(existing, dict):
+                existing = target[leaf] = {}
+            apply_fields(existing, value, dotted=False)
+        else:
+            target[leaf] = copy.deepcopy(value)
+    return doc
+
+
+def resolve_set(data: dict) -> dict:
+    """A plain (non-merge) set: Increment sentinels just become their value"""
+    return apply_fields({}, data, dotted=False)
+
+
+# ================== INTERFACE ==================
+
+class WriteBatch:
+    """Collects writes and commits them atomically; callers keep it under 500 operations"""
+    def __init__(self, backend):
+        self.backend = backend
+        self.ops: List[Tuple] = []
+
+    def set(self, collection, doc_id, data, merge=False):
+        self.ops.append(("set", collection, str(doc_id), data, merge))
+
+    def update(self, collection, doc_id, fields):
+        self.ops.append(("update", collection, str(doc_id), fields, None))
+
+    def delete(self, collection, doc_id):
+        self.ops.append(("delete", collection, str(doc_id), None, None))
+
+    def __len__(self):
+        return len(self.ops)
+
+    def commit(self):
+        if self.ops:
+            self.backend._commit(self.ops)
+        self.ops = []
+
+
+class StorageBackend:
+    name = "base"
+
+    def get(self, collection: str, doc_id) -> Optional[dict]:
+        raise NotImplementedError
+
+    def get_many(self, collection: str, doc_ids) -> List[dict]:
+        """Fetch several documents by id; missing ones are skipped"""
+        docs = (self.get(collection, doc_id) for doc_id in doc_ids)
+        return [doc for doc in docs if doc is not None]
+
+    def set(self, collection: str, doc_id, data: dict, merge: bool = False):
+        raise NotImplementedError
+
+    def update(self, collection: str, doc_id, fields: dict):
+        raise NotImplementedError
+
+    def delete(self, collection: str, doc_id):
+        raise NotImplementedError
+
+    def query(self, collection: str, filters=None, order_by=None, limit: int = None, offset: int = None,
+              start_after: dict = None, select: List[str] = None) -> List[dict]:
+        raise NotImplementedError
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def _commit(self, ops):
+        raise NotImplementedError
+
+    def run_transaction(self, fn: Callable[[Any], Any]):
+        """Run fn(txn) atomically. txn has get/set/update/delete; all reads must come before writes."""
+        raise NotImplementedError
+
+    def join(self, collection: str, foreign_key: str, parent_collection: str, filters=None,
+             order_by=None, limit: int = None) -> List[Tuple[dict, Optional[dict]]]:
+        """Query collection and pair each row with the parent_collection doc its foreign_key points at"""
+        children = self.query(collection, filters=filters, order_by=order_by, limit=limit)
+        parent_ids = {child.get(foreign_key) for child in children if child.get(foreign_key) is not None}
+        parents = {parent.get("id"): parent for parent in self.get_many(parent_collection, parent_ids)}
+        return [(child, parents.get(child.get(foreign_key))) for child in children]
+
+
+# ================== IN-MEMORY BACKEND ==================
+
+class _BufferedTransaction:
+    def __init__(self, backend):
+        self.backend = backend
+        self.batch = WriteBatch(backend)
+
+    def get(self, collection, doc_id):
+        return self.backend.get(collection, doc_id)
+
+    def set(self, collection, doc_id, data, merge=False):
+        self.batch.set(collection, doc_id, data, merge)
+
+    def update(self, collection, doc_id, fields):
+        self.batch.update(collection, doc_id, fields)
+
+    def delete(self, collection, doc_id):
+        self.batch.delete(collection, doc_id)
+
+
+class MemoryBackend(StorageBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.RLock()
+
+    def _collection(self, collection):
+        return self._data.setdefault(collection, {})
+
+    def get(self, collection, doc_id):
+        with self._lock:
+            doc = self._collection(collection).get(str(doc_id))
+            return copy.deepcopy(doc) if doc is not None else None
+
+    def set(self, collection, doc_id, data, merge=False):
+        self._commit([("set", collection, str(doc_id), data, merge)])
+
+    def update(self, collection, doc_id, fields):
+        self._commit([("update", collection, str(doc_id), fields, None)])
+
+    def delete(self, collection, doc_id):
+        self._commit([("delete", collection, str(doc_id), None, None)])
+
+    def query(self, collection, filters=None, order_by=None, limit=None, offset=None, start_after=None, select=None):
+        with self._lock:
+            docs = list(self._collection(collection).values())
+            return copy.deepcopy(apply_query(docs, filters, order_by, limit, offset, start_after, select))
+
+    def _commit(self, ops):
+        with self._lock:
+            for op, collection, doc_id, data, merge in ops:
+                if op == "update" and doc_id not in self._collection(collection):
+                    raise NotFound(f"{collection}/{doc_id}")
+            for op, collection, doc_id, data, merge in ops:
+                docs = self._collection(collection)
+                if op == "set" and merge:
+                    apply_fields(docs.setdefault(doc_id, {}), data, dotted=False)
+                elif op == "set":
+                    docs[doc_id] = resolve_set(data)
+                elif op == "update":
+                    apply_fields(docs[doc_id], data)
+                else:
+                    docs.pop(doc_id, None)
+
+    def run_transaction(self, fn):
+        # One process-wide lock gives serializable transactions
+        with self._lock:
+            txn = _BufferedTransaction(self)
+            result = fn(txn)
+            txn.batch.commit()
+            return result
+
+
+# ================== SELECTION ==================
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str) -> StorageBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sql":
+        from storage_sql import SQLBackend
+        return SQLBackend()
+    if name == "firestore":
+        from storage_firestore import FirestoreBackend
+        return FirestoreBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {name}")
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(os.environ.get("STORAGE_BACKEND", "firestore").lower())
+    return _backend
+
+
+def set_backend(backend: StorageBackend):
+    """Swap the process-wide backend (local perf runs, scripts)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,133 @@
+"""
+Firestore implementation of the storage interface (the production backend).
+"""
+from typing import List
+
+from firebase_admin import firestore
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+try:
+    from firebase_config import get_db
+    from storage import Increment, NotFound, StorageBackend, WriteBatch
+except ImportError:
+    from .firebase_config import get_db
+    from .storage import Increment, NotFound, StorageBackend, WriteBatch
+
+
+def _to_firestore(data: dict) -> dict:
+    """Swap storage.Increment sentinels for Firestore's own transforms"""
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            out[key] = firestore.Increment(value.value)
+        elif isinstance(value, dict):
+            out[key] = _to_firestore(value)
+        else:
+            out[key] = value
+    return out
+
+
+class _FirestoreBatch(WriteBatch):
+    def commit(self):
+        if not self.ops:
+            return
+        batch = self.backend.client.batch()
+        for op, collection, doc_id, data, merge in self.ops:
+            ref = self.backend._ref(collection, doc_id)
+            if op == "set":
+                batch.set(ref, _to_firestore(data), merge=merge)
+            elif op == "update":
+                batch.update(ref, _to_firestore(data))
+            else:
+                batch.delete(ref)
+        try:
+            batch.commit()
+        except gexc.NotFound as e:
+            raise NotFound(str(e))
+        self.ops = []
+
+
+class _FirestoreTransaction:
+    def __init__(self, backend, transaction):
+        self.backend = backend
+        self.transaction = transaction
+
+    def get(self, collection, doc_id):
+        snap = self.backend._ref(collection, doc_id).get(transaction=self.transaction)
+        return snap.to_dict() if snap.exists else None
+
+    def set(self, collection, doc_id, data, merge=False):
+        self.transaction.set(self.backend._ref(collection, doc_id), _to_firestore(data), merge=merge)
+
+    def update(self, collection, doc_id, fields):
+        self.transaction.update(self.backend._ref(collection, doc_id), _to_firestore(fields))
+
+    def delete(self, collection, doc_id):
+        self.transaction.delete(self.backend._ref(collection, doc_id))
+
+
+class FirestoreBackend(StorageBackend):
+    name = "firestore"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_db()
+        return self._client
+
+    def _ref(self, collection, doc_id):
+        return self.client.collection(collection).document(str(doc_id))
+
+    def get(self, collection, doc_id):
+        snap = self._ref(collection, doc_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    def get_many(self, collection, doc_ids) -> List[dict]:
+        refs = [self._ref(collection, doc_id) for doc_id in doc_ids]
+        if not refs:
+            return []
+        # get_all streams back in arbitrary order; keep the caller's order
+        found = {snap.id: snap.to_dict() for snap in self.client.get_all(refs) if snap.exists}
+        return [found[ref.id] for ref in refs if ref.id in found]
+
+    def set(self, collection, doc_id, data, merge=False):
+        self._ref(collection, doc_id).set(_to_firestore(data), merge=merge)
+
+    def update(self, collection, doc_id, fields):
+        try:
+            self._ref(collection, doc_id).update(_to_firestore(fields))
+        except gexc.NotFound as e:
+            raise NotFound(str(e))
+
+    def delete(self, collection, doc_id):
+        self._ref(collection, doc_id).delete()
+
+    def query(self, collection, filters=None, order_by=None, limit=None, offset=None, start_after=None, select=None):
+        query = self.client.collection(collection)
+        for field, op, value in filters or ():
+            query = query.where(filter=FieldFilter(field, op, value))
+        for field, direction in order_by or ():
+            query = query.order_by(field, direction=direction)
+        if start_after is not None:
+            query = query.start_after(start_after)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        if select is not None:
+            query = query.select(select)
+        return [doc.to_dict() for doc in query.get()]
+
+    def batch(self):
+        return _FirestoreBatch(self)
+
+    def run_transaction(self, fn):
+        @firestore.transactional
+        def _run(transaction):
+            return fn(_FirestoreTransaction(self, transaction))
+
+        return _run(self.client.transaction(max_attempts=10))
@@ -0,0 +1,256 @@
+"""
+SQLAlchemy implementation of the storage interface.
+
+Collections that have a model in models.py map onto its table, so filters, ordering,
+cursors and limits become indexed WHERE / ORDER BY / LIMIT clauses and join() is a real
+outer join. Anything else (counters, jobs, ...) lives as JSON rows in the `documents`
+table and is filtered in Python. Fields that a table has no column for are dropped.
+"""
+import json
+
+from sqlalchemy import and_, func, inspect, or_, select, text
+
+import models
+from database import SessionLocal, engine as default_engine
+from storage import (DESCENDING, Increment, NotFound, StorageBackend,
+                     apply_fields, apply_query, resolve_set)
+
+_SQL_OPS = {
+    "==": lambda col, v: col == v,
+    "!=": lambda col, v: col != v,
+    "<": lambda col, v: col < v,
+    "<=": lambda col, v: col <= v,
+    ">": lambda col, v: col > v,
+    ">=": lambda col, v: col >= v,
+    "in": lambda col, v: col.in_(list(v)),
+    "not-in": lambda col, v: col.notin_(list(v)),
+}
+
+
+class _SQLTransaction:
+    def __init__(self, backend, session):
+        self.backend = backend
+        self.session = session
+
+    def get(self, collection, doc_id):
+        return self.backend._get(self.session, collection, doc_id, for_update=True)
+
+    def set(self, collection, doc_id, data, merge=False):
+        self.backend._write(self.session, "set", collection, str(doc_id), data, merge)
+
+    def update(self, collection, doc_id, fields):
+        self.backend._write(self.session, "update", collection, str(doc_id), fields, None)
+
+    def delete(self, collection, doc_id):
+        self.backend._write(self.session, "delete", collection, str(doc_id), None, None)
+
+
+class SQLBackend(StorageBackend):
+    name = "sql"
+
+    def __init__(self, engine=None, session_factory=None):
+        self.engine = engine or default_engine
+        self.Session = session_factory or SessionLocal
+        if self.engine is None or self.Session is None:
+            raise RuntimeError("SQL backend selected but no database engine is configured")
+        self.models = {mapper.class_.__tablename__: mapper.class_ for mapper in models.Base.registry.mappers}
+        self._sync_schema()
+
+    def _sync_schema(self):
+        """create_all only creates missing tables; also add missing columns and indexes to old ones"""
+        models.Base.metadata.create_all(bind=self.engine)
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table in models.Base.metadata.sorted_tables:
+                existing = {col["name"] for col in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        col_type = column.type.compile(dialect=self.engine.dialect)
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+
+    # --- row helpers ---
+    def _model(self, collection):
+        model = self.models.get(collection)
+        return model if model is not None and collection != "documents" else None
+
+    @staticmethod
+    def _row_to_dict(row):
+        return {col.name: getattr(row, col.key) for col in row.__table__.columns}
+
+    def _get_row(self, session, collection, doc_id, for_update=False):
+        model = self._model(collection)
+        if model is not None:
+            try:
+                key = int(doc_id)
+            except (TypeError, ValueError):
+                return None
+            stmt = select(model).where(model.id == key)
+        else:
+            model = models.Document
+            stmt = select(model).where(model.collection == collection, model.doc_id == str(doc_id))
+        if for_update:
+            stmt = stmt.with_for_update()
+        return session.execute(stmt).scalars().first()
+
+    def _get(self, session, collection, doc_id, for_update=False):
+        row = self._get_row(session, collection, doc_id, for_update)
+        if row is None:
+            return None
+        if self._model(collection) is None:
+            return json.loads(row.data)
+        return self._row_to_dict(row)
+
+    def _write(self, session, op, collection, doc_id, data, merge):
+        model = self._model(collection)
+        row = self._get_row(session, collection, doc_id, for_update=True)
+        if op == "delete":
+            if row is not None:
+                session.delete(row)
+            return
+        if op == "update" and row is None:
+            raise NotFound(f"{collection}/{doc_id}")
+
+        if model is None:
+            # JSON document: merge in Python under the row lock
+            if op == "set" and not merge:
+                doc = resolve_set(data)
+            else:
+                doc = apply_fields(json.loads(row.data) if row is not None else {}, data, dotted=(op == "update"))
+            if row is None:
+                session.add(models.Document(collection=collection, doc_id=doc_id, data=json.dumps(doc)))
+            else:
+                row.data = json.dumps(doc)
+            return
+
+        columns = {col.key for col in model.__table__.columns}
+        if row is None:
+            row = model(id=int(doc_id))
+            session.add(row)
+        elif op == "set" and not merge:
+            for col in columns - {"id"}:
+                setattr(row, col, None)
+        for field, value in data.items():
+            if field not in columns or field == "id":
+                continue
+            if isinstance(value, Increment):
+                if op == "set" and not merge:
+                    value = value.value
+                elif inspect(row).persistent:
+                    # Let the database do "col = coalesce(col, 0) + n" so concurrent adds don't get lost
+                    value = func.coalesce(getattr(model, field), 0) + value.value
+                else:
+                    value = (getattr(row, field) or 0) + value.value
+            setattr(row, field, value)
+
+    def _statement(self, model, filters, order_by, limit, offset, start_after):
+        stmt = select(model)
+        for field, op, value in filters or ():
+            stmt = stmt.where(_SQL_OPS[op](getattr(model, field), value))
+        if order_by:
+            cols = [(getattr(model, field), direction) for field, direction in order_by]
+            if start_after is not None:
+                clauses = []
+                for i, (col, direction) in enumerate(cols):
+                    value = start_after.get(order_by[i][0])
+                    after = col < value if direction == DESCENDING else col > value
+                    equal = [prev == start_after.get(order_by[j][0]) for j, (prev, _) in enumerate(cols[:i])]
+                    clauses.append(and_(*equal, after))
+                stmt = stmt.where(or_(*clauses))
+            stmt = stmt.order_by(*[col.desc() if direction == DESCENDING else col.asc() for col, direction in cols])
+        if offset:
+            stmt = stmt.offset(offset)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
+
+    def _columns_known(self, model, fields):
+        columns = {col.key for col in model.__table__.columns}
+        return all(field in columns for field in fields)
+
+    # --- interface ---
+    def get(self, collection, doc_id):
+        with self.Session() as session:
+            return self._get(session, collection, doc_id)
+
+    def get_many(self, collection, doc_ids):
+        doc_ids = list(doc_ids)
+        model = self._model(collection)
+        if model is None or not doc_ids:
+            return super().get_many(collection, doc_ids)
+        with self.Session() as session:
+            rows = session.execute(select(model).where(model.id.in_([int(i) for i in doc_ids]))).scalars().all()
+            found = {row.id: self._row_to_dict(row) for row in rows}
+        return [found[int(i)] for i in doc_ids if int(i) in found]
+
+    def set(self, collection, doc_id, data, merge=False):
+        self._commit([("set", collection, str(doc_id), data, merge)])
+
+    def update(self, collection, doc_id, fields):
+        self._commit([("update", collection, str(doc_id), fields, None)])
+
+    def delete(self, collection, doc_id):
+        self._commit([("delete", collection, str(doc_id), None, None)])
+
+    def query(self, collection, filters=None, order_by=None, limit=None, offset=None, start_after=None, select=None):
+        model = self._model(collection)
+        fields = [f for f, _, _ in filters or ()] + [f for f, _ in order_by or ()]
+        with self.Session() as session:
+            if model is None or not self._columns_known(model, fields):
+                # No table (or a field the table lacks): filter in Python
+                if model is None:
+                    rows = session.execute(_select_documents(collection)).scalars().all()
+                    docs = [json.loads(row.data) for row in rows]
+                else:
+                    docs = [self._row_to_dict(row) for row in session.execute(_select_model(model)).scalars().all()]
+                return apply_query(docs, filters, order_by, limit, offset, start_after, select)
+            stmt = self._statement(model, filters, order_by, limit, offset, start_after)
+            docs = [self._row_to_dict(row) for row in session.execute(stmt).scalars().all()]
+        if select is not None:
+            docs = [{field: doc[field] for field in select if field in doc} for doc in docs]
+        return docs
+
+    def _commit(self, ops):
+        with self.Session() as session:
+            try:
+                for op, collection, doc_id, data, merge in ops:
+                    self._write(session, op, collection, doc_id, data, merge)
+                    session.flush()
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def run_transaction(self, fn):
+        with self.Session() as session:
+            try:
+                result = fn(_SQLTransaction(self, session))
+                session.commit()
+                return result
+            except Exception:
+                session.rollback()
+                raise
+
+    def join(self, collection, foreign_key, parent_collection, filters=None, order_by=None, limit=None):
+        child, parent = self._model(collection), self._model(parent_collection)
+        fields = [f for f, _, _ in filters or ()] + [f for f, _ in order_by or ()]
+        if child is None or parent is None or not self._columns_known(child, fields):
+            return super().join(collection, foreign_key, parent_collection, filters, order_by, limit)
+        stmt = self._statement(child, filters, order_by, limit, None, None)
+        stmt = stmt.add_columns(parent).outerjoin(parent, getattr(child, foreign_key) == parent.id)
+        with self.Session() as session:
+            return [
+                (self._row_to_dict(c), self._row_to_dict(p) if p is not None else None)
+                for c, p in session.execute(stmt).all()
+            ]
+
+
+# query() takes a `select` argument that shadows sqlalchemy.select inside it
+def _select_documents(collection):
+    return select(models.Document).where(models.Document.collection == collection)
+
+
+def _select_model(model):
+    return select(model)
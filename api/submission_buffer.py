@@ -0,0 +1,182 @@
+"""
+Write-behind buffer for test submissions.
+
+When a whole batch finishes a timed test together, writing every attempt as it comes
+in means hundreds of synchronous writes in the same second. With SUBMISSION_BUFFER=jsonl
+submit_test still scores immediately (from the cached answer key) and returns the
+result, but the attempt document is appended to a local JSON-lines file instead and
+flushed to `test_attempts` in WriteBatches:
+
+- when FLUSH_SIZE attempts are pending, or the oldest has waited FLUSH_INTERVAL seconds
+  (in a background thread, so the submitting request doesn't wait);
+- on POST /api/test-attempts/flush, and before attempts are listed or regraded;
+- at process exit.
+
+Listeners registered with on_write() get each flushed group of documents, so
+rollups (leaderboards) are updated once per flush rather than once per attempt.
+
+Attempt ids are allocated before buffering, so replaying a file after a crash
+rewrites the same documents rather than duplicating them. Flushing renames the file
+to `<path>.flushing` first; a leftover `.flushing` file from a crashed flush is
+replayed before anything newer. Listeners run before the file is removed, so a crash
+can only repeat them, never skip them; on a replay they are called with replay=True
+and must not re-apply anything that isn't idempotent (item stats are marked stale).
+
+The file is per process: only enable this on instances with a persistent disk that
+live long enough to flush (not short-lived serverless functions).
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional
+
+from jobs import BATCH_LIMIT
+
+MODE = os.environ.get("SUBMISSION_BUFFER", "").lower()  # "" writes through, "jsonl" buffers
+PATH = os.environ.get("SUBMISSION_BUFFER_PATH", os.path.join(tempfile.gettempdir(), "linear_academy_submissions.jsonl"))
+FLUSH_SIZE = int(os.environ.get("SUBMISSION_FLUSH_SIZE", 200))
+FLUSH_INTERVAL = float(os.environ.get("SUBMISSION_FLUSH_INTERVAL", 10))
+
+_listeners: List[Callable[[List[dict], bool], None]] = []
+
+
+def on_write(listener: Callable[[List[dict], bool], None]):
+    """Register a callback run with the documents of every completed flush and whether
+    they are a replay (they may have been passed to the listener before)"""
+    _listeners.append(listener)
+
+
+class JsonlBuffer:
+    def __init__(self, path: str, collection: str = "test_attempts"):
+        self.path = path
+        self.collection = collection
+        self._flushing_path = path + ".flushing"
+        self._lock = threading.Lock()  # guards the file being appended to
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._pending = self._count(path) + self._count(self._flushing_path)
+        self._oldest = time.monotonic() if self._pending else None
+        self._flusher: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _count(path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+
+    def append(self, record: dict):
+        """Durably record one document (fsync'd before returning)"""
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def pending(self) -> int:
+        return self._pending
+
+    def due(self) -> bool:
+        if not self._pending:
+            return False
+        return self._pending >= FLUSH_SIZE or time.monotonic() - self._oldest >= FLUSH_INTERVAL
+
+    def _write_file(self, store, path: str, replay: bool = False) -> int:
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # torn last line from a crash mid-append
+        batch = store.batch()
+        written_at = time.time()
+        for record in records:
+            # When it reached the collection (not when it was buffered); see item_stats.RebuildJob
+            record["written_at"] = written_at
+            batch.set(self.collection, record["id"], record)
+            if len(batch) == BATCH_LIMIT:
+                batch.commit()
+        batch.commit()
+        for listener in _listeners:
+            try:
+                listener(records, replay)
+            except Exception as e:
+                print(f"Submission buffer listener failed: {e}")
+        os.remove(path)
+        return len(records)
+
+    def flush(self, store) -> int:
+        """Write everything buffered so far to the store; returns the number of documents"""
+        with self._flush_lock:
+            written = 0
+            if os.path.exists(self._flushing_path):
+                # Left by a flush that failed or crashed, possibly after its listeners ran
+                written += self._write_file(store, self._flushing_path, replay=True)
+            with self._lock:
+                if not os.path.exists(self.path):
+                    self._pending, self._oldest = 0, None
+                    return written
+                os.replace(self.path, self._flushing_path)
+                self._pending, self._oldest = 0, None
+            try:
+                return written + self._write_file(store, self._flushing_path)
+            except Exception:
+                # Left in place for the next flush; count it as pending again
+                with self._lock:
+                    self._pending += self._count(self._flushing_path)
+                    self._oldest = self._oldest or time.monotonic()
+                raise
+
+    def maybe_flush(self, store):
+        """Start a background flush if enough has built up and none is running"""
+        if not self.due() or (self._flusher is not None and self._flusher.is_alive()):
+            return
+
+        def _run():
+            try:
+                self.flush(store)
+            except Exception as e:
+                print(f"Submission buffer flush failed, will retry: {e}")
+
+        self._flusher = threading.Thread(target=_run, name="submission-flush", daemon=True)
+        self._flusher.start()
+
+
+_buffer: Optional[JsonlBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> Optional[JsonlBuffer]:
+    """The process-wide buffer, or None when submissions are written through"""
+    global _buffer
+    if MODE != "jsonl":
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = JsonlBuffer(PATH)
+    return _buffer
+
+
+def flush(store) -> int:
+    buffer = get_buffer()
+    return buffer.flush(store) if buffer is not None else 0
+
+
+def _flush_at_exit():
+    if _buffer is not None and _buffer.pending():
+        try:
+            import storage
+            _buffer.flush(storage.get_backend())
+        except Exception as e:
+            print(f"Submission buffer not flushed at exit, kept at {_buffer.path}: {e}")
+
+
+atexit.register(_flush_at_exit)
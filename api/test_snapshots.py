@@ -0,0 +1,212 @@
+"""
+Published test snapshots.
+
+Loading a test for a student used to cost a read of the test plus a query over its
+questions. When a test is published (or edited while published) we instead write one
+snapshot document, `test_snapshots/<test_id>`, holding the test metadata and all of its
+questions packed column-wise ({"id": [...], "question_text": [...], ...}; Firestore
+doesn't allow arrays of arrays). A student load is then a single document read.
+
+Snapshots hold the student view only: no correct_option or explanation. Those go into
+a compact answer key per version, `answer_keys/<test_id>_v<version>`, which never
+leaves the server and is what submissions are scored against. The previous version's
+key is kept so attempts started just before an edit still score.
+
+Question edits don't rebuild the snapshot (that re-reads the whole bank); they count
+an edit on the head, and the first load after that rebuilds it. Test edits and
+publishing rebuild straight away.
+
+Snapshots are immutable: every rebuild gets the next version number and replaces the
+head document. The number is allocated in the transaction that writes the head and
+its answer key, and only if the head is still the one the build started from; a build
+that lost a race with another one retries on top of it, so two builds never share a
+version. Banks too big for one document (Firestore caps documents at 1 MiB) spill
+their columns into chunk documents `<test_id>_<build id>_<n>` that the head lists;
+those are written before the head and the previous version's chunks are deleted after
+it, so readers never see a half-built snapshot.
+"""
+import datetime
+import json
+import uuid
+from typing import List, Optional
+
+from storage import Increment
+
+SNAPSHOTS_COLLECTION = "test_snapshots"
+CHUNKS_COLLECTION = "test_snapshot_chunks"
+ANSWER_KEYS_COLLECTION = "answer_keys"
+MAX_INLINE_BYTES = 800 * 1024  # leave room under the 1 MiB document limit
+CHUNK_SIZE = 200  # questions per chunk document
+BUILD_ATTEMPTS = 3  # builds that lose to a concurrent one retry this many times in all
+
+# What a student sees of a question
+STUDENT_FIELDS = (
+    "id", "question_text", "question_image_url", "option_a", "option_b", "option_c",
+    "option_d", "marks", "order_index",
+)
+
+
+def pack_questions(questions: List[dict]) -> dict:
+    return {field: [q.get(field) for q in questions] for field in STUDENT_FIELDS}
+
+
+def unpack_questions(packed: dict, test_id: int) -> List[dict]:
+    columns = [packed.get(field) or [] for field in STUDENT_FIELDS]
+    count = len(columns[0])
+    return [
+        {**{field: column[i] if i < len(column) else None for field, column in zip(STUDENT_FIELDS, columns)},
+         "test_id": test_id}
+        for i in range(count)
+    ]
+
+
+def build_answer_key(test_id: int, version: Optional[int], questions: List[dict]) -> dict:
+    """Column-wise answer key: ids, lower-cased correct options, marks and explanations"""
+    return {
+        "test_id": test_id,
+        "version": version,
+        "ids": [q.get("id") for q in questions],
+        "correct": [(q.get("correct_option") or "").lower() for q in questions],
+        "marks": [q.get("marks", 1) or 0 for q in questions],
+        "explanations": [q.get("explanation") for q in questions],
+    }
+
+
+def _key_id(test_id: int, version: int) -> str:
+    return f"{test_id}_v{version}"
+
+
+def load_answer_key(store, test_id: int, version: int) -> Optional[dict]:
+    return store.get(ANSWER_KEYS_COLLECTION, _key_id(test_id, version))
+
+
+def _size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class _Superseded(Exception):
+    """Another build replaced the head after this one read it"""
+
+
+def build(store, test_id: int) -> Optional[dict]:
+    """Write a new snapshot version from the live test and questions; None if the test is gone"""
+    for _ in range(BUILD_ATTEMPTS):
+        try:
+            return _build(store, test_id)
+        except _Superseded:
+            continue
+    # Still racing other builds; the head they installed is at least as new as ours
+    return store.get(SNAPSHOTS_COLLECTION, test_id)
+
+
+def _build(store, test_id: int) -> Optional[dict]:
+    test = store.get("mcq_tests", test_id)
+    if test is None:
+        return None
+    # Read before the questions, so an edit made while we build still marks the result stale
+    previous = store.get(SNAPSHOTS_COLLECTION, test_id) or {}
+    questions = store.query("mcq_questions", filters=[("test_id", "==", test_id)])
+    questions.sort(key=lambda x: x.get("order_index", 0))
+
+    head = {
+        "test_id": test_id,
+        "published": True,
+        "built_at": datetime.datetime.now().isoformat(),
+        "test": test,
+        "question_count": len(questions),
+        "chunks": [],
+        "built_edits": previous.get("edits", 0),
+    }
+    key = build_answer_key(test_id, None, questions)
+
+    packed = pack_questions(questions)
+    if _size(packed) <= MAX_INLINE_BYTES:
+        head["questions"] = packed
+    else:
+        # Named per build, as the version isn't known until the head is written
+        build_id = uuid.uuid4().hex[:12]
+        batch = store.batch()
+        for n, start in enumerate(range(0, len(questions), CHUNK_SIZE)):
+            chunk_id = f"{test_id}_{build_id}_{n}"
+            batch.set(CHUNKS_COLLECTION, chunk_id, {"questions": pack_questions(questions[start:start + CHUNK_SIZE])})
+            head["chunks"].append(chunk_id)
+        batch.commit()
+
+    def _write_head(txn):
+        current = txn.get(SNAPSHOTS_COLLECTION, test_id) or {}
+        if current.get("version", 0) != previous.get("version", 0):
+            raise _Superseded()
+        version = previous.get("version", 0) + 1
+        head["version"] = key["version"] = version
+        head["edits"] = current.get("edits", 0)
+        # The key has to exist before any reader can see this version
+        txn.set(ANSWER_KEYS_COLLECTION, _key_id(test_id, version), key)
+        txn.set(SNAPSHOTS_COLLECTION, test_id, head)
+        return version
+
+    try:
+        version = store.run_transaction(_write_head)
+    except _Superseded:
+        _delete_chunks(store, head)
+        raise
+    _delete_chunks(store, previous)
+    if version > 2:
+        store.delete(ANSWER_KEYS_COLLECTION, _key_id(test_id, version - 2))
+    return head
+
+
+def mark_stale(store, test_id: int):
+    """A question changed: count the edit on the head instead of rebuilding (one write).
+    load() then treats the snapshot as missing, so the next reader rebuilds it."""
+    store.set(SNAPSHOTS_COLLECTION, test_id, {"test_id": test_id, "edits": Increment(1)}, merge=True)
+
+
+def is_stale(head: Optional[dict]) -> bool:
+    return bool(head) and head.get("edits", 0) > head.get("built_edits", 0)
+
+
+def _delete_chunks(store, head: Optional[dict]):
+    chunk_ids = (head or {}).get("chunks") or []
+    if chunk_ids:
+        batch = store.batch()
+        for chunk_id in chunk_ids:
+            batch.delete(CHUNKS_COLLECTION, chunk_id)
+        batch.commit()
+
+
+def load(store, test_id: int) -> Optional[dict]:
+    """{"version", "test", "questions"} from the current snapshot, or None if there isn't one
+    (or its questions were edited since it was built)"""
+    head = store.get(SNAPSHOTS_COLLECTION, test_id)
+    if head is None or not head.get("published") or is_stale(head):
+        return None
+    if head.get("chunks"):
+        questions = []
+        for chunk in store.get_many(CHUNKS_COLLECTION, head["chunks"]):
+            questions.extend(unpack_questions(chunk.get("questions") or {}, test_id))
+    else:
+        questions = unpack_questions(head.get("questions") or {}, test_id)
+    return {"version": head.get("version"), "test": head.get("test"), "questions": questions}
+
+
+def _delete_keys(store, head: dict):
+    for version in (head.get("version", 0), head.get("version", 0) - 1):
+        if version > 0:
+            store.delete(ANSWER_KEYS_COLLECTION, _key_id(head.get("test_id"), version))
+
+
+def retract(store, test_id: int):
+    """Unpublish: drop the content but keep the version number, so versions never repeat"""
+    head = store.get(SNAPSHOTS_COLLECTION, test_id)
+    if head is not None and head.get("published"):
+        store.set(SNAPSHOTS_COLLECTION, test_id, {"test_id": test_id, "version": head.get("version", 0), "published": False})
+        _delete_chunks(store, head)
+        _delete_keys(store, head)
+
+
+def delete(store, test_id: int):
+    head = store.get(SNAPSHOTS_COLLECTION, test_id)
+    if head is not None:
+        store.delete(SNAPSHOTS_COLLECTION, test_id)
+        _delete_chunks(store, head)
+        _delete_keys(store, head)
@@ -87,9 +87,14 @@ const TakeTest = () => {
                 student_name: studentInfo.name || 'Anonymous',
                 student_email: studentInfo.email || null,
                 student_phone: studentInfo.phone || null,
-                answers_json: JSON.stringify(answers)
+                answers_json: JSON.stringify(answers),
+                test_version: test?.version ?? null,
+                attempt_token: test?.attempt_token ?? null
             }, timeTaken);
 
+            // Correct options and explanations only arrive with the result
+            const review = res.data.review || {};
+            setQuestions(prev => prev.map(q => ({ ...q, ...(review[q.id] || {}) })));
             setResult(res.data);
             setTestSubmitted(true);
         } catch (error) {
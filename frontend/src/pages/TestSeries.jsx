@@ -25,10 +25,11 @@ const TestSeries = () => {
         // No auto-load for classes anymore, Board selection first
     }, []);
 
-    const loadClasses = async (board) => {
+    // One request for the board's whole class -> subject -> series -> test tree
+    const loadCatalog = async (board) => {
         setLoading(true);
         try {
-            const res = await endpoints.getClasses(board);
+            const res = await endpoints.getCatalog(board);
             setClasses(res.data);
         } catch (error) {
             console.error(error);
@@ -37,61 +38,37 @@ const TestSeries = () => {
         }
     };
 
-    const loadSubjects = async (classId, board) => {
+    const loadSeriesPdfs = async (seriesId) => {
         try {
-            const res = await endpoints.getSubjectsByClass(classId, board);
-            setSubjects(res.data);
+            const res = await endpoints.getPDFsByTestSeries(seriesId);
+            setPdfs(res.data);
         } catch (error) {
-            console.error(error);
-        }
-    };
-
-    const loadTestSeries = async (subjectId) => {
-        try {
-            const res = await endpoints.getTestSeriesBySubject(subjectId);
-            setTestSeries(res.data);
-        } catch (error) {
-            console.error(error);
-        }
-    };
-
-    const loadSeriesContent = async (seriesId) => {
-        try {
-            console.log('Loading content for series ID:', seriesId);
-            const [pdfsRes, testsRes] = await Promise.all([
-                endpoints.getPDFsByTestSeries(seriesId),
-                endpoints.getTestsByTestSeries(seriesId)
-            ]);
-            console.log('PDFs response:', pdfsRes.data);
-            console.log('Tests response:', testsRes.data);
-            setPdfs(pdfsRes.data);
-            setTests(testsRes.data);
-        } catch (error) {
-            console.error('Error loading series content:', error);
+            console.error('Error loading series PDFs:', error);
         }
     };
 
     const handleBoardSelect = (board) => {
         setSelectedBoard(board);
-        loadClasses(board);
+        loadCatalog(board);
     };
 
     const handleClassSelect = (cls) => {
         setSelectedClass(cls);
         setSelectedSubject(null);
         setSelectedSeries(null);
-        loadSubjects(cls.id, selectedBoard);
+        setSubjects(cls.subjects || []);
     };
 
     const handleSubjectSelect = (subject) => {
         setSelectedSubject(subject);
         setSelectedSeries(null);
-        loadTestSeries(subject.id);
+        setTestSeries(subject.test_series || []);
     };
 
     const handleSeriesSelect = (series) => {
         setSelectedSeries(series);
-        loadSeriesContent(series.id);
+        setTests(series.tests || []);
+        loadSeriesPdfs(series.id);
     };
 
     const handleBack = () => {
@@ -611,8 +611,13 @@ const TestSeriesManager = () => {
 
     const handleDeleteSeries = async (id) => {
         if (!confirm('Delete this test series and all its content?')) return;
-        await endpoints.deleteTestSeries(id);
-        if (selectedSeries?.id === id) setSelectedSeries(null);
+        try {
+            await endpoints.deleteTestSeries(id);
+            if (selectedSeries?.id === id) setSelectedSeries(null);
+        } catch (error) {
+            console.error('Failed to delete series:', error);
+            alert('Failed to delete series: ' + (error.response?.data?.detail || error.message));
+        }
         loadSeries();
     };
 
@@ -22,6 +22,27 @@ api.interceptors.request.use(
     (error) => Promise.reject(error)
 );
 
+// Cascade deletes answer 202 while work remains; keep calling until the server reports done,
+// but give up if it stops making progress or takes too many calls
+const MAX_DELETE_CALLS = 20;
+const MAX_STALLED_DELETE_CALLS = 2;
+
+const deleteUntilDone = async (url) => {
+    let res = await api.delete(url);
+    let calls = 1;
+    let stalled = 0;
+    while (res.status === 202) {
+        const deleted = Object.values(res.data?.deleted || {}).reduce((sum, n) => sum + n, 0);
+        stalled = deleted > 0 ? 0 : stalled + 1;
+        if (stalled >= MAX_STALLED_DELETE_CALLS || calls >= MAX_DELETE_CALLS) {
+            throw new Error(`Deletion is not finishing (job ${res.data?.job_id}); try again later`);
+        }
+        res = await api.delete(url);
+        calls += 1;
+    }
+    return res;
+};
+
 export const endpoints = {
     // Config
     getConfig: () => api.get('/config'),
@@ -57,6 +78,9 @@ export const endpoints = {
 
     // ================== TEST SERIES ==================
 
+    // Full class -> subject -> series -> test tree in one request
+    getCatalog: (board = null) => api.get(`/catalog${board ? `?board=${board}` : ''}`),
+
     // Academic Classes
     getClasses: (board = null) => api.get(`/classes${board ? `?board=${board}` : ''}`),
     getClass: (id) => api.get(`/classes/${id}`),
@@ -73,7 +97,7 @@ export const endpoints = {
     getAllTestSeries: () => api.get('/test-series'),
     getTestSeries: (id) => api.get(`/test-series/${id}`),
     createTestSeries: (data) => api.post('/test-series', data),
-    deleteTestSeries: (id) => api.delete(`/test-series/${id}`),
+    deleteTestSeries: (id) => deleteUntilDone(`/test-series/${id}`),
 
     // PDF Resources
     getPDFsByTestSeries: (seriesId) => api.get(`/test-series/${seriesId}/pdfs`),
@@ -88,11 +112,12 @@ export const endpoints = {
     getTestForAdmin: (id) => api.get(`/tests/${id}?admin=true`),  // Returns ALL questions for admin
     createTest: (data) => api.post('/tests', data),
     updateTest: (id, data) => api.put(`/tests/${id}`, data),
-    deleteTest: (id) => api.delete(`/tests/${id}`),
+    deleteTest: (id) => deleteUntilDone(`/tests/${id}`),
 
     // MCQ Questions
     getQuestionsByTest: (testId) => api.get(`/tests/${testId}/questions`),
     createQuestion: (data) => api.post('/questions', data),
+    createQuestionsBulk: (testId, questions) => api.post(`/tests/${testId}/questions:bulk`, { questions }),
     updateQuestion: (id, data) => api.put(`/questions/${id}`, data),
     deleteQuestion: (id) => api.delete(`/questions/${id}`),
 
@@ -115,7 +140,7 @@ export const endpoints = {
     generateMCQ: (data) => api.post('/generate-mcq', data, { timeout: 60000 }),
     getGeneratedTests: () => api.get('/generated-tests'),
     publishGeneratedTest: (id) => api.post(`/generated-tests/${id}/publish`),
-    deleteGeneratedTest: (id) => api.delete(`/generated-tests/${id}`),
+    deleteGeneratedTest: (id) => deleteUntilDone(`/generated-tests/${id}`),
     flipMCQ: (id, data) => api.post(`/questions/${id}/flip`, data, { timeout: 30000 }),
 
     // Question Bank
@@ -0,0 +1,24 @@
+"""
+One-off migration: set grade_value on students written before it existed.
+
+The toppers listing orders by grade_value, so students without it are left out until
+this (or POST /api/students/backfill-grades) has run. Safe to run again; only
+students whose grade_value differs from their rank are written.
+
+    STORAGE_BACKEND=firestore python scripts/backfill_student_grades.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import crud
+
+
+def main():
+    updated = crud.backfill_student_grades(None)
+    print(f"Updated grade_value on {updated} students")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Throughput of the batch scoring engine (api/scoring.py).
+
+Scores N synthetic attempts against a synthetic bank, once through the vectorised
+path and once through the per-question Python loop (what runs without NumPy), and
+checks they agree.
+
+    python scripts/bench_scoring.py --attempts 10000 --questions 50
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import scoring
+
+
+def make_key(questions: int, rng: random.Random) -> dict:
+    return {
+        "version": 1,
+        "ids": list(range(1, questions + 1)),
+        "correct": [rng.choice("abcd") for _ in range(questions)],
+        "marks": [rng.choice([1, 1, 2, 4]) for _ in range(questions)],
+    }
+
+
+def make_attempts(key: dict, count: int, rng: random.Random) -> list:
+    attempts = []
+    for _ in range(count):
+        # ~85% answered, ~60% of those right
+        answers = {}
+        for q_id, correct in zip(key["ids"], key["correct"]):
+            if rng.random() < 0.85:
+                answers[str(q_id)] = correct if rng.random() < 0.6 else rng.choice("abcd")
+        attempts.append(answers)
+    return attempts
+
+
+def run(label, fn, count):
+    start = time.perf_counter()
+    results = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed * 1000:9.1f} ms   {count / elapsed:12,.0f} attempts/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attempts", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    key = make_key(args.questions, rng)
+    attempts = make_attempts(key, args.attempts, rng)
+    compiled = scoring.compile_key(key)
+    print(f"{args.attempts:,} attempts x {args.questions} questions, numpy={'yes' if scoring.np is not None else 'no'}")
+
+    rows = run("encode", lambda: [scoring.encode(compiled, a) for a in attempts], args.attempts)
+    vectorised = run("score", lambda: scoring.score_encoded(compiled, rows), args.attempts)
+    looped = run("score (loop)", lambda: [scoring._score_row(compiled, row) for row in rows], args.attempts)
+    run("end to end", lambda: scoring.score_many(compiled, attempts), args.attempts)
+    assert vectorised == looped, "vectorised and loop scores disagree"
+    print("results match")
+
+
+if __name__ == "__main__":
+    main()